@@ -0,0 +1,110 @@
+
+# 渲染流程各阶段的微基准测试，用法：python benchmark_rendering.py [重复次数]
+
+import asyncio
+import os
+import sys
+import timeit
+
+from utilities import Vector2D
+from mika_screen import GameScreen
+from mika_terminal import TerminalGameScreen
+from styleml.core import StyleMLCoreParser, ReturnCharExtParser
+from styleml.portal_ext import PortalExtParser
+from styleml.macro_ext import MacroExtParser
+from styleml.convenient_argument import parse_convenient_dict
+from styleml_mika_exts import StyleExtParser, AnimationExtParser, LineWrapExtParser, AffineTransformExtParser, RowLayout
+from styleml_glyph_exts import GlyphsetExtParser
+
+text = r"""
+\def[hl=\\s\[fg=gold\]]\
+\tick[:0.1]Behold\delay[:0.5], here I am!\delay[:1.0]
+The {\s[bg=gray]Most {\!hl \tick[:0.4]ALMIGHTY} and {\s[fg=red]\tick[:0.4]POWERFUL}}
+{\s[bg=red]Dragon} in this Kingdom! 这是一段比较长的中文文字，用来测试换行。
+""" * 20
+
+parser = StyleMLCoreParser(ext_parser=[
+    PortalExtParser(),
+    GlyphsetExtParser(),
+    AnimationExtParser(initial_tick=0.03),
+    StyleExtParser(),
+    ReturnCharExtParser()
+])
+fused_parser = StyleMLCoreParser(ext_parser=parser.ext_parser, fused=True)
+macro_parser = MacroExtParser()
+line_wrap = LineWrapExtParser(Vector2D(25, 0), only_printable=False)
+streaming_line_wrap = LineWrapExtParser(Vector2D(25, 0), only_printable=False, streaming=True)
+affine = AffineTransformExtParser(origin=Vector2D(0, 16))
+screen = GameScreen(dim=Vector2D(40, 2000))
+terminal = TerminalGameScreen(dim=Vector2D(40, 2000), out=open(os.devnull, "w"))
+
+tokens = parser.tokenize(text)
+expanded = macro_parser.transformer(tokens)
+transformed = parser.transform(expanded)
+rendered = parser.render(transformed)
+wrapped = line_wrap.post_renderer(rendered)
+positioned = affine.post_renderer(wrapped)
+
+class InstantWaiter:
+    "跳过动画时的waiter"
+    instant = True
+    interrupted = False
+
+    async def __call__(self, time, t=None):
+        return True
+
+def place_all(layout):
+    "只计算换行布局，不生成换行后的token"
+    place = layout.place
+    for i, t in enumerate(rendered):
+        x, y = t.meta["pos"]
+        place(i, x, y, line_wrap.token_kind(t))
+    layout.truncate(len(rendered))
+
+class ImmediateWaiter:
+    "不跳过动画，但每次等待都立即返回，用来比较逐个等待字符的开销"
+    async def __call__(self, time, t=None):
+        return True
+
+vectors = [Vector2D(i, i * 2) for i in range(1000)]
+mati, matj, delta = Vector2D(1, 0), Vector2D(0, 1), Vector2D(5, 5)
+
+stages = {
+    "vector new": lambda: [Vector2D(i, i) for i in range(1000)],
+    "vector add": lambda: [v + delta for v in vectors],
+    "vector affine": lambda: [v.affine_transform(mati, matj, delta) for v in vectors],
+    "convenient dict": lambda: [parse_convenient_dict("fg=red,bg=!hl,bold+,col;3", {"hl": "gold"}) for _ in range(1000)],
+    "tokenize": lambda: parser.tokenize(text),
+    "macro expand": lambda: macro_parser.transformer(tokens),
+    "transform": lambda: parser.transform(expanded),
+    "render": lambda: parser.render(transformed),
+    "transform + render": lambda: parser.transform_and_render(expanded),
+    "fused transform + render": lambda: fused_parser.transform_and_render(expanded),
+    "line wrap": lambda: LineWrapExtParser(Vector2D(25, 0), only_printable=False).post_renderer(rendered),
+    "line wrap (cached layout)": lambda: line_wrap.post_renderer(rendered),
+    # 缓存省下的是布局的计算，给token加上新位置（with_meta）的部分每次都要做
+    "row layout": lambda: place_all(RowLayout(columns=25)),
+    "row layout (cached)": lambda: place_all(line_wrap.get_layout()),
+    "streaming line wrap": lambda: list(streaming_line_wrap.stream_post_renderer(rendered)),
+    "word wrap": lambda: LineWrapExtParser(Vector2D(25, 0), only_printable=False, word_wrap=True).post_renderer(rendered),
+    "affine transform": lambda: affine.post_renderer(wrapped),
+    "print tokens": lambda: screen.print_tokens(positioned, Vector2D(0, 0)),
+    # 异步打印包括asyncio.run本身的开销（约0.2ms），跳过动画时省下的是逐个等待字符
+    "print tokens (instant)": lambda: asyncio.run(screen.async_print_tokens(positioned, Vector2D(0, 0), waiter=InstantWaiter())),
+    "print tokens (await each)": lambda: asyncio.run(screen.async_print_tokens(positioned, Vector2D(0, 0), waiter=ImmediateWaiter())),
+    "terminal frame": lambda: (terminal.begin(), terminal.print_tokens(positioned, Vector2D(0, 0)), terminal.flush()),
+    # 内容没变时只需要比较，不输出
+    "terminal frame (diff)": lambda: (terminal.clear_screen(), terminal.print_tokens(positioned, Vector2D(0, 0)), terminal.flush()),
+    # 流式处理时，第一个字符可以输出之前需要的时间
+    "first token": lambda: line_wrap.post_renderer(parser.render(parser.transform(expanded)))[0],
+    "first token (streaming)": lambda: next(iter(streaming_line_wrap.stream_post_renderer(
+        fused_parser.stream_transform_and_render(expanded)
+    ))),
+}
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{len(text)} characters, {len(positioned)} tokens")
+    for name, f in stages.items():
+        t = min(timeit.repeat(f, number=number, repeat=3)) / number
+        print(f"{name:>26}: {t * 1000:8.3f}ms")
@@ -0,0 +1,12 @@
+
+# 为了加快启动速度（特别是在pyodide中），预先把所有对话模块解析好并打包
+
+import mika_modules
+import mika_module_bundle
+
+root = "resources/modules"
+
+modules = mika_modules.walk_modules(root)
+
+with open("modules_bundle.bin", "wb") as f:
+    f.write(mika_module_bundle.compile_bundle(root, modules))
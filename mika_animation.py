@@ -0,0 +1,199 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import attr
+
+# 所有动画共用一个计时器：等待中的动画只是堆中的一个唤醒时间，不再为每个字符创建sleep和event两个task
+# 中断和跳过通过waiter上的标志和立即完成其future实现
+
+@attr.s
+class AnimationScheduler:
+    """
+    按唤醒时间排序的堆，由一个驱动循环唤醒到期的动画，两次唤醒之间至少间隔frame_time
+    clock和sleep可以替换成FakeClock，这样测试时不需要真正等待
+    """
+    clock = attr.ib(default=time.monotonic)
+    sleep = attr.ib(default=asyncio.sleep)
+    frame_time = attr.ib(default=1 / 60)
+    heap = attr.ib(factory=list, init=False) # (唤醒时间, 序号, future)
+    counter = attr.ib(factory=itertools.count, init=False)
+    driver = attr.ib(default=None, init=False) # 驱动循环的task
+    driver_target = attr.ib(default=None, init=False) # 驱动循环下次醒来的时间
+    last_tick = attr.ib(default=float("-inf"), init=False)
+    ticks = attr.ib(default=0, init=False) # 驱动循环醒来的次数
+
+    def wait(self, delay):
+        "返回一个future，delay秒后完成，结果为True；被提前结束（参见Waiter.wake）时结果为False"
+        return self.wait_until(self.clock() + delay)
+
+    def wait_until(self, deadline):
+        future = asyncio.get_running_loop().create_future()
+        if deadline <= self.clock():
+            future.set_result(True)
+            return future
+        heapq.heappush(self.heap, (deadline, next(self.counter), future))
+        self._ensure_driver(deadline)
+        return future
+
+    def _ensure_driver(self, deadline):
+        if self.driver is not None and not self.driver.done():
+            # driver_target为None时驱动循环还没有开始运行，开始时会看到新的唤醒时间
+            if self.driver_target is None or max(deadline, self.last_tick + self.frame_time) >= self.driver_target:
+                return
+            self.driver.cancel() # 驱动循环会醒得太晚，重新开始
+        self.driver_target = None
+        self.driver = asyncio.ensure_future(self._drive())
+
+    def tick(self, now=None):
+        "唤醒到期的动画，返回下一个唤醒时间，没有等待中的动画时返回None"
+        now = self.clock() if now is None else now
+        self.last_tick = now
+        self.ticks += 1
+        heap = self.heap
+        while heap and (heap[0][0] <= now or heap[0][2].done()):
+            future = heapq.heappop(heap)[2]
+            if not future.done():
+                future.set_result(True)
+        return heap[0][0] if heap else None
+
+    async def _drive(self):
+        while self.heap:
+            self.driver_target = max(self.heap[0][0], self.last_tick + self.frame_time)
+            await self.sleep(self.driver_target - self.clock())
+            if self.tick() is None:
+                await asyncio.sleep(0) # 被唤醒的动画通常马上又会等待，不必为此结束驱动循环
+
+    @property
+    def pending(self):
+        "等待中的动画数"
+        return sum(1 for _, _, future in self.heap if not future.done())
+
+@attr.s
+class FakeClock:
+    "测试用的时钟，sleep时不真正等待，而是直接把时间拨到醒来的时刻"
+    now = attr.ib(default=0.0)
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        await asyncio.sleep(0) # 先让其他协程运行，它们可能要求更早醒来（取消这次sleep），此时时间不前进
+        self.now += max(delay, 0)
+
+@attr.s
+class Waiter:
+    """
+    作为GameScreen.async_print_tokens的waiter，等待通过scheduler进行
+    instant为True时不再等待，interrupted为True时结束动画；修改后调用wake()使正在进行的等待立即结束
+    """
+    scheduler = attr.ib(factory=AnimationScheduler)
+    interrupted = attr.ib(default=False)
+    instant = attr.ib(default=False)
+    pending = attr.ib(default=None, init=False)
+    timeline = attr.ib(default=None, init=False) # 上次等待按时结束的时刻，下次从这里开始计时，按帧唤醒的误差不会累积
+
+    async def __call__(self, time, t=None):
+        if self.interrupted:
+            return False
+        if self.instant:
+            return True
+        scheduler = self.scheduler
+        start = scheduler.clock()
+        if self.timeline is not None:
+            start = max(self.timeline, start - scheduler.frame_time)
+        deadline = start + max(time, 0)
+        self.pending = scheduler.wait_until(deadline)
+        try:
+            on_time = await self.pending
+        finally:
+            self.pending = None
+        self.timeline = deadline if on_time else None
+        return not self.interrupted
+
+    def wake(self):
+        if self.pending is not None and not self.pending.done():
+            self.pending.set_result(False)
+
+    def skip(self):
+        "跳过动画，剩下的部分立即显示"
+        self.instant = True
+        self.wake()
+
+    def interrupt(self):
+        self.interrupted = True
+        self.wake()
+
+@attr.s
+class AnimationWrapper:
+    task = attr.ib(default=None)
+    ongoing = attr.ib(default=False)
+    finished = attr.ib(default=False)
+    finished_event = attr.ib(factory=asyncio.Event)
+    meta = attr.ib(factory=dict)
+
+    async def wrapper_task(self):
+        try:
+            self.ongoing = True
+            await asyncio.create_task(self.task)
+            self.finished = True
+            self.finished_event.set()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            import sys
+            sys.exit(1)
+
+    def start(self):
+        return asyncio.create_task(self.wrapper_task())
+
+@attr.s
+class AnimationManager:
+    "正在进行的动画，它们的waiter共用同一个scheduler"
+    pool = attr.ib(factory=dict)
+    next_id = attr.ib(default=0)
+    scheduler = attr.ib(factory=AnimationScheduler)
+
+    def new_waiter(self, cls=Waiter, **kwargs):
+        return cls(scheduler=self.scheduler, **kwargs)
+
+    def add_animation(self, anim):
+        this_id = self.next_id
+        self.pool[this_id] = anim
+        self.next_id += 1
+        return this_id
+
+    async def pool_wrapper(self, anim_id):
+        await self.pool[anim_id].start()
+        self.pool.pop(anim_id)
+
+    def start_animation(self, anim_id):
+        return asyncio.create_task(self.pool_wrapper(anim_id))
+
+if __name__ == "__main__":
+    # 用FakeClock模拟三个同时进行的打字动画，不需要真正等待
+    clock = FakeClock()
+    manager = AnimationManager(scheduler=AnimationScheduler(clock=clock, sleep=clock.sleep))
+    log = []
+
+    async def typewriter(name, tick, n, waiter):
+        for i in range(n):
+            log.append((round(clock(), 3), name, i))
+            if not await waiter(tick):
+                log.append((round(clock(), 3), name, "interrupted"))
+                return
+
+    async def main():
+        waiters = [manager.new_waiter() for _ in range(3)]
+        tasks = [asyncio.create_task(typewriter(name, tick, 10, w)) for name, tick, w in zip("abc", (0.03, 0.05, 0.1), waiters)]
+        await asyncio.sleep(0)
+        while clock() < 0.2:
+            await asyncio.sleep(0)
+        waiters[2].interrupt()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    for entry in log:
+        print(*entry)
+    print(f"{manager.scheduler.ticks} ticks")
@@ -8,34 +8,14 @@ from styleml.portal_ext import PortalExtParser
 from styleml.macro_ext import MacroExtParser
 from styleml_mika_exts import StyleExtParser, AnimationExtParser, LineWrapExtParser
 from styleml_glyph_exts import GlyphsetExtParser
+from mika_animation import AnimationScheduler, Waiter
 
 from pyodide import create_proxy
 from js import jQuery as jq
 
 import asyncio
 
-import attr
-
-@attr.s
-class Waiter:
-    interrupted = attr.ib(default=False)
-    instant = attr.ib(default=False)
-    update_event = attr.ib(factory=asyncio.Event)
-    
-    async def __call__(self, time, t=None):
-        if self.interrupted:
-            return False
-        if self.instant:
-            return True
-        done, pending = await asyncio.wait([
-            asyncio.create_task(asyncio.sleep(time)),
-            asyncio.create_task(self.update_event.wait()),
-        ], return_when=asyncio.FIRST_COMPLETED) # 保证中断事件触发时立刻中断
-        for t in pending: # 清除多余任务
-            t.cancel()
-        if self.interrupted:
-            return False
-        return True
+scheduler = AnimationScheduler() # 所有打字动画共用
 
 ui = SVGGameScreen()
 
@@ -47,7 +27,7 @@ styleml_parser = StyleMLCoreParser(
         AnimationExtParser(),
         StyleExtParser(),
         ReturnCharExtParser(),
-        LineWrapExtParser(cr_area=Vector2D(20, 0))
+        LineWrapExtParser(cr_area=Vector2D(20, 0), streaming=True)
         ]
     )
 
@@ -84,19 +64,19 @@ next_animation_id = 0
 
 def _(e):
     s = jq("#sty-text").val()
-    tokens = styleml_parser.render(styleml_parser.transform(styleml_parser.tokenize(
+    tokens = styleml_parser.stream_transform_and_render(styleml_parser.tokenize(
         s
-    )))
+    )) # 边解析边输出
     #ui.scr.print_footprints(footprints)
     
     global next_animation_id
-    waiter = Waiter()
+    waiter = Waiter(scheduler=scheduler)
     current_animation_id = next_animation_id
     waiters[current_animation_id] = waiter
     next_animation_id += 1
     async def _():
         try:
-            await ui.async_print_tokens(tokens, origin=Vector2D(0, 0), waiter=waiter)
+            await ui.async_print_tokens(tokens, origin=Vector2D(0, 0), waiter=waiter, frame_time=scheduler.frame_time)
             waiters.pop(current_animation_id)
         except Exception as e:
             import traceback
@@ -118,7 +98,6 @@ jq("#clear-sty").on("click", create_proxy(_))
 
 def _(e):
     for anim_id, waiter in waiters.items():
-        waiter.interrupted = True
-        waiter.update_event.set()
+        waiter.interrupt()
     
 jq("#interrupt-sty-animation").on("click", create_proxy(_))
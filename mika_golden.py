@@ -0,0 +1,186 @@
+
+# 不需要浏览器，按脚本中的选择驱动RegionalDialogueManager，把每次暂停时的画面和golden文件比较
+# 用法：
+#   python mika_golden.py check paths.json golden_dir    逐条路径比较画面，不同时打印diff
+#   python mika_golden.py record paths.json golden_dir   重新生成golden文件
+#   python mika_golden.py random [路径数] [种子]          随机选择走若干条路径，只计时
+# paths.json的格式为{路径名: [每次暂停时的选择, ...]}，选择是null时不选择，直接进入下一句
+
+import difflib
+import json
+import os
+import random
+import sys
+import time
+
+import attr
+
+import styleml.core, styleml.macro_ext, styleml.portal_ext
+import styleml_mika_exts, styleml_glyph_exts
+import mika_modules
+import mika_sentence_pool
+import mika_regional_dialogue
+from mika_macro_store import MacroStore
+from mika_screen import GameScreen
+from utilities import Vector2D
+
+_end = object()
+
+def make_postmacro_parser():
+    return styleml.core.StyleMLCoreParser(ext_parser=[
+        mika_regional_dialogue.InterSentenceCallExtParser(),
+        styleml.portal_ext.PortalExtParser(),
+        styleml_glyph_exts.GlyphsetExtParser(),
+        styleml_mika_exts.AnimationExtParser(initial_tick=0.03),
+        styleml_mika_exts.StyleExtParser(),
+        styleml.core.ReturnCharExtParser()
+    ])
+
+def default_screen_regions():
+    return {
+        "speech": mika_regional_dialogue.ScreenRegion(size=Vector2D(25, 6), origin=Vector2D(0, 16)),
+        "map": mika_regional_dialogue.ScreenRegion(size=Vector2D(25, 16), origin=Vector2D(0, 0))
+    }
+
+@attr.s
+class HeadlessRunner:
+    """
+    同步地播放对话，不等待动画，每到需要暂停的句子时由choose(manager)决定选择，并记录画面的快照
+    choose返回None时不选择，返回_end时结束这条路径
+    每条路径使用新的manager，全局宏由初始宏fork得到；各manager共享句子的编译缓存，缓存的有效性仍由读到的宏决定
+    """
+    sentences = attr.ib()
+    predefined_macros = attr.ib(converter=MacroStore)
+    macro_parser = attr.ib(factory=styleml.macro_ext.MacroExtParser)
+    postmacro_parser = attr.ib(factory=make_postmacro_parser)
+    screen_regions = attr.ib(factory=default_screen_regions)
+    dim = attr.ib(default=Vector2D(40, 25))
+    max_sentences = attr.ib(default=1000) # 每条路径（以及每次句间调用）最多播放的句子数，防止死循环
+    compiled_sentences = attr.ib(factory=dict)
+    row_layouts = attr.ib(factory=dict)
+
+    @classmethod
+    def from_resources(cls, **kwargs):
+        "和mika_regional_dialogue_demo.py相同的方式读取对话和初始宏"
+        sentences = mika_sentence_pool.LazySentencePool.from_bundle_or_module_files("./modules_bundle.bin", "./resources/modules")
+        macro_parser = styleml.macro_ext.MacroExtParser()
+        postmacro_parser = make_postmacro_parser()
+        with open("./resources/predefined_macros.txt", encoding="utf-8") as f:
+            predefined_macros = macro_parser.expand_and_get_defined_macros(postmacro_parser.tokenize(f.read()))[1]
+        return cls(sentences=sentences, predefined_macros=predefined_macros, macro_parser=macro_parser, postmacro_parser=postmacro_parser, **kwargs)
+
+    def new_manager(self):
+        return mika_regional_dialogue.RegionalDialogueManager(
+            sentences=self.sentences,
+            screen_regions=self.screen_regions,
+            macros=self.predefined_macros.fork(),
+            macro_parser=self.macro_parser,
+            postmacro_parser=self.postmacro_parser,
+            current_sentence_name=self.predefined_macros["start_sentence"],
+            compiled_sentences=self.compiled_sentences,
+            row_layouts=self.row_layouts
+        )
+
+    def render_current_sentence(self, manager, screen, choice=None):
+        region_name = manager.current_conv("region_conv")
+        if manager.current_conv("clear_region_conv") and region_name is not None:
+            region = manager.screen_regions[region_name]
+            screen.clear_rectangle(region.origin, region.origin + region.size)
+        base_sentence_name = manager.current_sentence_name
+        for t in manager.eval_sentence(choice):
+            screen.print_token(t, Vector2D(0, 0))
+            if isinstance(t, mika_regional_dialogue.InterSentenceCallToken):
+                target = mika_modules.resolve_module_ref(base_sentence_name, t.value["target"])
+                self.play_inter_sentence_call(manager.fork_from_inter_sentence_call(target, macros=t.meta.get("macros")), screen)
+
+    def play_inter_sentence_call(self, manager, screen):
+        "句间调用不暂停，一直播放到调用的句子返回"
+        for _ in range(self.max_sentences):
+            self.render_current_sentence(manager, screen)
+            try:
+                manager.next_sentence()
+            except IndexError:
+                return
+
+    def play_path(self, choose):
+        "播放一条路径，返回画面快照的列表，每项以\"=== 句子名 选择\"开头"
+        manager = self.new_manager()
+        screen = GameScreen(dim=self.dim)
+        frames = []
+        try:
+            for _ in range(self.max_sentences):
+                self.render_current_sentence(manager, screen)
+                if manager.current_conv("pause_after_conv"):
+                    choice = choose(manager)
+                    if choice is _end:
+                        break
+                    if choice is not None:
+                        self.render_current_sentence(manager, screen, choice)
+                    frames.append(f"=== {manager.current_sentence_name} {choice}\n{screen.snapshot()}")
+                try:
+                    manager.next_sentence()
+                except IndexError:
+                    frames.append(f"=== end {manager.current_sentence_name}\n{screen.snapshot()}")
+                    break
+        except Exception as e: # 出错也是画面的一部分，这样golden文件也能发现新出现（或消失）的错误
+            frames.append(f"=== error {manager.current_sentence_name} {e!r}\n{screen.snapshot()}")
+        return frames
+
+    def play_scripted(self, choices):
+        choices = iter(choices)
+        return self.play_path(lambda manager: next(choices, _end))
+
+    def play_random(self, rnd, max_pauses=50):
+        pauses = iter(range(max_pauses))
+        def choose(manager):
+            if next(pauses, _end) is _end:
+                return _end
+            amount = manager.current_conv("choice_amount_conv")
+            return rnd.randrange(amount) if amount else None
+        return self.play_path(choose)
+
+def golden_path(golden_dir, path_name):
+    return os.path.join(golden_dir, f"{path_name}.txt")
+
+def check_paths(runner, paths, golden_dir, record=False):
+    "返回和golden文件不同的路径名"
+    failed = []
+    for path_name, choices in paths.items():
+        actual = "".join(runner.play_scripted(choices))
+        file_name = golden_path(golden_dir, path_name)
+        if record:
+            os.makedirs(golden_dir, exist_ok=True)
+            with open(file_name, "w", encoding="utf-8") as f:
+                f.write(actual)
+            continue
+        try:
+            with open(file_name, encoding="utf-8") as f:
+                expected = f.read()
+        except FileNotFoundError:
+            expected = ""
+        if actual != expected:
+            failed.append(path_name)
+            diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(), file_name, path_name, lineterm="")
+            print("\n".join(list(diff)[:80]))
+    return failed
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "random"
+    runner = HeadlessRunner.from_resources()
+    start = time.perf_counter()
+    if command == "random":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+        rnd = random.Random(int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+        frames = sum(len(runner.play_random(rnd)) for _ in range(count))
+        failed = []
+    else:
+        with open(sys.argv[2], encoding="utf-8") as f:
+            paths = json.load(f)
+        count = len(paths)
+        failed = check_paths(runner, paths, sys.argv[3], record=command == "record")
+        frames = None
+    elapsed = time.perf_counter() - start
+    print(f"{count} paths in {elapsed:.2f}s ({count / elapsed * 60:.0f} paths/min)" + (f", {frames} frames" if frames is not None else ""))
+    if failed:
+        print(f"{len(failed)} failed: {', '.join(failed)}")
+        sys.exit(1)
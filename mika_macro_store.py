@@ -0,0 +1,148 @@
+import itertools
+from collections.abc import MutableMapping
+
+import attr
+
+_missing = object()
+_versions = itertools.count(1) # 所有store共用，所以两个store的version相同时内容也一定相同（互为fork且都没有再修改）
+
+@attr.s(eq=False, slots=True)
+class MacroNode:
+    "trie上的一个节点，对应一个模块"
+    macros = attr.ib(factory=dict) # 该模块中的宏：最后一级的名字 -> 值
+    children = attr.ib(factory=dict) # 子模块：最后一级的名字 -> MacroNode
+    owner = attr.ib(default=None) # 只有owner的store可以直接修改该节点，其他store修改前要先复制
+    version = attr.ib(default=0) # 该模块（包括子模块）最后一次修改时的版本
+    size = attr.ib(default=0) # 该模块（包括子模块）中宏的个数
+
+def _split(key):
+    "宏的绝对名字 -> (模块路径的各级, 宏名)"
+    if type(key) is not str:
+        raise TypeError(f"macro name must be str, not {type(key).__name__}")
+    *path, name = key.split(".")
+    return path, name
+
+class MacroStore(MutableMapping):
+    """
+    按模块组织的全局宏，键是宏的绝对名字，比如"a.b.c"是模块a.b中的宏c
+    内部是以模块名的各级为路径的trie，读写的代价只和模块的层数有关
+    fork()的代价是O(1)的：副本和原store共享所有节点，之后谁修改就复制从根到该模块路径上的节点
+    version在内容改变时更新，可以用来判断某个模块下的宏在两个时刻之间有没有改变
+    """
+
+    def __init__(self, macros=()):
+        self._owner = object()
+        self._root = MacroNode(owner=self._owner)
+        self.version = 0
+        self.update(macros)
+
+    def _find(self, path):
+        node = self._root
+        for name in path:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def _own(self, node):
+        if node.owner is self._owner:
+            return node
+        return MacroNode(dict(node.macros), dict(node.children), self._owner, node.version, node.size)
+
+    def _writable_path(self, path):
+        "返回从根到模块path上的节点，都是可以直接修改的，不存在的模块会被创建"
+        node = self._root = self._own(self._root)
+        nodes = [node]
+        for name in path:
+            child = node.children.get(name)
+            child = node.children[name] = MacroNode(owner=self._owner) if child is None else self._own(child)
+            nodes.append(child)
+            node = child
+        return nodes
+
+    def _touch(self, nodes, size_delta):
+        self.version = version = next(_versions)
+        for node in nodes:
+            node.version = version
+            node.size += size_delta
+
+    def get(self, key, default=None):
+        path, name = _split(key)
+        node = self._find(path)
+        if node is None:
+            return default
+        return node.macros.get(name, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return type(key) is str and self.get(key, _missing) is not _missing
+
+    def __setitem__(self, key, value):
+        path, name = _split(key)
+        node = self._find(path)
+        old = _missing if node is None else node.macros.get(name, _missing)
+        if old is value: # 写入同一个对象时内容没有改变，不更新version
+            return
+        nodes = self._writable_path(path)
+        nodes[-1].macros[name] = value
+        self._touch(nodes, 1 if old is _missing else 0)
+
+    def __delitem__(self, key):
+        path, name = _split(key)
+        node = self._find(path)
+        if node is None or name not in node.macros:
+            raise KeyError(key)
+        nodes = self._writable_path(path)
+        del nodes[-1].macros[name]
+        self._touch(nodes, -1)
+        for i in range(1, len(nodes)): # 删除没有宏的模块，只需要删掉最上层的
+            if nodes[i].size == 0:
+                del nodes[i - 1].children[path[i - 1]]
+                break
+
+    def _iter_node(self, node, prefix):
+        for name, value in node.macros.items():
+            yield prefix + name, value
+        for name, child in node.children.items():
+            yield from self._iter_node(child, prefix + name + ".")
+
+    def __iter__(self):
+        return (k for k, v in self._iter_node(self._root, ""))
+
+    def __len__(self):
+        return self._root.size
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def items_under(self, module):
+        "模块module及其子模块中的宏，产生(绝对名字, 值)，module为\"\"时是所有宏"
+        path = module.split(".") if module else []
+        node = self._find(path)
+        if node is None:
+            return iter(())
+        return self._iter_node(node, module + "." if module else "")
+
+    def macros_under(self, module):
+        return dict(self.items_under(module))
+
+    def version_under(self, module):
+        "模块module（包括子模块）最后一次修改时的版本，没有宏的模块是0"
+        node = self._find(module.split(".") if module else [])
+        return 0 if node is None else node.version
+
+    def fork(self):
+        "得到内容相同的副本，之后两者的修改互不影响"
+        new = type(self).__new__(type(self))
+        new._root = self._root
+        new._owner = object()
+        new.version = self.version
+        self._owner = object() # 现有的节点两者都不能直接修改了
+        return new
+
+    copy = fork
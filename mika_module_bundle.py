@@ -0,0 +1,156 @@
+import hashlib
+import os
+import pickle
+import zlib
+
+import attr
+
+import mika_modules
+import mika_regional_dialogue
+import mika_yaml_dialogue
+import styleml.convenient_argument
+import styleml.core
+
+# 把所有对话模块预先解析成句子池，打包成一个文件，运行时只需要读取这个文件
+# 格式：不压缩的文件头 BUNDLE_MAGIC + 4字节的版本号 + 32字节的sources，之后是zlib压缩的pickle，内容是{"modules": {模块名: 该模块句子池的pickle}, "foreign": {句子名: 模块名}}
+# 版本号和sources在解开pickle之前检查，代码改变导致pickle解不开时不会走到那一步
+# 每个模块单独pickle，以便只解开用到的模块
+# sources是打包时各yaml文件和生成句子池的代码的摘要，它们改了之后打包文件就过期了，读取时可以用它检查
+# foreign是名字不在所在模块之下的句子（如用绝对名字定义的alias）-> 所在的模块，找这些句子时不需要解开所有模块
+
+BUNDLE_VERSION = 5
+BUNDLE_MAGIC = b"MIKABNDL"
+_header_size = len(BUNDLE_MAGIC) + 4 + 32
+
+# 打包文件中pickle的类由这些模块定义，解析yaml的代码也在其中
+code_modules = (mika_yaml_dialogue, mika_modules, styleml.core, styleml.convenient_argument)
+
+# 读取打包文件可能出现的错误：文件头不对或过期时是ValueError，其余是文件损坏或pickle中的类改名、移动了
+bundle_errors = (ValueError, EOFError, AttributeError, ImportError, pickle.UnpicklingError, zlib.error)
+
+def yaml_modules(modules):
+    return {k: v for k, v in modules.items() if os.path.splitext(v)[1] == ".yaml"}
+
+def _update_digest(h, parts):
+    for part in parts:
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+
+def code_fingerprint(h):
+    "生成句子池的代码：code_modules的源文件和Sentence的字段"
+    for module in code_modules:
+        with open(module.__file__, "rb") as f:
+            content = f.read().replace(b"\r\n", b"\n")
+        _update_digest(h, (module.__name__.encode(), content))
+    _update_digest(h, [a.name.encode() for a in attr.fields(mika_regional_dialogue.Sentence)])
+
+def sources_digest(root, modules):
+    "各yaml模块的文件名和内容，以及生成句子池的代码的摘要"
+    h = hashlib.sha256()
+    code_fingerprint(h)
+    for module_name, file_name in sorted(yaml_modules(modules).items()):
+        with open(os.path.join(root, file_name), "rb") as f:
+            content = f.read()
+        _update_digest(h, (module_name.encode(), file_name.replace(os.sep, "/").encode(), content))
+    return h.hexdigest()
+
+def intern_tokens(tokens, table):
+    "token是frozen的，相同的token可以共享同一个实例，pickle时只会存一份"
+    interned = []
+    for t in tokens:
+        try:
+            key = (type(t), t.value, tuple(sorted(t.meta.items())))
+            t = table.setdefault(key, t)
+        except TypeError: # 不可hash的token不共享
+            pass
+        interned.append(t)
+    return interned
+
+def parse_module(module_name, s):
+    pool = mika_yaml_dialogue.parse_mikad_module(module_name, s)
+    table = {}
+    for sentence in pool.values():
+        sentence.content_tokens = intern_tokens(sentence.content_tokens, table)
+    return pool
+
+def compile_module(module_name, s):
+    return pickle.dumps(parse_module(module_name, s), protocol=pickle.HIGHEST_PROTOCOL)
+
+def compile_bundle(root, modules):
+    "modules是walk_modules的结果(模块名->相对于root的文件名)"
+    compiled = {}
+    defined = {} # 句子名 -> 所在的模块
+    for module_name, file_name in yaml_modules(modules).items():
+        with open(os.path.join(root, file_name), encoding="utf-8") as f:
+            pool = parse_module(module_name, f.read())
+        compiled[module_name] = pickle.dumps(pool, protocol=pickle.HIGHEST_PROTOCOL)
+        defined.update(dict.fromkeys(pool, module_name))
+    foreign = {name: m for name, m in defined.items() if mika_modules.owning_module(compiled, name) != m}
+    header = BUNDLE_MAGIC + BUNDLE_VERSION.to_bytes(4, "little") + bytes.fromhex(sources_digest(root, modules))
+    bundle = {"modules": compiled, "foreign": foreign}
+    return header + zlib.compress(pickle.dumps(bundle, protocol=pickle.HIGHEST_PROTOCOL))
+
+def read_header(data):
+    "返回打包文件的(版本号, sources)，不是打包文件时抛出ValueError"
+    if len(data) < _header_size or not data.startswith(BUNDLE_MAGIC):
+        raise ValueError("not a module bundle, rerun generate_module_bundle.py")
+    version = int.from_bytes(data[len(BUNDLE_MAGIC):len(BUNDLE_MAGIC) + 4], "little")
+    return version, data[len(BUNDLE_MAGIC) + 4:_header_size].hex()
+
+def read_bundle(data, sources=None, with_foreign=False):
+    """
+    返回模块名->该模块句子池的pickle，with_foreign为True时返回(它, foreign)
+    sources是现在的源文件摘要（sources_digest），和打包时的不同时抛出ValueError；为None时不检查
+    其他可能的错误参见bundle_errors
+    """
+    version, bundle_sources = read_header(data)
+    if version != BUNDLE_VERSION:
+        raise ValueError(f"incompatible module bundle version {version}")
+    if sources is not None and bundle_sources != sources:
+        raise ValueError("module bundle is out of date, rerun generate_module_bundle.py")
+    bundle = pickle.loads(zlib.decompress(data[_header_size:]))
+    if with_foreign:
+        return bundle["modules"], bundle["foreign"]
+    return bundle["modules"]
+
+def load_module(compiled_module):
+    return pickle.loads(compiled_module)
+
+def load_bundle(path):
+    "读取打包文件，返回所有模块合并后的句子池"
+    with open(path, "rb") as f:
+        modules = read_bundle(f.read())
+    sentences = {}
+    for compiled_module in modules.values():
+        sentences.update(load_module(compiled_module))
+    return sentences
+
+if __name__ == "__main__":
+    # 比较直接解析yaml和读取打包文件的速度
+    import contextlib
+    import io
+    import time
+    import mika_modules
+    root = "resources/modules"
+    modules = mika_modules.walk_modules(root)
+
+    def parse_all():
+        sentences = {}
+        for m, file_name in modules.items():
+            with open(os.path.join(root, file_name), encoding="utf-8") as f:
+                sentences.update(mika_yaml_dialogue.parse_mikad_module(m, f.read()))
+        return sentences
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = compile_bundle(root, modules)
+        start = time.perf_counter()
+        parsed = parse_all()
+        parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded = {}
+    for compiled_module in read_bundle(data).values():
+        loaded.update(load_module(compiled_module))
+    load_time = time.perf_counter() - start
+    assert parsed == loaded
+    print(f"{len(loaded)} sentences, bundle {len(data)} bytes")
+    print(f"parse yaml: {parse_time * 1000:.2f}ms, load bundle: {load_time * 1000:.2f}ms")
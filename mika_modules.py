@@ -1,5 +1,9 @@
 
+from functools import lru_cache
 import os
+import sys
+
+import attr
 
 
 # 模块系统描述以下：
@@ -18,9 +22,37 @@ def walk_modules(root, root_package=""):
             modules[module_name] = os.path.join(rel_dir, file_name)
     return modules
 
-def resolve_module_ref(current_module_name, ref_module_name):
-    if ref_module_name is None:
-        return current_module_name
+@attr.s(eq=False, repr=False)
+class ModuleNode:
+    """
+    模块树上的一个节点，每个模块名只对应一个节点，path是完整的模块名（同一个模块名总是同一个字符串对象）
+    """
+    name = attr.ib() # 最后一级的名字，根模块是""
+    parent = attr.ib(default=None)
+    path = attr.ib(default="")
+    children = attr.ib(factory=dict)
+
+    def __repr__(self):
+        return f"ModuleNode({self.path!r})"
+
+    def child(self, name):
+        try:
+            return self.children[name]
+        except KeyError:
+            path = sys.intern(name if self.parent is None else self.path + "." + name)
+            node = self.children[name] = ModuleNode(name=name, parent=self, path=path)
+            return node
+
+    def ancestors(self):
+        "从自己开始，一直到根模块"
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
+root_module = ModuleNode("")
+
+def _resolve_module_node(current_module_name, ref_module_name):
     ref_stack = ref_module_name.split(".")
     current_stack = current_module_name.split(".")
     if len(ref_stack[-1]) == 0: # 处理以"."结尾时多一级的问题
@@ -33,30 +65,59 @@ def resolve_module_ref(current_module_name, ref_module_name):
     else:
         # absolute
         work_stack = ref_stack
-    abs_stack = []
+    node = root_module
     for it in work_stack:
         if len(it) == 0:
-            try:
-                abs_stack.pop()
-            except IndexError as e:
-                raise ValueError("relative module reference beyond root module") from e
+            if node.parent is None:
+                raise ValueError("relative module reference beyond root module")
+            node = node.parent
         elif it[0] == "<":
             # backtrack
             search_for = it[1:]
             if len(search_for) == 0: # to root
-                abs_stack = []
-            while abs_stack[-1] != search_for:
-                abs_stack.pop()
+                node = root_module
+            while node.name != search_for:
+                if node.parent is None:
+                    raise IndexError(f"no enclosing module named {search_for}")
+                node = node.parent
         elif it[0] == ">":
             # new reference from current location
             from_root = it[1:]
-            if len(from_root) != 0:
-                abs_stack = [from_root]
-            else:
-                abs_stack = []
+            node = root_module.child(from_root) if len(from_root) != 0 else root_module
         else:
-            abs_stack.append(it)
-    return ".".join(abs_stack)
+            node = node.child(it)
+    return node
+
+# 同样的引用会被反复解析（每次读写宏都要解析一次），所以缓存结果
+resolve_cache_size = 4096
+_resolve_module_node_cached = lru_cache(maxsize=resolve_cache_size)(_resolve_module_node)
+
+def resolve_module_node(current_module_name, ref_module_name):
+    "返回ref_module_name在模块树上对应的ModuleNode"
+    if ref_module_name is None:
+        ref_module_name = "."
+    try:
+        return _resolve_module_node_cached(current_module_name, ref_module_name)
+    except TypeError: # 不可hash的参数
+        return _resolve_module_node(current_module_name, ref_module_name)
+
+def resolve_module_ref(current_module_name, ref_module_name):
+    if ref_module_name is None:
+        return current_module_name
+    return resolve_module_node(current_module_name, ref_module_name).path
+
+def module_node(module_name):
+    "绝对模块名对应的ModuleNode"
+    return resolve_module_node("", module_name)
+
+def owning_module(modules, sentence_name):
+    "modules中sentence_name所在的模块（名字最长的前缀模块，不包括根模块），找不到时返回None"
+    node = module_node(sentence_name)
+    while node.parent is not None:
+        if node.path in modules:
+            return node.path
+        node = node.parent
+    return None
 
 if __name__ == "__main__":
     a = "a.b.c.d"
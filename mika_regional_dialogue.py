@@ -1,10 +1,15 @@
 
+import asyncio
+
 import attr
 
 from utilities import Vector2D
 import mika_modules
+import mika_animation
+from mika_macro_store import MacroStore
 import styleml.convenient_argument as conv
 from styleml.core import StyleMLCoreParser, StyleMLExtParser, CommandToken, Token
+from styleml.macro_ext import MacroScope
 from styleml_mika_exts import LineWrapExtParser, AffineTransformExtParser
 
 @attr.s
@@ -13,6 +18,7 @@ class ScreenRegion:
     origin = attr.ib(default=Vector2D(0, 0))
     row_grow = attr.ib(default=Vector2D(1, 0))
     col_grow = attr.ib(default=Vector2D(0, 1))
+    word_wrap = attr.ib(default=False) # 换行时不从中间断开英文单词
 
 @attr.s
 class Sentence:
@@ -29,24 +35,54 @@ class Sentence:
     clear_region_conv = attr.ib(default="+")
     mock_location = attr.ib(default=".")
     meta = attr.ib(factory=dict)
+    compiled_convs = attr.ib(factory=dict, eq=False, repr=False) # conv名 -> 编译好的conv，参见compile_convs
     
     def __attrs_post_init__(self):
         if isinstance(self.content_tokens, str):
             self.content_tokens = StyleMLCoreParser.tokenize(self.content_tokens)
         if self.content_tokens is None:
             self.content_tokens = []
+        self.compile_convs()
+    
+    def compile_convs(self):
+        "预先编译各个conv，修改conv之后需要重新调用"
+        self.compiled_convs = {}
+        for name in conv_names:
+            try:
+                self.compiled_convs[name] = conv.compile_convenient_obj_repr(getattr(self, name))
+            except (ValueError, TypeError): # 不合法的conv，求值时再报错
+                pass
     
+    def compiled_conv(self, name):
+        try:
+            return self.compiled_convs[name]
+        except KeyError:
+            return conv.compile_convenient_obj_repr(getattr(self, name))
+
+conv_names = tuple(a.name for a in attr.fields(Sentence) if a.name.endswith("_conv"))
+
+_missing = MacroScope.missing
 
 @attr.s
 class ModularMacroProxy:
-    global_macros = attr.ib(factory=dict)
-    stage = attr.ib(factory=dict)
+    global_macros = attr.ib(factory=MacroStore)
+    stage = attr.ib(factory=MacroScope)
     base_module = attr.ib(default="")
+    global_reads = attr.ib(default=None) # 若是dict，则记录从global_macros读到的值（绝对名字->值），复制时共享
+    
+    def _read_global(self, absolute):
+        value = self.global_macros.get(absolute, _missing)
+        if self.global_reads is not None:
+            self.global_reads[absolute] = value
+        return value
     
     def __getitem__(self, macro_name):
         absolute = mika_modules.resolve_module_ref(self.base_module, macro_name)
         if absolute not in self.stage:
-            return self.global_macros[absolute]
+            value = self._read_global(absolute)
+            if value is _missing:
+                raise KeyError(macro_name)
+            return value
         return self.stage[absolute]
     
     def __setitem__(self, macro_name, value):
@@ -55,7 +91,7 @@ class ModularMacroProxy:
     
     def __contains__(self, macro_name):
         absolute = mika_modules.resolve_module_ref(self.base_module, macro_name)
-        return absolute in self.stage or absolute in self.global_macros
+        return absolute in self.stage or self._read_global(absolute) is not _missing
     
     def merge(self):
         self.global_macros.update(self.stage)
@@ -63,13 +99,36 @@ class ModularMacroProxy:
     def copy(self):
         return attr.evolve(self, stage=self.stage.copy())
 
+    def tracking_copy(self, reads):
+        "复制，之后读到的宏（暂存的和全局的）记录在reads中：绝对名字 -> 值，没有该宏时为MacroScope.missing"
+        return attr.evolve(self, stage=MacroScope(self.stage, reads=reads), global_reads=reads)
+
+    def snapshot(self):
+        "当前能读到的所有宏（全局宏加上暂存的宏）的MacroStore，之后的修改互不影响"
+        if isinstance(self.global_macros, MacroStore):
+            store = self.global_macros.fork()
+        else:
+            store = MacroStore(self.global_macros)
+        store.update(self.stage)
+        return store
+
+    def macros_under(self, module):
+        "模块module（相对于base_module）及其子模块中的宏，绝对名字 -> 值"
+        absolute = mika_modules.resolve_module_ref(self.base_module, module)
+        if isinstance(self.global_macros, MacroStore):
+            macros = self.global_macros.macros_under(absolute)
+        else:
+            macros = {k: v for k, v in self.global_macros.items() if not absolute or k.startswith(absolute + ".")}
+        macros.update((k, v) for k, v in self.stage.items() if not absolute or k.startswith(absolute + "."))
+        return macros
+
     def update(self, value):
-        if isinstance(value, dict):
-            self.stage.update(value)
-        elif isinstance(value, ModularMacroProxy):
+        if isinstance(value, ModularMacroProxy):
             if self.global_macros is not value.global_macros:
                 raise ValueError("other is incompatible with this proxy")
             self.stage.update(value.stage)
+        else:
+            self.stage.update(value)
     
     def get(self, macro_name, default=None):
         try:
@@ -77,12 +136,61 @@ class ModularMacroProxy:
         except KeyError:
             return default
 
+def as_macro_store(macros):
+    "RegionalDialogueManager.macros总是MacroStore，ModularMacroProxy（比如token中的宏环境）取其快照"
+    if isinstance(macros, MacroStore):
+        return macros
+    if isinstance(macros, ModularMacroProxy):
+        return macros.snapshot()
+    return MacroStore(macros)
+
+def _same_macro_value(a, b):
+    return a is b or (type(a) is type(b) and a == b)
+
+@attr.s
+class CompiledSentence:
+    """
+    eval_sentence的结果缓存
+    global_reads是求值时从全局宏中读到的值，只要这些值不变，求值的结果就不变
+    macros_version是确认结果有效时全局宏的版本，版本没变时不需要逐个检查global_reads
+    """
+    sentence = attr.ib()
+    global_reads = attr.ib()
+    staged_macros = attr.ib()
+    next_sentence_name = attr.ib()
+    is_next_sentence_call = attr.ib()
+    is_next_sentence_return = attr.ib()
+    region_name = attr.ib()
+    region = attr.ib()
+    tokens = attr.ib()
+    macros_version = attr.ib(default=None)
+    
+    @property
+    def dependencies(self):
+        "求值时读到的全局宏的名字"
+        return frozenset(self.global_reads)
+    
+    def is_valid(self, sentence, macros, screen_regions):
+        if sentence is not self.sentence:
+            return False
+        if self.region_name is not None and screen_regions.get(self.region_name) != self.region:
+            return False
+        if self.macros_version is not None and self.macros_version == getattr(macros, "version", None):
+            return True
+        return self.reads_unchanged(macros)
+
+    def reads_unchanged(self, macros):
+        return all(
+            _same_macro_value(macros.get(k, _missing), v)
+            for k, v in self.global_reads.items()
+        )
+
 @attr.s
 class RegionalDialogueManager:
 
     sentences = attr.ib(factory=dict)
     screen_regions = attr.ib(factory=dict)
-    macros = attr.ib(factory=dict)
+    macros = attr.ib(factory=MacroStore, converter=as_macro_store)
     macro_parser = attr.ib(default=None)
     postmacro_parser = attr.ib(default=None)
     current_sentence_name = attr.ib(default=None)
@@ -91,41 +199,168 @@ class RegionalDialogueManager:
     is_next_sentence_return = attr.ib(default=False)
     call_stack = attr.ib(factory=list)
     is_returned = attr.ib(default=False)
+    compiled_sentences = attr.ib(factory=dict) # (句子名, choice, is_returned) -> CompiledSentence
+    row_layouts = attr.ib(factory=dict) # (句子名, 区域大小) -> 上次换行完的RowLayout，同一句子再次换行时只重新计算改变的部分
+    conv_proxies = attr.ib(factory=dict) # 句子名 -> eval_conv用的ModularMacroProxy，只读，所以可以重复使用
     
     @property
     def current_sentence(self):
         return self.sentences[self.current_sentence_name]
     
     def eval_sentence(self, choice=None):
+        """
+        求值当前句子，返回定位好的tokens
+        结果会被缓存，若句子读到的全局宏都没有改变，则直接返回上次的tokens（不要修改返回的列表）
+        """
+        s = self.current_sentence
+        name = self.current_sentence_name
+        key = (name, choice, self.is_returned)
+        compiled = self.compiled_sentences.get(key)
+        if compiled is None or not compiled.is_valid(s, self.macros, self.screen_regions):
+            compiled = self.compile_sentence(choice)
+            self.compiled_sentences[key] = compiled
+        else:
+            self.macros.update(compiled.staged_macros)
+        self.next_sentence_name = compiled.next_sentence_name
+        self.is_next_sentence_call = compiled.is_next_sentence_call
+        self.is_next_sentence_return = compiled.is_next_sentence_return
+        return compiled.tokens
+    
+    def stream_sentence(self, choice=None):
+        """
+        和eval_sentence相同，但返回逐个产生tokens的迭代器，可以边解析边输出
+        宏在调用时就已经展开，下一句和全局宏的改变立即生效；之后的扩展、render和换行随着迭代进行，扩展读到的仍是调用时的宏
+        迭代完之后结果才会被缓存，中途放弃的不缓存
+        """
+        s = self.current_sentence
+        key = (self.current_sentence_name, choice, self.is_returned)
+        compiled = self.compiled_sentences.get(key)
+        if compiled is None or not compiled.is_valid(s, self.macros, self.screen_regions):
+            compiled, tokens = self.compile_sentence_lazily(choice, streaming=True)
+            tokens = self._cache_when_exhausted(key, compiled, tokens)
+        else:
+            self.macros.update(compiled.staged_macros)
+            tokens = iter(compiled.tokens)
+        self.next_sentence_name = compiled.next_sentence_name
+        self.is_next_sentence_call = compiled.is_next_sentence_call
+        self.is_next_sentence_return = compiled.is_next_sentence_return
+        return tokens
+    
+    def _cache_when_exhausted(self, key, compiled, tokens):
+        yield from tokens
+        self.compiled_sentences[key] = compiled
+    
+    def sentence_dependencies(self, sentence_name, choice=None, is_returned=False):
+        "返回句子上次求值时读到的全局宏的名字，没有求值过时返回None"
+        compiled = self.compiled_sentences.get((sentence_name, choice, is_returned))
+        return None if compiled is None else compiled.dependencies
+    
+    def sentences_depending_on(self, macro_names):
+        "返回依赖于macro_names中某个全局宏的已缓存句子，每项为(句子名, choice, is_returned)"
+        macro_names = set(macro_names)
+        return [
+            key for key, compiled in self.compiled_sentences.items()
+            if not macro_names.isdisjoint(compiled.global_reads)
+        ]
+    
+    def compile_sentence(self, choice=None):
+        compiled, tokens = self.compile_sentence_lazily(choice)
+        for _ in tokens:
+            pass
+        return compiled
+    
+    def compile_sentence_lazily(self, choice=None, streaming=False):
+        """
+        展开宏并确定下一句、区域等，返回(CompiledSentence, tokens的迭代器)
+        之后的扩展、render和换行在迭代时才进行，迭代完之后CompiledSentence的tokens和global_reads才完整
+        streaming为True时，各阶段串联成生成器，换行也不需要先看完所有token（参见LineWrapExtParser）
+        此时在全局宏的fork上展开，迭代时扩展读到的是开始时的宏，不受之后对全局宏的修改影响
+        """
         s = self.current_sentence
         name = self.current_sentence_name
         mock = mika_modules.resolve_module_ref(
             name,
             s.mock_location
         )
-        proxy = ModularMacroProxy(global_macros=self.macros, base_module=name)
+        global_reads = {}
+        store = self.macros.fork() if streaming else self.macros
+        proxy = ModularMacroProxy(global_macros=store, base_module=name, global_reads=global_reads)
         proxy[".choice"] = choice
         proxy[".returned"] = self.is_returned
         expanded, macros = self.macro_parser.expand_and_get_defined_macros(s.content_tokens, proxy)
-        self.next_sentence_name = mika_modules.resolve_module_ref(
+        next_sentence_name = mika_modules.resolve_module_ref(
             mock,
-            conv.parse_convenient_obj_repr(s.next_conv, macros=macros)
+            s.compiled_conv("next_conv")(macros)
         )
-        self.is_next_sentence_call = conv.parse_convenient_obj_repr(s.call_conv, macros=macros)
-        self.is_next_sentence_return = conv.parse_convenient_obj_repr(s.return_conv, macros=macros)
+        is_next_sentence_call = s.compiled_conv("call_conv")(macros)
+        is_next_sentence_return = s.compiled_conv("return_conv")(macros)
+        staged_macros = dict(macros.stage)
+        reads_before_merge = dict(global_reads)
+        global_reads.clear()
         macros.merge()
-        rendered = self.postmacro_parser.render(self.postmacro_parser.transform(expanded))
-        region_name = conv.parse_convenient_obj_repr(s.region_conv, macros=macros)
+        if store is not self.macros: # 暂存的宏同样写入全局宏，fork只留给这句之后的扩展读
+            self.macros.update(staged_macros)
+        region_name = s.compiled_conv("region_conv")(macros)
+        region = None
         if region_name is not None: # 如果region_name是None，则不打印字符
-            region = self.screen_regions[region_name]
-            line_wrapped = LineWrapExtParser(region.size, only_printable=False).post_renderer(rendered)
-            transformed = AffineTransformExtParser(origin=region.origin, col_grow=region.col_grow, row_grow=region.row_grow).post_renderer(line_wrapped)
-            return transformed
-        return []
+            region = attr.evolve(self.screen_regions[region_name])
+        compiled = CompiledSentence(
+            sentence=s,
+            global_reads=reads_before_merge,
+            staged_macros=staged_macros,
+            next_sentence_name=next_sentence_name,
+            is_next_sentence_call=is_next_sentence_call,
+            is_next_sentence_return=is_next_sentence_return,
+            region_name=region_name,
+            region=region,
+            tokens=None
+        )
+        return compiled, self._render_compiled(name, compiled, expanded, global_reads, streaming, store)
+    
+    def _render_compiled(self, name, compiled, expanded, global_reads, streaming, store):
+        parser = self.postmacro_parser
+        region = compiled.region
+        collected = []
+        if streaming:
+            rendered = parser.stream_transform_and_render(expanded)
+        else:
+            rendered = parser.transform_and_render(expanded)
+        if region is not None:
+            # 换行期间把layout从缓存中取出，交错进行的另一个stream会用新的layout，换行完才放回
+            layout_key = (name, region.size)
+            line_wrap = LineWrapExtParser(
+                region.size, only_printable=False, streaming=streaming, word_wrap=region.word_wrap,
+                layout=self.row_layouts.pop(layout_key, None)
+            )
+            line_wrapped = line_wrap.stream_post_renderer(rendered)
+            for t in AffineTransformExtParser(origin=region.origin, col_grow=region.col_grow, row_grow=region.row_grow).stream_post_renderer(line_wrapped):
+                collected.append(t)
+                yield t
+            self.row_layouts[layout_key] = line_wrap.get_layout()
+        else:
+            for _ in rendered: # 不打印，但扩展读到的宏仍然算作依赖
+                pass
+        if store is not self.macros: # 缓存的tokens（比如句间调用的宏环境）和eval_sentence的一样引用全局宏
+            for t in collected:
+                macros = t.meta.get("macros")
+                if isinstance(macros, ModularMacroProxy) and macros.global_macros is store:
+                    macros.global_macros = self.macros
+        compiled.tokens = collected
+        # merge之后读到的暂存宏，由staged_macros决定，不需要检查
+        compiled.global_reads = compiled.global_reads | {k: v for k, v in global_reads.items() if k not in compiled.staged_macros}
+        if compiled.reads_unchanged(self.macros):
+            compiled.macros_version = self.macros.version
     
     def eval_conv(self, sentence_name, attr_name):
-        proxy = ModularMacroProxy(global_macros=self.macros, base_module=sentence_name)
-        return conv.parse_convenient_obj_repr(getattr(self.sentences[sentence_name], attr_name), macros=proxy)
+        "常量的conv直接返回编译时的值，依赖宏的才通过(按句子缓存的)ModularMacroProxy读取"
+        compiled = self.sentences[sentence_name].compiled_conv(attr_name)
+        if compiled.is_constant:
+            return compiled.value
+        proxy = self.conv_proxies.get(sentence_name)
+        if proxy is None or proxy.global_macros is not self.macros:
+            proxy = ModularMacroProxy(global_macros=self.macros, base_module=sentence_name)
+            self.conv_proxies[sentence_name] = proxy
+        return compiled(proxy)
 
     def current_conv(self, attr_name):
         return self.eval_conv(self.current_sentence_name, attr_name)
@@ -153,7 +388,10 @@ class RegionalDialogueManager:
             self,
             current_sentence_name=sentence_name,
             macros=self.macros if macros is None else macros,
-            call_stack=[]
+            call_stack=[],
+            compiled_sentences={},
+            row_layouts={},
+            conv_proxies={}
         )
 
 @attr.s
@@ -167,18 +405,41 @@ class InterSentenceCallExtParser(StyleMLExtParser):
     \stcallsync[]
     """
     
+    retains_tokens = False
+    
     initial_tick = attr.ib(default=0)
     
-    def transformer(self, tokens):
-        transformed_tokens = []
+    def stream_transformer(self, tokens):
         for t in tokens:
             if isinstance(t, CommandToken) and t.value in ("stcall", "stcallsync"):
                 argument = t.meta.get("argument")
                 target = conv.parse_convenient_obj_repr(argument, macros=t.meta.get("macros") or {})
-                transformed_tokens.append(InterSentenceCallToken(
+                yield InterSentenceCallToken(
                     value={"is_sync": t.value == "stcallsync", "target": target},
                     meta=t.meta | {"post_delay": -1}
-                ))
+                )
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
+                yield t
+
+@attr.s
+class InterSentenceWaiter(mika_animation.Waiter):
+    r"""
+    遇到InterSentenceCallToken时调用async_inter_sentence_caller(句子名, instant=, macros=)，\stcallsync等它结束
+    t为None时（如frame_time累积的延迟）只是等待
+    """
+    async_inter_sentence_caller = attr.ib(default=None)
+    base_sentence_name = attr.ib(default=None)
+    
+    async def __call__(self, time, t=None):
+        if self.interrupted:
+            return False
+        if isinstance(t, InterSentenceCallToken):
+            is_sync, target = t.value["is_sync"], t.value["target"]
+            task = asyncio.create_task(self.async_inter_sentence_caller(
+                mika_modules.resolve_module_ref(self.base_sentence_name, target),
+                instant=self.instant,
+                macros=t.meta["macros"]
+            ))
+            if is_sync:
+                await task
+        return await super().__call__(time, t) # 所有动画的等待都由scheduler统一唤醒
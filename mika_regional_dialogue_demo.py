@@ -1,30 +1,22 @@
 
 import asyncio
-import attr
 
 import mika_svgui
 import styleml.core, styleml.macro_ext, styleml.portal_ext, styleml.convenient_argument
 import styleml_mika_exts, styleml_glyph_exts
-import mika_yaml_dialogue
+import mika_sentence_pool
+import mika_animation
 
 import mika_regional_dialogue
 
-import mika_modules
-
 from utilities import Vector2D
 
 from js import jQuery as jq
 
 import os
 
-all_modules = mika_modules.walk_modules("./resources/modules")
-# 读取对话
-sentences = {}
-for m, file_name in all_modules.items():
-    ext = os.path.splitext(file_name)[1]
-    if ext == ".yaml":
-        with open(os.path.join("./resources/modules", file_name), encoding="utf-8") as f:
-            sentences.update(mika_yaml_dialogue.parse_mikad_module(m, f.read()))
+# 读取对话，打包文件(generate_module_bundle.py)没有过期时从中读取，否则解析各模块；模块都在第一次用到时才读取
+sentences = mika_sentence_pool.LazySentencePool.from_bundle_or_module_files("./modules_bundle.bin", "./resources/modules")
 
 scr = mika_svgui.SVGGameScreen()
 
@@ -76,92 +68,21 @@ def clear_region(region_name):
             pos = region.origin + Vector2D(x, y)
             scr.print_cell(pos, None)
 
-@attr.s
-class AnimationWrapper:
-    task = attr.ib(default=None)
-    ongoing = attr.ib(default=False)
-    finished = attr.ib(default=False)
-    finished_event = attr.ib(default=asyncio.Event())
-    meta = attr.ib(factory=dict)
-
-    async def wrapper_task(self):
-        try:
-            self.ongoing = True
-            await asyncio.create_task(self.task)
-            self.finished = True
-            self.finished_event.set()
-        except Exception:
-            import traceback
-            traceback.print_exc()
-            import sys
-            sys.exit(1)
-    
-    def start(self):
-        return asyncio.create_task(self.wrapper_task())
-
-@attr.s
-class AnimationManager:
-    pool = attr.ib(factory=dict)
-    next_id = attr.ib(default=0)
-    
-    def add_animation(self, anim):
-        this_id = self.next_id
-        self.pool[this_id] = anim
-        self.next_id += 1
-        return this_id
-    
-    async def pool_wrapper(self, anim_id):
-        await self.pool[anim_id].start()
-        self.pool.pop(anim_id)
-    
-    def start_animation(self, anim_id):
-        return asyncio.create_task(self.pool_wrapper(anim_id))
-
-@attr.s
-class InterSentenceWaiter:
-    interrupted = attr.ib(default=False)
-    instant = attr.ib(default=False)
-    update_event = attr.ib(factory=asyncio.Event)
-    async_inter_sentence_caller = attr.ib(default=None)
-    base_sentence_name = attr.ib(default=None)
-    
-    async def __call__(self, time, t=None):
-        if self.interrupted:
-            return False
-        if isinstance(t, mika_regional_dialogue.InterSentenceCallToken):
-            is_sync, target = t.value["is_sync"], t.value["target"]
-            task = asyncio.create_task(self.async_inter_sentence_caller(
-                mika_modules.resolve_module_ref(self.base_sentence_name, target),
-                instant=self.instant,
-                macros=t.meta["macros"]
-            ))
-            if is_sync:
-                await task
-        if self.instant:
-            return True
-        done, pending = await asyncio.wait([
-            asyncio.create_task(asyncio.sleep(time)),
-            asyncio.create_task(self.update_event.wait()),
-        ], return_when=asyncio.FIRST_COMPLETED) # 保证中断事件触发时立刻中断
-        for t in pending: # 清除多余任务
-            t.cancel()
-        if self.interrupted:
-            return False
-        return True
-
-animation_pool = AnimationManager()
+animation_pool = mika_animation.AnimationManager()
 
 def add_print_tokens_animation(tokens, base_sentence_name, meta, instant=False):
-    waiter = InterSentenceWaiter(
+    waiter = animation_pool.new_waiter(
+        mika_regional_dialogue.InterSentenceWaiter,
         async_inter_sentence_caller=async_inter_sentence_caller,
         base_sentence_name=base_sentence_name,
         instant=instant
     )
     meta["waiter"] = waiter
     return animation_pool.add_animation(
-        AnimationWrapper(
+        mika_animation.AnimationWrapper(
             scr.async_print_tokens(
-                tokens, origin=Vector2D(0, 0), waiter=waiter
+                tokens, origin=Vector2D(0, 0), waiter=waiter,
+                frame_time=animation_pool.scheduler.frame_time # 同一帧内到期的字符一起打印
             ),
             meta=meta
         )
@@ -176,7 +97,7 @@ async def render_current_sentence(manager, instant=False, choice=None):
         if manager.current_conv("clear_region_conv"):
             clear_region(manager.current_conv("region_conv"))
         i = add_print_tokens_animation(
-            manager.eval_sentence(choice),
+            manager.stream_sentence(choice), # 边解析边输出，不用等整句解析完
             manager.current_sentence_name,
             meta={"sentence_name": manager.current_sentence_name},
             instant=instant
@@ -203,14 +124,26 @@ async def consequent_next_sentence(manager, first=False, skip_pause=False, insta
         except IndexError:
             return
 
+def upcoming_sentence_name(manager, first=False):
+    "consequent_next_sentence接下来要播放的句子"
+    if first:
+        return manager.current_sentence_name
+    if manager.is_next_sentence_return and manager.call_stack:
+        return manager.call_stack[-1]
+    return manager.next_sentence_name
+
 def main_start_next_sentence(first=False):
+    # 预读取下一句之后可能用到的模块，要在下一句开始（改变current_sentence_name）之前确定下一句
+    upcoming = upcoming_sentence_name(manager, first)
+    module_name = None if upcoming is None else sentences.owning_module(upcoming)
     asyncio.create_task(consequent_next_sentence(manager, first=first))
+    if module_name is not None:
+        asyncio.create_task(sentences.prefetch(module_name))
 
 def try_skip_animation():
     for anim_id, wrapper in animation_pool.pool.items():
         if not manager.eval_conv(wrapper.meta["sentence_name"], "uninterruptable_conv"):
-            wrapper.meta["waiter"].instant = True
-            wrapper.meta["waiter"].update_event.set()
+            wrapper.meta["waiter"].skip()
         
 main_start_next_sentence(True)
 
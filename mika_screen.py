@@ -1,15 +1,24 @@
-from itertools import count
+from itertools import chain, count, islice
+from array import array
 import re
+import string
 import asyncio
 
 import attr
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from styleml.core import CharacterToken
 from utilities import Vector2D, Cardinal, List2D, grouper
 
-@attr.s(frozen=True)
-class ScreenCell:
-    ch = attr.ib(default=None)
+@attr.s(frozen=True, slots=True, eq=False)
+class CellStyle:
+    """
+    格子的风格，每种风格组合只有一个实例（使用CellStyle.intern获取），所以可以用is比较
+    """
     fg = attr.ib(default="white")
     bg = attr.ib(default="black")
     hlit = attr.ib(default=False)
@@ -18,11 +27,303 @@ class ScreenCell:
     undl = attr.ib(default=False)
     midl = attr.ib(default=False)
     topl = attr.ib(default=False)
+    
+    registry = {}
+    
+    @classmethod
+    def intern(cls, fg="white", bg="black", hlit=False, bold=False, emph=False, undl=False, midl=False, topl=False):
+        key = (fg, bg, hlit, bold, emph, undl, midl, topl)
+        style = cls.registry.get(key)
+        if style is None:
+            style = cls.registry[key] = cls(*key)
+        return style
+    
+    def evolve(self, **changes):
+        return self.intern(**(attr.asdict(self, recurse=False) | changes))
+
+default_style = CellStyle.intern()
+
+def style_repr(style):
+    "风格和默认风格不同的部分，写法同convenient dict，如\"fg=red,bold+\""
+    parts = []
+    for name, default in attr.asdict(default_style, recurse=False).items():
+        value = getattr(style, name)
+        if value == default:
+            continue
+        if isinstance(value, bool):
+            parts.append(name + ("+" if value else "-"))
+        else:
+            parts.append(f"{name}={value}")
+    return ",".join(parts)
+
+snapshot_placeholder = "\ufffc" # 快照中代替不能写出的字符
+_snapshot_style_keys = string.ascii_letters + string.digits + "".join(c for c in string.punctuation if c not in ".#:")
+
+def _snapshot_style_key(n):
+    return _snapshot_style_keys[n] if n < len(_snapshot_style_keys) else chr(0x100 + n)
+
+@attr.s(frozen=True, slots=True, init=False)
+class ScreenCell:
+    """
+    屏幕上的一个格子，由字符和共享的CellStyle组成
+    构造时可以直接指定风格，如ScreenCell("a", fg="red")，也可以指定style，再加上要修改的风格
+    ScreenCell.intern(ch, style)返回共享的实例，用于大量输出相同的格子
+    """
+    ch = attr.ib(default=None)
+    style = attr.ib(default=default_style)
+    
+    cells = {} # (ch, style) -> 共享的ScreenCell
+    
+    def __init__(self, ch=None, *, style=None, **style_changes):
+        if style is None:
+            style = CellStyle.intern(**style_changes) if style_changes else default_style
+        elif style_changes:
+            style = style.evolve(**style_changes)
+        object.__setattr__(self, "ch", ch)
+        object.__setattr__(self, "style", style)
+    
+    fg = property(lambda self: self.style.fg)
+    bg = property(lambda self: self.style.bg)
+    hlit = property(lambda self: self.style.hlit)
+    bold = property(lambda self: self.style.bold)
+    emph = property(lambda self: self.style.emph)
+    undl = property(lambda self: self.style.undl)
+    midl = property(lambda self: self.style.midl)
+    topl = property(lambda self: self.style.topl)
+    
+    @classmethod
+    def intern(cls, ch=None, style=default_style):
+        try:
+            return cls.cells[ch, style]
+        except KeyError:
+            cell = cls.cells[ch, style] = cls(ch, style=style)
+            return cell
+        except TypeError: # ch不可hash（如CustomGlyph）
+            return cls(ch, style=style)
+
+_default_cell = ScreenCell()
+_cell_values = ("ch", "fg", "bg")
+_cell_flags = ("hlit", "bold", "emph", "undl", "midl", "topl")
+_flag_bits = {name: 1 << i for i, name in enumerate(_cell_flags)}
+_present_bit = 1 << len(_cell_flags) # 没有该位的格子是None
+
+@attr.s(eq=False)
+class CellPalette:
+    """
+    ScreenCellBuffer的值表，字符和颜色存为值表中的编号
+    可hash的值按(类型, 值)查找，不可hash的值（如CustomGlyph）按对象本身查找，值表持有该对象，所以它的id不会被重用
+    """
+    values = attr.ib(factory=list)
+    index = attr.ib(factory=dict)
+
+    def encode(self, value):
+        try:
+            key = (type(value), value)
+            code = self.index.get(key)
+        except TypeError:
+            key = (id, id(value))
+            code = self.index.get(key)
+        if code is None:
+            code = self.index[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def copy(self):
+        return type(self)(list(self.values), dict(self.index))
+
+@attr.s
+class ScreenCellBuffer:
+    """
+    ScreenCell的二维缓冲区，可以代替List2D作为GameScreen.map
+    每个格子的字符、前景色、背景色存为值表(CellPalette)中的编号，布尔风格存为标志位，分别放在并列的数组中
+    有numpy时使用numpy数组，否则使用array和bytearray
+    读取格子时构造对应的ScreenCell，矩形区域的填充、上色、清除、复制都是整块进行的
+    """
+    dim = attr.ib()
+    min_palette_limit = 1024
+    
+    def __attrs_post_init__(self):
+        size = self.dim.x * self.dim.y
+        self.palette = CellPalette() # 每个缓冲区有自己的值表
+        self.palette_limit = self.min_palette_limit # 值表超过这个大小时，下次修改前去掉不再用到的值
+        defaults = {name: self.palette.encode(getattr(_default_cell, name)) for name in _cell_values}
+        if numpy is not None:
+            self.planes = {name: numpy.full(size, code, dtype=numpy.int32) for name, code in defaults.items()}
+            self.flags = numpy.zeros(size, dtype=numpy.uint8)
+        else:
+            self.planes = {name: array("i", [code]) * size for name, code in defaults.items()}
+            self.flags = bytearray(size)
+    
+    def flatten(self, index):
+        if index.x >= self.dim.x or index.y >= self.dim.y:
+            raise IndexError(f"index {index} is out of bound")
+        return index.y * self.dim.x + index.x
+    
+    def __getitem__(self, key):
+        if not isinstance(key, Vector2D):
+            raise KeyError()
+        i = self.flatten(key)
+        flags = self.flags[i]
+        if not flags & _present_bit:
+            return None
+        values = self.palette.values
+        style = CellStyle.intern(
+            fg=values[self.planes["fg"][i]],
+            bg=values[self.planes["bg"][i]],
+            **{name: bool(flags & bit) for name, bit in _flag_bits.items()}
+        )
+        return ScreenCell.intern(values[self.planes["ch"][i]], style)
+    
+    def __setitem__(self, key, cell):
+        if not isinstance(key, Vector2D):
+            raise KeyError()
+        self.flatten(key)
+        self.fill_rectangle(key, key + Vector2D(1, 1), cell)
+    
+    def __iter__(self):
+        for y in range(self.dim.y):
+            for x in range(self.dim.x):
+                yield self[Vector2D(x, y)]
+    
+    def _rows(self, pos0, pos1):
+        "矩形区域在一维数组中对应的各行的(起始, 结束)"
+        if pos0.x < 0 or pos0.y < 0 or pos1.x > self.dim.x or pos1.y > self.dim.y:
+            raise IndexError(f"rectangle {pos0}-{pos1} is out of bound")
+        if pos1.x <= pos0.x:
+            return []
+        return [(y * self.dim.x + pos0.x, y * self.dim.x + pos1.x) for y in range(pos0.y, pos1.y)]
+    
+    def _rect_view(self, plane, pos0, pos1):
+        return plane.reshape(self.dim.y, self.dim.x)[pos0.y:pos1.y, pos0.x:pos1.x]
+    
+    def _fill(self, plane, pos0, pos1, value):
+        if numpy is not None:
+            self._rect_view(plane, pos0, pos1)[...] = value
+            return
+        for start, stop in self._rows(pos0, pos1):
+            if isinstance(plane, bytearray):
+                plane[start:stop] = bytes([value]) * (stop - start)
+            else:
+                plane[start:stop] = array(plane.typecode, [value]) * (stop - start)
+    
+    def _set_flags(self, pos0, pos1, on, off):
+        if numpy is not None:
+            view = self._rect_view(self.flags, pos0, pos1)
+            view |= on
+            view &= ~off & 0xFF
+            return
+        table = bytes((b | on) & ~off & 0xFF for b in range(256))
+        for start, stop in self._rows(pos0, pos1):
+            self.flags[start:stop] = self.flags[start:stop].translate(table)
+    
+    def compact_palette(self):
+        "去掉值表中没有格子用到的值，重新编号"
+        old, palette = self.palette.values, CellPalette()
+        for name, plane in self.planes.items():
+            if numpy is not None:
+                used, inverse = numpy.unique(plane, return_inverse=True)
+                table = numpy.array([palette.encode(old[c]) for c in used], dtype=numpy.int32)
+                plane[...] = table[inverse]
+            else:
+                table = {}
+                self.planes[name] = array("i", [
+                    table[c] if c in table else table.setdefault(c, palette.encode(old[c])) for c in plane
+                ])
+        self.palette = palette
+        self.palette_limit = max(self.min_palette_limit, 2 * len(palette.values))
+
+    def _before_change(self):
+        "在修改之前（而不是中途）整理值表，这样一次修改中得到的编号都是有效的"
+        if len(self.palette.values) > self.palette_limit:
+            self.compact_palette()
+    
+    def fill_rectangle(self, pos0, pos1, cell):
+        "把[pos0, pos1)的格子都设为cell"
+        self._rows(pos0, pos1) # 检查边界
+        if cell is None:
+            self.clear_rectangle(pos0, pos1)
+            return
+        self._before_change()
+        for name in _cell_values:
+            self._fill(self.planes[name], pos0, pos1, self.palette.encode(getattr(cell, name)))
+        flags = _present_bit
+        for name, bit in _flag_bits.items():
+            if getattr(cell, name):
+                flags |= bit
+        self._fill(self.flags, pos0, pos1, flags)
+    
+    def clear_rectangle(self, pos0, pos1):
+        self._rows(pos0, pos1)
+        self._before_change()
+        for name in _cell_values:
+            self._fill(self.planes[name], pos0, pos1, self.palette.encode(getattr(_default_cell, name)))
+        self._fill(self.flags, pos0, pos1, 0)
+    
+    def paint_rectangle(self, pos0, pos1, style):
+        "和对每个格子进行attr.evolve(cell or ScreenCell(), **style)相同"
+        self._rows(pos0, pos1)
+        self._before_change()
+        on, off = _present_bit, 0
+        for name, value in style.items():
+            if name in _flag_bits:
+                if value:
+                    on |= _flag_bits[name]
+                else:
+                    off |= _flag_bits[name]
+            elif name in _cell_values:
+                self._fill(self.planes[name], pos0, pos1, self.palette.encode(value))
+            else:
+                raise TypeError(f"unknown style {name}")
+        self._set_flags(pos0, pos1, on, off)
+    
+    def blit(self, src, src_pos0, src_pos1, dst_pos):
+        "把src的[src_pos0, src_pos1)复制到自己的dst_pos处"
+        self._before_change()
+        self._blit(src, src_pos0, src_pos1, dst_pos, translate=src.palette is not self.palette)
+    
+    def _blit(self, src, src_pos0, src_pos1, dst_pos, translate):
+        "translate为True时，把src值表中的编号换成自己值表中的编号"
+        dst_pos1 = dst_pos + (src_pos1 - src_pos0)
+        src_rows, dst_rows = src._rows(src_pos0, src_pos1), self._rows(dst_pos, dst_pos1)
+        src_values, encode = src.palette.values, self.palette.encode
+        for name in _cell_values + ("flags",):
+            src_plane = src.flags if name == "flags" else src.planes[name]
+            dst_plane = self.flags if name == "flags" else self.planes[name]
+            translate_plane = translate and name != "flags"
+            if numpy is not None:
+                values = src._rect_view(src_plane, src_pos0, src_pos1)
+                if translate_plane:
+                    used, inverse = numpy.unique(values, return_inverse=True)
+                    table = numpy.array([encode(src_values[c]) for c in used], dtype=numpy.int32)
+                    values = table[inverse].reshape(values.shape)
+                self._rect_view(dst_plane, dst_pos, dst_pos1)[...] = values
+            else:
+                table = {}
+                for (s0, s1), (d0, d1) in zip(src_rows, dst_rows):
+                    if translate_plane:
+                        dst_plane[d0:d1] = array("i", [
+                            table[c] if c in table else table.setdefault(c, encode(src_values[c])) for c in src_plane[s0:s1]
+                        ])
+                    else:
+                        dst_plane[d0:d1] = src_plane[s0:s1]
+    
+    def copy_rectangle(self, pos0, pos1):
+        "返回[pos0, pos1)区域的副本，值表也复制，所以编号不需要转换"
+        new = type(self)(pos1 - pos0)
+        new.palette = self.palette.copy()
+        new.palette_limit = self.palette_limit
+        new._blit(self, pos0, pos1, Vector2D(0, 0), translate=False)
+        return new
+    
+    def copy(self):
+        return self.copy_rectangle(Vector2D(0, 0), self.dim)
+
 @attr.s
 class GameScreen:
     map = attr.ib(init=False)
     dim = attr.ib(default=Vector2D(40, 25))
     background = attr.ib(default=ScreenCell())
+    buffer_type = attr.ib(default=List2D) # 可以使用ScreenCellBuffer
     
     def __attrs_post_init__(self):
         self.clear_screen()
@@ -43,9 +344,11 @@ class GameScreen:
     
     def print_token(self, t, origin, mati=Vector2D(1, 0), matj=Vector2D(0, 1)):
         if isinstance(t, CharacterToken):
-            style = t.meta.get("style") or {}
+            style = t.meta.get("style") or default_style
+            if isinstance(style, dict):
+                style = CellStyle.intern(**style)
             pos = t.meta.get("pos").affine_transform(mati, matj, origin)
-            self.print_cell(pos, ScreenCell(t.value, **style))
+            self.print_cell(pos, ScreenCell.intern(t.value, style))
     
     def print_tokens(self, tokens, origin, mati=Vector2D(1, 0), matj=Vector2D(0, 1)):
         for t in tokens:
@@ -55,26 +358,115 @@ class GameScreen:
         c = attr.evolve(self.map[pos] or ScreenCell(), **style)
         self.map[pos] = c
 
+    def rectangle_changed(self, pos0, pos1):
+        "缓冲区整块修改了[pos0, pos1)的格子之后调用"
+        pass
+
     def paint_rectangle(self, pos0, pos1, style):
+        if isinstance(self.map, ScreenCellBuffer):
+            self.map.paint_rectangle(pos0, pos1, style)
+            self.rectangle_changed(pos0, pos1)
+            return
         for y in range(pos0.y, pos1.y):
             for x in range(pos0.x, pos1.x):
                 self.paint_cell(Vector2D(x, y), style)
     
-    async def async_print_tokens(self, tokens, origin, mati=Vector2D(1, 0), matj=Vector2D(0, 1), waiter=None, start_from=0):
-        tokens = tokens[start_from:]
+    def flush(self):
+        "把修改立即输出到显示设备，默认什么也不做"
+        pass
+
+    async def async_print_tokens(self, tokens, origin, mati=Vector2D(1, 0), matj=Vector2D(0, 1), waiter=None, start_from=0, frame_time=None):
+        """
+        tokens可以是列表，也可以是边解析边产生token的迭代器（如RegionalDialogueManager.stream_sentence的结果）
+        waiter变为instant之后，剩下的token成批打印，参见_print_tokens_instantly
+        指定frame_time时，字符的延迟先累积起来，不满一帧时直接打印下一个字符，累积满一帧才等待累积的时间
+        这样同一帧内到期的字符一起打印，每帧最多等待一次，而每个字符出现的时间最多提前不到一帧
+        """
+        tokens = islice(tokens, start_from, None)
+        pending = 0 # 已经打印的字符中还没有等待的延迟
         for i, t in enumerate(tokens):
+            if waiter is not None and getattr(waiter, "instant", False) and not getattr(waiter, "interrupted", False):
+                return await self._print_tokens_instantly(chain((t,), tokens), i, origin, mati, matj, waiter)
             post_delay = t.meta.get("post_delay", 0)
             self.print_token(t, origin, mati, matj)
-            if post_delay != 0 and waiter is not None:
-                should_continue = await waiter(post_delay, t)
+            if post_delay == 0 or waiter is None:
+                continue
+            if frame_time is not None and isinstance(t, CharacterToken):
+                pending += post_delay
+                if pending < frame_time:
+                    continue
+                post_delay, pending = pending, 0
+            elif pending: # 非字符的token（如句间调用）要等到之前的字符都按时显示之后再处理
+                should_continue = await waiter(pending, None)
+                pending = 0
                 if not should_continue:
                     return i
+            should_continue = await waiter(post_delay, t)
+            if not should_continue:
+                return i
+        if pending and not await waiter(pending, None):
+            return i
+        return None
+
+    async def _print_tokens_instantly(self, tokens, start, origin, mati, matj, waiter):
+        """
+        跳过动画时不再逐个等待字符，直接打印，最后只刷新一次
+        有延迟的非字符token（如句间调用）仍然交给waiter处理，返回值同async_print_tokens
+        """
+        print_token = self.print_token
+        for i, t in enumerate(tokens, start):
+            print_token(t, origin, mati, matj)
+            if isinstance(t, CharacterToken):
+                continue
+            post_delay = t.meta.get("post_delay", 0)
+            if post_delay != 0 and not await waiter(post_delay, t):
+                self.flush()
+                return i
+        self.flush()
         return None
     
     def clear_screen(self):
-        self.map = List2D(self.dim)
+        self.map = self.buffer_type(self.dim)
+
+    def snapshot(self):
+        """
+        把map序列化成文本，用于保存和比较画面（参见mika_golden.py）
+        #text下每行是一行格子的字符，#style下是对应格子风格的编号（空格子是"."），行末的空格子省略
+        #legend是各编号对应的风格（和默认风格不同的部分），#glyphs是不能作为单个字符写出的格子（如CustomGlyph）
+        """
+        style_keys = {}
+        text_rows, style_rows, glyphs = [], [], []
+        cells = list(self.map) # 按行排列
+        width = self.dim.x
+        for y in range(self.dim.y):
+            row = cells[y * width:(y + 1) * width]
+            while row and row[-1] is None:
+                row.pop()
+            chars, keys = [], []
+            for x, cell in enumerate(row):
+                if cell is None:
+                    chars.append(" ")
+                    keys.append(".")
+                    continue
+                ch = " " if cell.ch is None else cell.ch
+                if not (isinstance(ch, str) and len(ch) == 1 and ch.isprintable()):
+                    glyphs.append(f"{x},{y} {ch!r}")
+                    ch = snapshot_placeholder
+                chars.append(ch)
+                key = style_keys.get(cell.style)
+                if key is None:
+                    key = style_keys[cell.style] = _snapshot_style_key(len(style_keys))
+                keys.append(key)
+            text_rows.append("".join(chars))
+            style_rows.append("".join(keys))
+        legend = [f"{key}:{style_repr(style)}" for style, key in style_keys.items()]
+        return "\n".join(["#text", *text_rows, "#style", *style_rows, "#legend", *legend, "#glyphs", *glyphs]) + "\n"
 
     def clear_rectangle(self, pos0, pos1):
+        if isinstance(self.map, ScreenCellBuffer):
+            self.map.clear_rectangle(pos0, pos1)
+            self.rectangle_changed(pos0, pos1)
+            return
         for y in range(pos0.y, pos1.y):
             for x in range(pos0.x, pos1.x):
                 self.print_cell(Vector2D(x, y), None)
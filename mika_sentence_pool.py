@@ -0,0 +1,149 @@
+import asyncio
+import os
+from collections.abc import Mapping
+
+import attr
+
+import mika_modules
+import mika_module_bundle
+import mika_yaml_dialogue
+
+def load_module_file(root, module_name, file_name):
+    with open(os.path.join(root, file_name), encoding="utf-8") as f:
+        return mika_yaml_dialogue.parse_mikad_module(module_name, f.read())
+
+@attr.s(eq=False)
+class LazySentencePool(Mapping):
+    """
+    按需读取模块的句子池，可以直接作为RegionalDialogueManager.sentences使用
+    访问某个句子时，找到它所在的模块（名字最长的前缀模块），只读取该模块
+    modules: 模块名 -> 读取该模块需要的参数(文件名、预编译的内容等)
+    load_module: (模块名, 参数) -> 该模块的句子池
+    foreign_sentences: 名字不在所在模块之下的句子（如用绝对名字定义的alias）-> 所在的模块
+    找句子时只看这两个索引，不在索引中的模块里找，所以找不到的句子不会导致读取所有模块
+    打包文件中有foreign_sentences；直接读取yaml时事先不知道（为None），第一次找不到句子时读取所有模块并建立索引
+    """
+    modules = attr.ib(factory=dict)
+    load_module = attr.ib(default=None)
+    foreign_sentences = attr.ib(default=None)
+    loaded = attr.ib(factory=dict) # 已经读取的句子
+    module_sentences = attr.ib(factory=dict) # 已经读取的模块 -> 其中的句子名
+
+    @classmethod
+    def from_bundle(cls, path, sources=None):
+        "从generate_module_bundle.py生成的打包文件读取，sources参见mika_module_bundle.read_bundle"
+        with open(path, "rb") as f:
+            modules, foreign = mika_module_bundle.read_bundle(f.read(), sources, with_foreign=True)
+        return cls(modules=modules, load_module=lambda name, compiled: mika_module_bundle.load_module(compiled), foreign_sentences=foreign)
+
+    @classmethod
+    def from_bundle_or_module_files(cls, path, root):
+        """
+        打包文件和root下的模块文件一致时从打包文件读取，不一致（过期）、读不出来或没有打包文件时读取模块文件
+        之后某个模块的pickle解不开时，也改为读取该模块的文件
+        没有模块文件时（如网页版只下载了打包文件）直接使用打包文件
+        """
+        if not os.path.exists(path):
+            return cls.from_module_files(root)
+        if not os.path.isdir(root):
+            return cls.from_bundle(path)
+        modules = mika_modules.walk_modules(root)
+        try:
+            pool = cls.from_bundle(path, mika_module_bundle.sources_digest(root, modules))
+        except mika_module_bundle.bundle_errors:
+            return cls.from_module_files(root, modules)
+        file_names = mika_module_bundle.yaml_modules(modules)
+        def load_module(name, compiled):
+            try:
+                return mika_module_bundle.load_module(compiled)
+            except mika_module_bundle.bundle_errors:
+                return load_module_file(root, name, file_names[name])
+        pool.load_module = load_module
+        return pool
+
+    @classmethod
+    def from_module_files(cls, root, modules=None):
+        "从yaml模块文件读取，modules是walk_modules的结果，默认为walk_modules(root)"
+        if modules is None:
+            modules = mika_modules.walk_modules(root)
+        return cls(modules=mika_module_bundle.yaml_modules(modules), load_module=lambda name, file_name: load_module_file(root, name, file_name))
+
+    def owning_module(self, sentence_name):
+        "句子所在的模块，找不到时返回None"
+        module_name = (self.foreign_sentences or {}).get(sentence_name)
+        if module_name is not None:
+            return module_name
+        return mika_modules.owning_module(self.modules, sentence_name)
+
+    def ensure_module(self, module_name):
+        if module_name in self.module_sentences:
+            return
+        pool = self.load_module(module_name, self.modules[module_name])
+        self.loaded.update(pool)
+        self.module_sentences[module_name] = list(pool)
+
+    def ensure_all(self):
+        for module_name in self.modules:
+            self.ensure_module(module_name)
+
+    def __getitem__(self, sentence_name):
+        try:
+            return self.loaded[sentence_name]
+        except KeyError:
+            pass
+        module_name = self.owning_module(sentence_name)
+        if module_name is not None:
+            self.ensure_module(module_name) # 有索引时只读取这一个模块，其中没有该句子时就是没有
+        if sentence_name not in self.loaded and self.foreign_sentences is None:
+            self.build_foreign_sentences()
+        return self.loaded[sentence_name]
+
+    def build_foreign_sentences(self):
+        "读取所有模块，找出foreign_sentences"
+        self.ensure_all()
+        self.foreign_sentences = {
+            name: module_name
+            for module_name, names in self.module_sentences.items()
+            for name in names
+            if mika_modules.owning_module(self.modules, name) != module_name
+        }
+
+    def __iter__(self):
+        self.ensure_all()
+        return iter(self.loaded)
+
+    def __len__(self):
+        self.ensure_all()
+        return len(self.loaded)
+
+    def reachable_modules(self, module_name):
+        "从已读取的模块中，通过next_conv/call_return_conv（常量的）能直接到达的其他模块"
+        self.ensure_module(module_name)
+        reachable = set()
+        for name in self.module_sentences[module_name]:
+            s = self.loaded[name]
+            for conv in (s.next_conv, s.call_return_conv):
+                if not isinstance(conv, str) or conv[:1] != "=":
+                    continue
+                try:
+                    mock = mika_modules.resolve_module_ref(name, s.mock_location)
+                    target = mika_modules.resolve_module_ref(mock, conv[1:])
+                except (ValueError, IndexError):
+                    continue
+                target_module = self.owning_module(target)
+                if target_module is not None and target_module != module_name:
+                    reachable.add(target_module)
+        return reachable
+
+    async def prefetch(self, module_name, depth=1):
+        "在后台读取从module_name出发depth步以内能到达的模块，每读取一个模块让出一次控制权"
+        frontier = {module_name}
+        for _ in range(depth):
+            next_frontier = set()
+            for m in frontier:
+                for r in self.reachable_modules(m):
+                    if r not in self.module_sentences:
+                        self.ensure_module(r)
+                        next_frontier.add(r)
+                        await asyncio.sleep(0)
+            frontier = next_frontier
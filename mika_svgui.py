@@ -1,5 +1,7 @@
 
 import re
+from collections import OrderedDict
+from functools import lru_cache
 import attr
 
 from js import jQuery as jq
@@ -9,6 +11,8 @@ from pyodide import create_proxy
 from mika_screen import Vector2D, GameScreen, ScreenCell
 from styleml_glyph_exts import CustomGlyph
 
+nothing_applied = object()
+
 def create_svg_elem(name):
     return js.document.createElementNS("http://www.w3.org/2000/svg", name)
 
@@ -18,23 +22,53 @@ class SVGGameScreen(GameScreen):
     cell_height = 24
     cell_width = 24
     
+    # 修改格子时只记录脏格子，每个动画帧统一刷新一次，并跳过和屏幕上显示的内容相同的格子
+    dirty_positions = attr.ib(factory=set, init=False)
+    displayed_cells = attr.ib(factory=dict, init=False) # 位置 -> 屏幕上显示的ScreenCell
+    flush_scheduled = attr.ib(default=False, init=False)
+    
     def __attrs_post_init__(self):
         super().__attrs_post_init__()
         self.jq_svg, self.cell_slots = self.create_svg_base()
+        self.flush_proxy = create_proxy(lambda timestamp: self.flush())
         self.render_refresh_all()
         
     def print_cell(self, pos, cell):
         super().print_cell(pos, cell)
-        self.render_refresh_pos(pos)
+        self.mark_dirty(pos)
     
     def paint_cell(self, pos, styles):
         super().paint_cell(pos, styles)
-        self.render_refresh_pos(pos)
+        self.mark_dirty(pos)
     
     def clear_screen(self):
         super().clear_screen()
         if hasattr(self, "jq_svg"): # 刚开始的时候jq_svg还没有初始化
-            self.render_refresh_all()
+            for y in range(self.dim.y):
+                for x in range(self.dim.x):
+                    self.mark_dirty(Vector2D(x, y))
+    
+    def rectangle_changed(self, pos0, pos1):
+        for y in range(pos0.y, pos1.y):
+            for x in range(pos0.x, pos1.x):
+                self.mark_dirty(Vector2D(x, y))
+    
+    def mark_dirty(self, pos):
+        self.dirty_positions.add(pos)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            js.requestAnimationFrame(self.flush_proxy)
+    
+    def flush(self):
+        "把脏格子的变化写入DOM"
+        self.flush_scheduled = False
+        dirty, self.dirty_positions = self.dirty_positions, set()
+        for pos in dirty:
+            cell = self.get_display_cell(pos)
+            if self.displayed_cells.get(pos) == cell:
+                continue
+            self.render_refresh_cell(cell, self.cell_slots[pos])
+            self.displayed_cells[pos] = cell
 
     registered_onclick = attr.ib(factory=list)
     def onclick_handler_global(self, e):
@@ -71,7 +105,7 @@ class SVGGameScreen(GameScreen):
                 cell_g.append(text)
                 custom = jq(create_svg_elem("g")).attr("x", 0).attr("y", 0)
                 cell_g.append(custom)
-                cell_slots[Vector2D(x, y)] = dict(g=cell_g, bg=bg, text=text, custom=custom)
+                cell_slots[Vector2D(x, y)] = dict(g=cell_g, bg=bg, text=text, custom=custom, applied={})
                 jq_svg.append(cell_g)
         return jq_svg, cell_slots
     
@@ -81,21 +115,41 @@ class SVGGameScreen(GameScreen):
                 self.render_refresh_pos(Vector2D(x, y))
     
     def render_refresh_pos(self, pos):
-        self.render_refresh_cell(self.get_display_cell(pos), self.cell_slots[pos])
+        cell = self.get_display_cell(pos)
+        self.render_refresh_cell(cell, self.cell_slots[pos])
+        self.displayed_cells[pos] = cell
+        self.dirty_positions.discard(pos)
+    
+    @classmethod
+    def apply_slot_style(cls, slots, node, prop, value):
+        "只在值和上次写入的不同时才写入DOM，prop为\"text\"时设置文字，否则设置css"
+        applied = slots["applied"]
+        if applied.get((node, prop), nothing_applied) == value:
+            return
+        applied[(node, prop)] = value
+        if prop == "text":
+            slots[node].text(value)
+        else:
+            slots[node].css(prop, value)
+    
+    @classmethod
+    def clear_custom_slot(cls, slots):
+        if slots["applied"].get(("custom", "glyph")) is not None:
+            slots["custom"].empty()
+            slots["applied"][("custom", "glyph")] = None
     
     @classmethod
     def render_refresh_cell(cls, cell, slots):
         if isinstance(cell.ch, CustomGlyph):
-            slots["text"].empty()
+            cls.apply_slot_style(slots, "text", "text", "")
             getattr(cls.CustomGlyphRenderers, cell.ch.type)(cls, cell, slots)
         else:
-            slots["custom"].empty()
-            slots["bg"].css("fill", cell.bg if not cell.hlit else cell.fg)
-            slots["text"].css("fill", cell.fg if not cell.hlit else cell.bg).text(cell.ch or "")
-            if cell.bold:
-                slots["text"].css("font-weight", "bold")
-            if cell.emph:
-                slots["text"].css("font-style", "italic")
+            cls.clear_custom_slot(slots)
+            cls.apply_slot_style(slots, "bg", "fill", cell.bg if not cell.hlit else cell.fg)
+            cls.apply_slot_style(slots, "text", "fill", cell.fg if not cell.hlit else cell.bg)
+            cls.apply_slot_style(slots, "text", "text", cell.ch or "")
+            cls.apply_slot_style(slots, "text", "font-weight", "bold" if cell.bold else "normal")
+            cls.apply_slot_style(slots, "text", "font-style", "italic" if cell.emph else "normal")
             lines = []
             if cell.undl:
                 lines.append("underline")
@@ -103,10 +157,41 @@ class SVGGameScreen(GameScreen):
                 lines.append("line-through")
             if cell.topl:
                 lines.append("overline")
-            slots["text"].css("text-decoration", " ".join(lines))
+            cls.apply_slot_style(slots, "text", "text-decoration", " ".join(lines))
     
     class CustomGlyphRenderers:
         
+        # 编译好的字形(未插入DOM的svg元素)，使用时复制一份，按最近使用的顺序保留glyph_cache_size个
+        glyph_cache = OrderedDict()
+        glyph_cache_size = 256
+        
+        @classmethod
+        def glyph_key(cls, scr, cell):
+            "字形的外观由以下内容决定"
+            return (
+                cell.ch.type, cell.ch.value, scr.cell_width, scr.cell_height,
+                cell.fg if not cell.hlit else cell.bg, cell.bold, cell.emph
+            )
+        
+        @classmethod
+        def show_glyph(cls, scr, cell, slots, build):
+            "在custom槽中显示字形，build()返回新生成的字形"
+            key = cls.glyph_key(scr, cell)
+            if slots["applied"].get(("custom", "glyph")) == key: # 已经显示了同样的字形
+                return
+            compiled = cls.glyph_cache.get(key)
+            if compiled is None:
+                compiled = build()
+                cls.glyph_cache[key] = compiled
+                if len(cls.glyph_cache) > cls.glyph_cache_size:
+                    cls.glyph_cache.popitem(last=False)
+            else:
+                cls.glyph_cache.move_to_end(key)
+            c = slots["custom"]
+            c.empty()
+            c.append(compiled.clone())
+            slots["applied"][("custom", "glyph")] = key
+        
         @classmethod
         def _c_hz_lr(cls, width, height, children): # 左右结构
             combined = jq(create_svg_elem("g"))
@@ -283,11 +368,8 @@ class SVGGameScreen(GameScreen):
         
         @classmethod
         def c_hz(cls, scr, cell, slots):
-            slots["bg"].css("fill", cell.bg if not cell.hlit else cell.fg)
-            c = slots["custom"]
-            c.empty()
-            combined = cls._c_hz_parse_combine(scr.cell_width, scr.cell_height, cell.ch.value, cell)
-            c.append(combined)
+            scr.apply_slot_style(slots, "bg", "fill", cell.bg if not cell.hlit else cell.fg)
+            cls.show_glyph(scr, cell, slots, lambda: cls._c_hz_parse_combine(scr.cell_width, scr.cell_height, cell.ch.value, cell))
         
         @classmethod
         def _c_zy_zhuyin_structurize(cls, s):
@@ -316,9 +398,10 @@ class SVGGameScreen(GameScreen):
         _c_zy_mu_lut = dict(zip(_c_zy_mu_fr, _c_zy_mu_to))
 
         @classmethod
-        def c_zy(cls, scr, cell, slots):
+        @lru_cache(maxsize=256)
+        def _c_zy_structure(cls, s):
+            "把拼音转换为注音符号，再转换为c_hz的组合描述"
             zhuyin = ""
-            s = cell.ch.value
             while len(s) > 0:
                 g = re.match(
                     r"(er|ang|eng|an|en|au|eu|ai|ei|a|o|e|y|i|u|w|b|p|m|f|d|t|n|l|g|k|h|j|q|x|zh|ch|sh|r|z|c|s|1|2|3|4|5) *(.*)",
@@ -327,9 +410,11 @@ class SVGGameScreen(GameScreen):
                     break
                 mu, s = g[1], g[2]
                 zhuyin += cls._c_zy_mu_lut[mu]
-            st = cls._c_zy_zhuyin_structurize(zhuyin)
-            slots["bg"].css("fill", cell.bg if not cell.hlit else cell.fg)
-            c = slots["custom"]
-            c.empty()
-            combined = cls._c_hz_parse_combine(scr.cell_width, scr.cell_height, st, cell)
-            c.append(combined)
+            return cls._c_zy_zhuyin_structurize(zhuyin)
+
+        @classmethod
+        def c_zy(cls, scr, cell, slots):
+            scr.apply_slot_style(slots, "bg", "fill", cell.bg if not cell.hlit else cell.fg)
+            cls.show_glyph(scr, cell, slots, lambda: cls._c_hz_parse_combine(
+                scr.cell_width, scr.cell_height, cls._c_zy_structure(cell.ch.value), cell
+            ))
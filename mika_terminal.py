@@ -0,0 +1,313 @@
+import asyncio
+import sys
+import time
+import unicodedata
+from functools import lru_cache
+
+import attr
+
+from mika_screen import GameScreen
+from styleml_glyph_exts import CustomGlyph
+from utilities import Vector2D
+
+# 在ANSI终端中显示GameScreen，不需要Pyodide和浏览器
+# 每个格子占两列（汉字本身就是两列宽），只输出和上一帧不同的格子，同一风格的连续格子只输出一次风格的转义序列
+
+css_colors = {
+    "black": (0, 0, 0), "white": (255, 255, 255), "gray": (128, 128, 128), "grey": (128, 128, 128),
+    "silver": (192, 192, 192), "darkgray": (169, 169, 169), "lightgray": (211, 211, 211),
+    "red": (255, 0, 0), "darkred": (139, 0, 0), "maroon": (128, 0, 0), "pink": (255, 192, 203),
+    "orange": (255, 165, 0), "gold": (255, 215, 0), "yellow": (255, 255, 0), "brown": (165, 42, 42),
+    "green": (0, 128, 0), "lime": (0, 255, 0), "darkgreen": (0, 100, 0), "olive": (128, 128, 0),
+    "blue": (0, 0, 255), "navy": (0, 0, 128), "skyblue": (135, 206, 235), "lightblue": (173, 216, 230),
+    "cyan": (0, 255, 255), "aqua": (0, 255, 255), "teal": (0, 128, 128),
+    "magenta": (255, 0, 255), "fuchsia": (255, 0, 255), "purple": (128, 0, 128), "violet": (238, 130, 238),
+}
+
+@lru_cache(maxsize=256)
+def color_to_rgb(color):
+    "css颜色名或#rgb/#rrggbb -> (r, g, b)，无法识别时返回None"
+    if not isinstance(color, str):
+        return None
+    color = color.strip().lower()
+    if color.startswith("#"):
+        digits = color[1:]
+        if len(digits) == 3:
+            digits = "".join(d * 2 for d in digits)
+        try:
+            return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4)) if len(digits) == 6 else None
+        except ValueError:
+            return None
+    return css_colors.get(color)
+
+def _color_sgr(color, base, default):
+    rgb = color_to_rgb(color)
+    if rgb is None:
+        return str(default)
+    return f"{base};2;{rgb[0]};{rgb[1]};{rgb[2]}"
+
+_style_sgrs = {} # CellStyle是共享实例，按实例缓存
+
+def style_sgr(style):
+    "CellStyle对应的SGR转义序列，先重置再设置全部风格，所以和之前输出的风格无关"
+    try:
+        return _style_sgrs[style]
+    except KeyError:
+        pass
+    fg, bg = (style.bg, style.fg) if style.hlit else (style.fg, style.bg)
+    codes = ["0", _color_sgr(fg, 38, 39), _color_sgr(bg, 48, 49)]
+    for flag, code in (("bold", 1), ("emph", 3), ("undl", 4), ("midl", 9), ("topl", 53)):
+        if getattr(style, flag):
+            codes.append(str(code))
+    sgr = _style_sgrs[style] = "\x1b[" + ";".join(codes) + "m"
+    return sgr
+
+@lru_cache(maxsize=4096)
+def _pad_char(ch, cell_width):
+    width = 2 if unicodedata.east_asian_width(ch[:1]) in "WF" else 1
+    return ch + " " * max(cell_width - width, 0)
+
+@attr.s
+class TerminalGameScreen(GameScreen):
+    """
+    输出到ANSI终端的GameScreen
+    修改格子时只记录脏格子，在事件循环中按帧刷新，两帧之间至少间隔1/max_fps秒
+    没有运行中的事件循环时（如同步地打印tokens）需要自己调用flush()
+    """
+
+    cell_width = 2 # 每个格子在终端中占的列数
+    glyph_placeholder = "？" # CustomGlyph无法在终端中组合，用这个字符代替
+
+    out = attr.ib(default=None) # 输出的文件，默认是sys.stdout
+    max_fps = attr.ib(default=30)
+    clock = attr.ib(default=time.monotonic)
+    dirty_indices = attr.ib(factory=set, init=False) # 脏格子在一维排列中的编号 y * dim.x + x
+    displayed_cells = attr.ib(factory=dict, init=False) # 编号 -> 终端上显示的ScreenCell
+    flush_handle = attr.ib(default=None, init=False)
+    last_flush = attr.ib(default=None, init=False)
+    cursor = attr.ib(default=None, init=False) # 终端光标所在格子的编号，未知时是None
+    current_style = attr.ib(default=None, init=False) # 终端当前的风格，未知时是None
+    frames = attr.ib(default=0, init=False) # 输出过的帧数
+
+    def print_cell(self, pos, cell):
+        super().print_cell(pos, cell)
+        self.mark_dirty(pos)
+
+    def paint_cell(self, pos, styles):
+        super().paint_cell(pos, styles)
+        self.mark_dirty(pos)
+
+    def clear_screen(self):
+        super().clear_screen()
+        self.rectangle_changed(Vector2D(0, 0), self.dim)
+
+    def rectangle_changed(self, pos0, pos1):
+        width = self.dim.x
+        for y in range(pos0.y, pos1.y):
+            self.dirty_indices.update(range(y * width + pos0.x, y * width + pos1.x))
+        if self.flush_handle is None:
+            self.schedule_flush()
+
+    def mark_dirty(self, pos):
+        self.dirty_indices.add(pos.y * self.dim.x + pos.x)
+        if self.flush_handle is None:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = 0
+        if self.last_flush is not None:
+            delay = max(0, self.last_flush + 1 / self.max_fps - self.clock())
+        self.flush_handle = loop.call_later(delay, self.flush)
+
+    def cell_text(self, cell):
+        ch = cell.ch
+        if ch is None:
+            return " " * self.cell_width
+        if isinstance(ch, CustomGlyph):
+            ch = self.glyph_placeholder
+        return _pad_char(ch, self.cell_width)
+
+    def render_frame(self):
+        "返回把脏格子的变化画到终端上的字符串，并清空脏格子"
+        dirty, self.dirty_indices = self.dirty_indices, set()
+        parts = []
+        cursor, style = self.cursor, self.current_style
+        width, displayed = self.dim.x, self.displayed_cells
+        for i in sorted(dirty):
+            y, x = divmod(i, width)
+            cell = self.get_display_cell(Vector2D(x, y))
+            if displayed.get(i) == cell:
+                continue
+            if cursor != i:
+                parts.append(f"\x1b[{y + 1};{x * self.cell_width + 1}H")
+            if cell.style is not style:
+                parts.append(style_sgr(cell.style))
+                style = cell.style
+            parts.append(self.cell_text(cell))
+            cursor = i + 1 if x + 1 < width else None # 行末之后光标的位置由终端决定
+            displayed[i] = cell
+        self.cursor, self.current_style = cursor, style
+        return "".join(parts)
+
+    def write(self, s):
+        out = self.out or sys.stdout
+        out.write(s)
+        out.flush()
+
+    def flush(self):
+        "把脏格子的变化输出到终端"
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        frame = self.render_frame()
+        if frame:
+            self.write(frame)
+        self.last_flush = self.clock()
+        self.frames += 1
+
+    def begin(self):
+        "清空终端并隐藏光标，之后所有格子都会重新输出"
+        self.write("\x1b[?25l\x1b[2J")
+        self.displayed_cells.clear()
+        self.cursor = self.current_style = None
+        self.rectangle_changed(Vector2D(0, 0), self.dim)
+
+    def end(self):
+        "输出剩下的变化，恢复终端的风格和光标"
+        self.flush()
+        self.write(f"\x1b[0m\x1b[{self.dim.y + 1};1H\x1b[?25h")
+        self.cursor = self.current_style = None
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end()
+
+arrow_keys = {"\x1b[A": -1, "\x1b[B": 1, "\x1bOA": -1, "\x1bOB": 1} # 上下方向键
+
+def handle_input_line(line, choice, amount):
+    """
+    暂停时终端输入的一行 -> (是否继续下一句, 新的选择)，和网页版的按键相同：
+    上下方向键（可以连按几次再回车）在amount个选项之间循环移动，也可以输入选项的编号（从1开始）
+    空行或其他输入继续下一句；没有选项时方向键使选择变为None
+    """
+    line = line.rstrip("\r\n")
+    if line.isdigit():
+        n = int(line)
+        return False, (n - 1 if amount and 1 <= n <= amount else choice)
+    moves = []
+    rest = line
+    while rest[:3] in arrow_keys:
+        moves.append(arrow_keys[rest[:3]])
+        rest = rest[3:]
+    if not moves or rest:
+        return True, choice
+    for move in moves:
+        choice = 0 if choice is None else choice + move
+        if not amount:
+            return False, None
+        choice %= amount
+    return False, choice
+
+if __name__ == "__main__":
+    # 在终端中播放对话：播放时按回车跳过动画；暂停时用上下方向键加回车或输入编号选择，空行继续下一句
+    import threading
+    import styleml.core, styleml.macro_ext, styleml.portal_ext
+    import styleml_mika_exts, styleml_glyph_exts
+    import mika_sentence_pool
+    import mika_regional_dialogue
+    import mika_animation
+
+    sentences = mika_sentence_pool.LazySentencePool.from_bundle_or_module_files("./modules_bundle.bin", "./resources/modules")
+    styleml_parser = styleml.core.StyleMLCoreParser(ext_parser=[
+        mika_regional_dialogue.InterSentenceCallExtParser(),
+        styleml.portal_ext.PortalExtParser(),
+        styleml_glyph_exts.GlyphsetExtParser(),
+        styleml_mika_exts.AnimationExtParser(initial_tick=0.03),
+        styleml_mika_exts.StyleExtParser(),
+        styleml.core.ReturnCharExtParser()
+    ])
+    macro_parser = styleml.macro_ext.MacroExtParser()
+    predefined_macros = macro_parser.expand_and_get_defined_macros(styleml_parser.tokenize(open("./resources/predefined_macros.txt").read()))[1]
+    manager = mika_regional_dialogue.RegionalDialogueManager(
+        sentences=sentences,
+        screen_regions={
+            "speech": mika_regional_dialogue.ScreenRegion(size=Vector2D(25, 6), origin=Vector2D(0, 16)),
+            "map": mika_regional_dialogue.ScreenRegion(size=Vector2D(25, 16), origin=Vector2D(0, 0))
+        },
+        macro_parser=macro_parser,
+        macros=predefined_macros,
+        postmacro_parser=styleml_parser,
+        current_sentence_name=predefined_macros["start_sentence"]
+    )
+    scr = TerminalGameScreen()
+    scheduler = mika_animation.AnimationScheduler(frame_time=1 / scr.max_fps)
+
+    def start_reading_lines(loop, lines):
+        "在守护线程中读取stdin，每行放进lines，EOF时放入None"
+        def read():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        threading.Thread(target=read, daemon=True).start()
+
+    async def render(lines, choice=None):
+        "播放当前句子，播放中读到一行时跳过动画；返回False表示输入已经结束"
+        region_name = manager.current_conv("region_conv")
+        if manager.current_conv("clear_region_conv") and region_name is not None:
+            region = manager.screen_regions[region_name]
+            scr.clear_rectangle(region.origin, region.origin + region.size)
+        waiter = mika_animation.Waiter(scheduler=scheduler)
+        printing = asyncio.ensure_future(scr.async_print_tokens(
+            manager.stream_sentence(choice), Vector2D(0, 0), waiter=waiter, frame_time=scheduler.frame_time
+        ))
+        alive = True
+        while not printing.done():
+            key = asyncio.ensure_future(lines.get())
+            await asyncio.wait({printing, key}, return_when=asyncio.FIRST_COMPLETED)
+            if not key.done():
+                key.cancel()
+            elif key.result() is None:
+                alive = False
+                waiter.skip()
+            elif not manager.current_conv("uninterruptable_conv"):
+                waiter.skip()
+        await printing
+        scr.flush()
+        return alive
+
+    async def play():
+        lines = asyncio.Queue()
+        start_reading_lines(asyncio.get_running_loop(), lines)
+        while True:
+            if not await render(lines):
+                return
+            if manager.current_conv("pause_after_conv"):
+                choice = None
+                while True:
+                    line = await lines.get()
+                    if line is None:
+                        return
+                    proceed, new_choice = handle_input_line(line, choice, manager.current_conv("choice_amount_conv"))
+                    if proceed:
+                        break
+                    if new_choice != choice: # 和网页版一样，用新的选择重新播放这一句，显示选中的选项
+                        choice = new_choice
+                        if not await render(lines, choice):
+                            return
+            try:
+                manager.next_sentence()
+            except (IndexError, KeyError):
+                return
+
+    with scr:
+        try:
+            asyncio.run(play())
+        except KeyboardInterrupt:
+            pass
@@ -1,55 +1,126 @@
 
 import re
+from functools import lru_cache
+
+import attr
 
 nothing_sentinent = object()
 
-def parse_convenient_obj_repr(s, macros=None):
-    "使用一个标点符号和字符串表示一个简单对象，比如是数字/字符串/真假"
+# 同一个参数字符串会被反复求值（每个\s, \tick等命令，以及句子的各个conv），
+# 所以先编译成小对象并缓存，求值时只需要调用它：obj(macros)
+compile_cache_size = 1024
+
+_obj_repr_re = re.compile(r"([=;:\+\-\?!\^])(.*)")
+_pair_re = re.compile(r"(.*?)([=;:\+\-\?!\^].*)")
+
+@attr.s(frozen=True, slots=True)
+class ConstantObj:
+    "不依赖宏的对象"
+    value = attr.ib()
+    is_constant = True
+
+    def __call__(self, macros=None):
+        return self.value
+
+@attr.s(frozen=True, slots=True)
+class MacroObj:
+    "!宏名，读取宏的值"
+    name = attr.ib()
+    is_constant = False
+
+    def __call__(self, macros=None):
+        return macros.get(self.name, nothing_sentinent) if macros is not None else nothing_sentinent
+
+@attr.s(frozen=True, slots=True)
+class MacroDefinedObj:
+    "^宏名，宏是否有定义"
+    name = attr.ib()
+    is_constant = False
+
+    def __call__(self, macros=None):
+        return macros is not None and self.name in macros
+
+@attr.s(frozen=True, slots=True)
+class ConvenientDict:
+    "编译好的convenient dict，items是(key, 编译好的对象)"
+    items = attr.ib()
+    is_constant = attr.ib()
+
+    def __call__(self, macros=None):
+        styles = {}
+        for key, obj in self.items:
+            value = obj(macros)
+            if value is nothing_sentinent: # 如果obj没有内容，则跳过该obj
+                continue
+            styles[key] = value
+        return styles
+
+_nothing = ConstantObj(nothing_sentinent)
+
+@lru_cache(maxsize=compile_cache_size)
+def compile_convenient_obj_repr(s):
+    "编译convenient obj repr，返回可以用obj(macros)求值的对象，不依赖宏的对象is_constant为True"
     if s is None:
-        return nothing_sentinent
-    m = re.match(r"([=;:\+\-\?!\^])(.*)", s)
+        return _nothing
+    m = _obj_repr_re.match(s)
     if not m:
-        return nothing_sentinent
+        return _nothing
     type, value = m[1], m[2]
-    obj = None
     if type == "=":
-        obj = value
+        return ConstantObj(value)
     elif type == ";":
-        obj = int(value)
+        return ConstantObj(int(value))
     elif type == ":":
-        obj = float(value)
+        return ConstantObj(float(value))
     elif type == "+":
-        obj = True
+        return ConstantObj(True)
     elif type == "-":
-        obj = False
+        return ConstantObj(False)
     elif type == "?":
-        obj = None
+        return ConstantObj(None)
     elif type == "!":
-        obj = macros.get(value, nothing_sentinent) if macros is not None else nothing_sentinent
+        return MacroObj(value)
     elif type == "^":
-        obj = macros is not None and value in macros
+        return MacroDefinedObj(value)
     else:
         raise ValueError(f"invalid type indicator {type} in {s}")
-    return obj
+
+@lru_cache(maxsize=compile_cache_size)
+def compile_convenient_pair(s):
+    "返回(key, 编译好的对象)"
+    m = _pair_re.match(s)
+    if not m:
+        return nothing_sentinent, _nothing
+    return m[1], compile_convenient_obj_repr(m[2])
+
+@lru_cache(maxsize=compile_cache_size)
+def compile_convenient_dict(s, delimiter=","):
+    "编译convenient pair组成的dict，返回ConvenientDict，求值时每次返回新的dict"
+    items = []
+    for piece in s.split(delimiter):
+        key, obj = compile_convenient_pair(piece)
+        if obj is _nothing:
+            continue
+        items.append((key, obj))
+    return ConvenientDict(tuple(items), all(obj.is_constant for key, obj in items))
+
+def compile_cache_clear():
+    compile_convenient_obj_repr.cache_clear()
+    compile_convenient_pair.cache_clear()
+    compile_convenient_dict.cache_clear()
+
+def parse_convenient_obj_repr(s, macros=None):
+    "使用一个标点符号和字符串表示一个简单对象，比如是数字/字符串/真假"
+    return compile_convenient_obj_repr(s)(macros)
 
 def parse_convenient_pair(s, macros=None):
     "使用一个key和convenient obj repr相连，代表一个键-值对"
-    m = re.match(r"(.*?)([=;:\+\-\?!\^].*)", s)
-    if not m:
-        return nothing_sentinent, nothing_sentinent
-    key, repr = m[1], m[2]
-    obj = parse_convenient_obj_repr(repr, macros=macros)
-    return key, obj
+    key, obj = compile_convenient_pair(s)
+    return key, obj(macros)
 
 def parse_convenient_dict(s, macros=None, delimiter=","):
     "解析convenient pair组成的dict"
-    styles = {}
-    for piece in s.split(delimiter):
-        key, obj = parse_convenient_pair(piece, macros=macros)
-        if obj is nothing_sentinent: # 如果obj没有内容，则跳过该obj
-            continue
-        styles[key] = obj
-    return styles
+    return compile_convenient_dict(s, delimiter)(macros)
 
 def parse_convenient_list(s, delimiter="|", lower=lambda x: x):
     "使用'|'分隔开的参数中的若干个部分"
@@ -58,4 +129,3 @@ def parse_convenient_list(s, delimiter="|", lower=lambda x: x):
         obj = lower(piece)
         arguments.append(obj)
     return arguments
-
@@ -1,9 +1,10 @@
 
 from string import ascii_letters, digits
+import re
 
 import attr
 
-from utilities import Vector2D, list_split, list_join
+from utilities import Vector2D, Cardinal
 
 """
 接口化styleml语言：
@@ -29,11 +30,26 @@ class Token:
     meta = attr.ib(factory=dict)
     printable = False
     require_macros = False
+    
+    def with_meta(self, updates):
+        "和attr.evolve(self, meta=(self.meta | updates))相同，但直接调用构造函数，快一倍左右"
+        return type(self)(self.value, self.meta | updates)
 
 @attr.s(frozen=True)
 class CharacterToken(Token):
     printable = True
 
+@attr.s(frozen=True)
+class _PendingCharacterToken(CharacterToken):
+    """
+    fused时在各扩展之间传递的字符，meta是自己的副本，with_meta直接修改它并返回自己
+    这样各扩展添加元数据时不需要每次都复制token，到render时才生成真正的CharacterToken
+    """
+    
+    def with_meta(self, updates):
+        self.meta.update(updates)
+        return self
+
 @attr.s(frozen=True)
 class BracketToken(Token):
     
@@ -89,123 +105,119 @@ class NewLineToken(ReposToken):
         x, y = original_pos
         return Vector2D(0, y+self.value)
 
+_escape = r"\\[\\\[\]{}@#]" # 转义序列
+_line_special_re = re.compile(_escape + r"|[@#]")
+_unescape_re = re.compile(r"\\([\\\[\]{}@#])")
+_token_re = re.compile(
+    r"(?P<text>[^\\{}]+)"
+    r"|(?P<escape>" + _escape + r")"
+    r"|(?P<bracket>[{}])"
+    r"|(?P<command>\\" # 不跟转义字符的"\"，是命令
+        r"(?P<name>(?:" + _escape + r"|[^\\ \[\r\n])*)"
+        r"(?:\[(?P<argument>(?:" + _escape + r"|\\(?!" + _escape[2:] + r")|[^\\\]])*)(?P<closed>\]?))?"
+        r" ?)" # command后可以有一个空格
+)
+
 @attr.s
 class StyleMLCoreParser:
     """
     StyleML的核心解析器
+    fused为True时，transform和render把各扩展的生成器(stream_transformer等)串联起来，
+    每个token依次经过所有扩展，只在最后生成一个列表，而不是每个扩展各生成一个列表；
+    transform_and_render还会跳过什么也不做的阶段，并就地添加字符的元数据（参见stream_transform_and_render）
     """
-    command_terminator = set("\\ [\r\n")
     
     ext_parser = attr.ib(factory=list)
+    fused = attr.ib(default=False)
     
     @classmethod
-    def tokenize(cls, text, inline_mode=False): # inline_mode不使用多行处理，不截行首行尾，也不除行首空格
-        # 处理转义符
-        text_as_rlist = list(reversed(text))
-        escaped_text_as_list = []
-        while len(text_as_rlist) != 0:
-            ch = text_as_rlist.pop()
-            try:
-                escape = text_as_rlist[-1]
-            except IndexError:
-                escape = ""
-            if ch == "\\" and escape in tuple("\\[]{}@#"): # 处理转义字符
-                text_as_rlist.pop()
-                escaped_text_as_list.append(ch + escape)
+    def _find_unescaped(cls, line, ch):
+        "找到行中第一个未被转义的ch，找不到则返回-1"
+        if ch not in line:
+            return -1
+        for m in _line_special_re.finditer(line):
+            if m[0] == ch:
+                return m.start()
+        return -1
+    
+    @classmethod
+    def _trim_lines(cls, text):
+        "处理行首开始符(@)、去除行首空格、注释符(#)以及换行符转义"
+        pieces = []
+        lines = text.split("\n") # 转义序列不会包含换行符，所以可以直接按行分割
+        for i, line in enumerate(lines):
+            at = cls._find_unescaped(line, "@")
+            if at == -1: # 没行首开始符
+                line = line.lstrip(" ") # 去除前导空格
             else:
-                escaped_text_as_list.append(ch)
-        
+                line = line[at+1:]
+            sharp = cls._find_unescaped(line, "#") # 注释符
+            if sharp != -1:
+                line = line[:sharp]
+            if i == len(lines) - 1:
+                pieces.append(line)
+            elif (len(line) - len(line.rstrip("\\"))) % 2 == 1: # 行尾有未转义的"\"，续行
+                pieces.append(line[:-1])
+            else:
+                pieces.append(line)
+                pieces.append("\n")
+        return "".join(pieces)
+    
+    @classmethod
+    def tokenize(cls, text, inline_mode=False): # inline_mode不使用多行处理，不截行首行尾，也不除行首空格
         if not inline_mode:
-            # 处理行首开始符(@)和注释符(#)
-            trimmed_text_as_rlist = []
-            for line in list_split(escaped_text_as_list, "\n"):
-                leading, *rest = list_split(line, "@")
-                if not rest: # 没行首开始符
-                    leading.reverse()
-                    try:
-                        while (ch := leading.pop()) == " ": # 去除前导空格
-                            pass
-                        leading.append(ch) # 把去多的加回来
-                    except IndexError:
-                        pass # 整行都是空格，pop完了
-                    leading.reverse()
-                    line = leading
-                else:
-                    rest = list_join(rest, "@")
-                    line = rest
-                # 注释符
-                leading, *rest = list_split(line, "#")
-                trimmed_text_as_rlist.append(leading)
-            trimmed_text_as_rlist = list_join(trimmed_text_as_rlist, "\n")
-            trimmed_text_as_rlist.reverse()
-            
-            # 处理换行符转义
-            flattened_text_as_rlist = []
-            while len(trimmed_text_as_rlist) != 0:
-                ch = trimmed_text_as_rlist.pop()
-                try:
-                    escape = trimmed_text_as_rlist[-1]
-                except IndexError:
-                    escape = ""
-                if ch == "\\" and escape == "\n":
-                    trimmed_text_as_rlist.pop()
-                else:
-                    flattened_text_as_rlist.append(ch)
-            flattened_text_as_rlist.reverse()
-        else:
-            escaped_text_as_list.reverse()
-            flattened_text_as_rlist = escaped_text_as_list
-            
+            text = cls._trim_lines(text)
         
-        # 解析tokens
+        # 解析tokens，一次扫描完成
         tokens = []
-        while len(flattened_text_as_rlist) != 0:
-            ch = flattened_text_as_rlist.pop()
-            if ch == "\\": # command
-                command = []
-                try:
-                    while flattened_text_as_rlist[-1] not in cls.command_terminator:
-                        command.append(flattened_text_as_rlist.pop())
-                except IndexError: # 防止文本最后出现命令的情况
-                    pass
-                command = "".join(command)
+        for m in _token_re.finditer(text):
+            kind = m.lastgroup
+            if kind == "text":
+                tokens.extend(map(CharacterToken, m[0]))
+            elif kind == "escape":
+                tokens.append(CharacterToken(m[0][-1]))
+            elif kind == "bracket":
+                tokens.append(BracketToken(m[0]))
+            else: # command
                 meta = {}
-                try:
-                    if flattened_text_as_rlist[-1] == "[":
-                        flattened_text_as_rlist.pop()
-                        argument = []
-                        while flattened_text_as_rlist[-1] != "]":
-                            argument.append(flattened_text_as_rlist.pop()[-1]) # 可能有转义序列
-                        flattened_text_as_rlist.pop()
-                        argument = "".join(argument)
-                        meta["argument"] = argument
-                except IndexError: # 防止文本最后出现无参数的命令
-                    pass
-                if len(flattened_text_as_rlist) != 0 and flattened_text_as_rlist[-1] == " ": # command后可以有一个空格
-                    flattened_text_as_rlist.pop()
-                tokens.append(CommandToken(command, meta))
-            elif ch in tuple("{}"):
-                tokens.append(BracketToken(ch))
-            else:
-                tokens.append(CharacterToken(ch[-1])) # 可能有转义序列
+                if m["closed"]: # 参数没有闭合的时候，丢弃参数
+                    meta["argument"] = _unescape_re.sub(r"\1", m["argument"])
+                tokens.append(CommandToken(m["name"], meta))
         
         return tokens
 
     def transform(self, tokens):
+        if self.fused:
+            return list(self.stream_transform(tokens))
         for parser in self.ext_parser:
             tokens = parser.transformer(tokens)
         return tokens
+    
+    def stream_transform(self, tokens):
+        "返回逐个产生transform结果的迭代器，跳过没有实现transform的扩展"
+        for parser in self.ext_parser:
+            if parser.has_transformer():
+                tokens = parser.stream_transformer(tokens)
+        return iter(tokens)
 
     def renderer(self, tokens):
+        return list(self.stream_renderer(tokens))
+
+    def stream_renderer(self, tokens):
         """
         支持的Token类型：printable的，Anchor, Chain, Repos
         """
-        rendered_tokens = []
         current_pos = Vector2D(0, 0)
         current_anchors = {}
         for t in tokens:
-            rendered_t = attr.evolve(t, meta=(t.meta | {"pos": current_pos}))
-            rendered_tokens.append(rendered_t)
+            if type(t) is _PendingCharacterToken: # meta已经是副本，直接交给真正的token；字符只需要右移
+                meta = t.meta
+                meta["pos"] = current_pos
+                yield CharacterToken(t.value, meta)
+                current_pos += Cardinal.RIGHT
+                continue
+            rendered_t = t.with_meta({"pos": current_pos})
+            yield rendered_t
             if isinstance(rendered_t, ReposToken):
                 current_pos = rendered_t.repos_target(current_pos)
             elif isinstance(rendered_t, AnchorToken):
@@ -215,38 +227,95 @@ class StyleMLCoreParser:
             elif isinstance(rendered_t, ChainToken):
                 current_pos = current_anchors.get(rendered_t.value).meta["pos"] or Vector2D(0, 0)
             if t.printable:
-                current_pos += Vector2D(1, 0)
-        return rendered_tokens
-        
+                current_pos += Cardinal.RIGHT
 
     def render(self, tokens):
+        if self.fused:
+            return list(self.stream_render(tokens))
         tokens = self.renderer(tokens)
         for parser in self.ext_parser:
             tokens = parser.post_renderer(tokens)
         return tokens
+    
+    def stream_render(self, tokens):
+        "返回逐个产生render结果的迭代器，跳过没有实现post_renderer的扩展"
+        tokens = self.stream_renderer(tokens)
+        for parser in self.ext_parser:
+            if parser.has_post_renderer():
+                tokens = parser.stream_post_renderer(tokens)
+        return tokens
+    
+    def transform_and_render(self, tokens):
+        "相当于render(transform(tokens))，fused时只经过一遍"
+        if self.fused:
+            return list(self.stream_transform_and_render(tokens))
+        return self.render(self.transform(tokens))
+    
+    def stream_transform_and_render(self, tokens):
+        """
+        相当于stream_render(stream_transform(tokens))
+        所有扩展的retains_tokens都为False时，字符在各扩展之间以_PendingCharacterToken传递，
+        添加元数据时不复制token，每个字符只在开始和render时各构造一次
+        """
+        if not any(parser.retains_tokens for parser in self.ext_parser):
+            tokens = (
+                _PendingCharacterToken(t.value, dict(t.meta)) if type(t) is CharacterToken else t
+                for t in tokens
+            )
+        return self.stream_render(self.stream_transform(tokens))
 
 @attr.s
 class StyleMLExtParser:
+    """
+    扩展可以实现transformer/post_renderer（处理整个列表），
+    也可以实现stream_transformer/stream_post_renderer（生成器，逐个处理token），只需实现其中一种，另一种由基类转换
+    只实现列表版本的扩展在fused时会先收集前面所有的token，不影响结果
+    retains_tokens为False的扩展保证：收到的token要么原样产生、要么丢弃、要么换成with_meta的结果（最多调用一次），
+    不保存也不重复产生收到的token，这样fused时token可以就地修改（参见StyleMLCoreParser.stream_transform_and_render）
+    """
+    
+    retains_tokens = True
+    
+    @classmethod
+    def has_transformer(cls):
+        "是否实现了transformer或stream_transformer，都没有实现时transform原样返回token"
+        return cls.transformer is not StyleMLExtParser.transformer or cls.stream_transformer is not StyleMLExtParser.stream_transformer
+    
+    @classmethod
+    def has_post_renderer(cls):
+        return cls.post_renderer is not StyleMLExtParser.post_renderer or cls.stream_post_renderer is not StyleMLExtParser.stream_post_renderer
     
     def transformer(self, tokens):
-        return tokens
+        return list(self.stream_transformer(tokens))
+    
+    def stream_transformer(self, tokens):
+        if type(self).transformer is StyleMLExtParser.transformer: # 两种都没有实现
+            yield from tokens
+        else:
+            yield from self.transformer(list(tokens))
     
     def post_renderer(self, tokens):
-        return tokens
+        return list(self.stream_post_renderer(tokens))
+    
+    def stream_post_renderer(self, tokens):
+        if type(self).post_renderer is StyleMLExtParser.post_renderer:
+            yield from tokens
+        else:
+            yield from self.post_renderer(list(tokens))
 
 @attr.s
 class ReturnCharExtParser(StyleMLExtParser):
     
-    def transformer(self, tokens):
-        transformed_tokens = []
+    retains_tokens = False
+    
+    def stream_transformer(self, tokens):
         for t in tokens:
             if isinstance(t, CharacterToken) and t.value == "\n":
-                transformed_tokens.append(NewLineToken(1))
+                yield NewLineToken(1)
             elif isinstance(t, CharacterToken) and t.value == "\r":
-                transformed_tokens.append(NewLineToken(0))
+                yield NewLineToken(0)
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
+                yield t
 
 if __name__ == "__main__":
     import sys
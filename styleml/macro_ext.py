@@ -1,5 +1,7 @@
 
 import re
+from functools import lru_cache
+from collections.abc import Mapping, MutableMapping
 
 from .core import StyleMLExtParser, StyleMLCoreParser
 from .core import CharacterToken, CommandToken, BracketToken
@@ -7,6 +9,106 @@ from .convenient_argument import parse_convenient_pair, parse_convenient_dict
 
 import attr
 
+_missing = object()
+_deleted = object() # 删除宏时，若父层中有该宏，则在当前层放置此标记
+
+class MacroScope(MutableMapping):
+    """
+    写时复制的宏环境
+    由一个可写的当前层和若干不再修改的父层组成，查找时从当前层向父层逐层查找
+    copy()时冻结当前层，由原环境和副本共享，所以复制的代价是O(1)的
+    父层过多时会合并成一层，以保证查找速度
+    初始的宏放在最底层(base)，若reads是dict，则记录查找到最底层的宏（宏名->读到的值，没有该宏时为missing），
+    即依赖于初始宏的读取，复制时共享
+    """
+    max_depth = 16
+    missing = _missing
+    
+    def __init__(self, macros=(), reads=None):
+        self._local = {}
+        self._parents = ()
+        self._base = dict(macros)
+        self.reads = reads
+    
+    def __getitem__(self, key):
+        value = self._local.get(key, _missing)
+        if value is _missing:
+            for layer in self._parents:
+                value = layer.get(key, _missing)
+                if value is not _missing:
+                    break
+            else:
+                value = self._base.get(key, _missing)
+                if self.reads is not None:
+                    self.reads[key] = value
+        if value is _missing or value is _deleted:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        self._local[key] = value
+    
+    def __delitem__(self, key):
+        self[key] # 不存在时抛出KeyError
+        if key in self._base or any(key in layer for layer in self._parents):
+            self._local[key] = _deleted
+        else:
+            del self._local[key]
+    
+    def __iter__(self):
+        return iter(self._flatten())
+    
+    def __len__(self):
+        return len(self._flatten())
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({self._flatten()!r})"
+    
+    @staticmethod
+    def _merge_layers(layers):
+        "合并若干层（靠前的优先），结果中可能有删除标记"
+        merged = {}
+        for layer in reversed(layers):
+            merged.update(layer)
+        return merged
+    
+    def _flatten(self):
+        merged = self._merge_layers((self._local,) + self._parents + (self._base,))
+        return {k: v for k, v in merged.items() if v is not _deleted}
+    
+    def _freeze(self):
+        if self._local:
+            self._parents = (self._local,) + self._parents
+            self._local = {}
+        if len(self._parents) > self.max_depth:
+            self._parents = (self._merge_layers(self._parents),)
+    
+    def copy(self):
+        self._freeze()
+        new = type(self)(reads=self.reads)
+        new._parents = self._parents
+        new._base = self._base
+        return new
+    
+    def _changes_since_copy(self, other):
+        "若other是由self复制后修改而来的，返回other在复制后修改过的层，否则返回None"
+        if self._local or other._base is not self._base:
+            return None
+        shared = len(self._parents)
+        new_layers = len(other._parents) - shared
+        if new_layers < 0 or any(a is not b for a, b in zip(other._parents[new_layers:], self._parents)):
+            return None
+        return (other._local,) + other._parents[:new_layers]
+    
+    def update(self, other=(), /, **kwargs):
+        if isinstance(other, MacroScope) and (changes := self._changes_since_copy(other)) is not None:
+            # 只需要应用复制后修改过的部分，与逐个复制所有宏的结果相同
+            for k, v in self._merge_layers(changes).items():
+                if v is not _deleted:
+                    self._local[k] = v
+            other = ()
+        super().update(other, **kwargs)
+
 @attr.s
 class MacroExtParser(StyleMLExtParser):
     r"""
@@ -19,15 +121,48 @@ class MacroExtParser(StyleMLExtParser):
     调用宏的命令如：\!宏名[参数]
     命令参数和命令不能嵌套，因此，if/else以基于宏的方式实现
     \ifelse[a=a,b=b,then=c,else=d] -> c if a == b else d
+    展开后的宏文本会被缓存tokenize结果，缓存大小由tokenize_cache_size指定（None为不限大小，0为不缓存）
     """
+    
+    retains_tokens = False
+    
     initial_macros = attr.ib(factory=dict)
     tokenize = attr.ib(default=StyleMLCoreParser.tokenize)
+    tokenize_cache_size = attr.ib(default=256)
+    
+    def __attrs_post_init__(self):
+        self.tokenize_inline = lru_cache(maxsize=self.tokenize_cache_size)(self._tokenize_inline)
     
-    def expand_and_get_defined_macros(self, tokens, initial_macros=None):
+    def _tokenize_inline(self, text):
+        return tuple(self.tokenize(text, inline_mode=True)) # token是frozen的，可以共享
+    
+    def tokenize_cache_info(self):
+        "返回缓存的hits, misses, maxsize, currsize"
+        return self.tokenize_inline.cache_info()
+    
+    def tokenize_cache_clear(self):
+        self.tokenize_inline.cache_clear()
+    
+    def expand_and_get_defined_macros(self, tokens, initial_macros=None, reads=None):
+        """
+        展开宏，返回展开后的tokens和最终的宏环境
+        若reads是dict，则在reads中记录从initial_macros中读到的宏（参见MacroScope）
+        initial_macros有tracking_copy方法时（如ModularMacroProxy）由它记录，否则须是Mapping
+        """
+        current_macros = self._initial_scope(initial_macros, reads)
+        return list(self.iter_expand(tokens, current_macros)), current_macros
+    
+    def _initial_scope(self, initial_macros, reads=None):
         if initial_macros is None:
             initial_macros = self.initial_macros
-        current_macros = initial_macros.copy()
-        transformed_tokens = []
+        if reads is not None and hasattr(initial_macros, "tracking_copy"):
+            return initial_macros.tracking_copy(reads) # 如ModularMacroProxy，由它自己记录读到的宏
+        if isinstance(initial_macros, dict) or (reads is not None and isinstance(initial_macros, Mapping)):
+            return MacroScope(initial_macros, reads=reads)
+        return initial_macros.copy() # MacroScope和ModularMacroProxy的复制都是O(1)的
+    
+    def iter_expand(self, tokens, current_macros):
+        "逐个产生展开后的token，宏的定义直接写入current_macros"
         for t in tokens:
             if isinstance(t, CommandToken) and t.value == "def":
                 name, expand_to = parse_convenient_pair(t.meta.get("argument"), macros=current_macros)
@@ -45,10 +180,10 @@ class MacroExtParser(StyleMLExtParser):
                 macro_template = current_macros[macro_name]
                 macro_arguments.update({"": "%"})
                 expanded_text = re.sub(r"%(.*?)%", lambda match: macro_arguments.get(match[1], ""), macro_template)
-                expanded_tokens = self.tokenize(expanded_text, inline_mode=True)
+                expanded_tokens = self.tokenize_inline(expanded_text)
                 # recursive expansion
-                recursive_expanded_tokens, inner_macros = self.expand_and_get_defined_macros(expanded_tokens, initial_macros=current_macros)
-                transformed_tokens.extend(recursive_expanded_tokens)
+                inner_macros = current_macros.copy()
+                yield from self.iter_expand(expanded_tokens, inner_macros)
                 current_macros.update(inner_macros)
             elif isinstance(t, CommandToken) and t.value == "ifelse":
                 arguments = parse_convenient_dict(t.meta.get("argument", ""), macros=current_macros)
@@ -60,18 +195,29 @@ class MacroExtParser(StyleMLExtParser):
                 else:
                     exp = exp_else
                 if exp: # 有可能then或else没有指定内容
-                    expanded_tokens = self.tokenize(exp, inline_mode=True)
-                    recursive_expanded_tokens, inner_macros = self.expand_and_get_defined_macros(expanded_tokens, initial_macros=current_macros)
-                    transformed_tokens.extend(recursive_expanded_tokens)
+                    expanded_tokens = self.tokenize_inline(exp)
+                    inner_macros = current_macros.copy()
+                    yield from self.iter_expand(expanded_tokens, inner_macros)
                     current_macros.update(inner_macros)
             elif isinstance(t, CommandToken) and t.value == "debug_print_macros":
                 print(f"printing macros from {t}: \n", current_macros)
             elif t.require_macros:
-                t = attr.evolve(t, meta=(t.meta | {"macros": current_macros.copy()}))
-                transformed_tokens.append(t)
+                t = t.with_meta({"macros": current_macros.copy()})
+                yield t
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens, current_macros
+                yield t
+    
+    def expand_and_get_dependencies(self, tokens, initial_macros=None):
+        """
+        展开宏，并返回展开后的tokens、最终的宏环境和依赖的宏(宏名->读到的值)
+        依赖是随着读取更新的，之后的扩展通过tokens中的宏读取时，也会记录到其中
+        """
+        reads = {}
+        expanded, macros = self.expand_and_get_defined_macros(tokens, initial_macros, reads=reads)
+        return expanded, macros, reads
     
     def transformer(self, tokens):
         return self.expand_and_get_defined_macros(tokens, initial_macros=None)[0]
+    
+    def stream_transformer(self, tokens):
+        return self.iter_expand(tokens, self._initial_scope(None))
@@ -20,23 +20,23 @@ class PortalExtParser(StyleMLExtParser):
     \offset[col#...,row#...]会给输出位置增加偏移量
     """
     
-    def transformer(self, tokens):
-        transformed_tokens = []
+    retains_tokens = False
+    
+    def stream_transformer(self, tokens):
         for t in tokens:
             if isinstance(t, CommandToken) and t.value in ("n", "r"):
                 amount = parse_convenient_obj_repr(t.meta.get("argument", "?"), macros=t.meta.get("macros") or {}) or {"n": 1, "r": 0}[t.value]
-                transformed_tokens.append(NewLineToken(amount))
+                yield NewLineToken(amount)
             elif isinstance(t, CommandToken) and t.value in ("anchor", "anchorrm", "chain"):
                 argument = t.meta.get("argument")
-                transformed_tokens.append({
+                yield {
                     "anchor": AnchorToken,
                     "anchorrm": AnchorRemoveToken,
                     "chain": ChainToken
-                    }[t.value](argument))
+                    }[t.value](argument)
             elif isinstance(t, CommandToken) and t.value in ("repos", "offset"):
                 arguments = parse_convenient_dict(t.meta.get("argument", ""), macros=t.meta.get("macros") or {})
                 pos = Vector2D(arguments.get("col"), arguments.get("row"))
-                transformed_tokens.append({"repos": AbsReposToken, "offset": RelReposToken}[t.value](pos))
+                yield {"repos": AbsReposToken, "offset": RelReposToken}[t.value](pos)
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
+                yield t
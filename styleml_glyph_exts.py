@@ -15,24 +15,22 @@ class CustomGlyph:
 @attr.s
 class GlyphsetExtParser(StyleMLExtParser):
     
+    retains_tokens = False
+    
     initial_glyphset = attr.ib(default=None)
     
-    def transformer(self, tokens):
+    def stream_transformer(self, tokens):
         step_glyphset = [self.initial_glyphset]
-        transformed_tokens = []
         for t in tokens:
             if isinstance(t, BracketToken) and t.is_left():
                 step_glyphset.append(step_glyphset[-1])
-                transformed_tokens.append(t)
+                yield t
             elif isinstance(t, BracketToken) and t.is_right():
                 step_glyphset.pop()
-                transformed_tokens.append(t)
+                yield t
             elif isinstance(t, CommandToken) and t.value == "g":
-                transformed_tokens.append(
-                    CharacterToken(value=CustomGlyph(type=step_glyphset[-1], value=t.meta.get("argument")))
-                    )
+                yield CharacterToken(value=CustomGlyph(type=step_glyphset[-1], value=t.meta.get("argument")))
             elif isinstance(t, CommandToken) and t.value == "glyphset":
                 step_glyphset[-1] = t.meta.get("argument")
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
\ No newline at end of file
+                yield t
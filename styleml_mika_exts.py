@@ -1,4 +1,6 @@
 
+from array import array
+
 import attr
 
 from styleml.core import StyleMLExtParser
@@ -6,32 +8,39 @@ from styleml.core import Token, CharacterToken, BracketToken, CommandToken
 from styleml.convenient_argument import parse_convenient_dict, parse_convenient_obj_repr
 from utilities import Vector2D, Cardinal
 
-from mika_screen import ScreenCell
+from mika_screen import CellStyle
 
 @attr.s
 class StyleExtParser(StyleMLExtParser):
     
+    retains_tokens = False
+    
     initial_style = attr.ib(default=None)
     
-    def transformer(self, tokens):
+    def stream_transformer(self, tokens):
+        """
+        给字符加上style元数据，是共享的CellStyle实例
+        """
         step_style = [self.initial_style or {}] # 解析嵌套格式标记的时候，使用栈来实现每一步的模板记录
-        transformed_tokens = []
+        step_cell_style = [CellStyle.intern(**step_style[-1])] # 每一步对应的CellStyle，只在风格改变时查找
         for t in tokens:
             if isinstance(t, CharacterToken):
-                t = attr.evolve(t, meta=(t.meta | {"style": step_style[-1]}))
-                transformed_tokens.append(t)
+                t = t.with_meta({"style": step_cell_style[-1]})
+                yield t
             elif isinstance(t, BracketToken) and t.is_left():
                 step_style.append(step_style[-1])
-                transformed_tokens.append(t)
+                step_cell_style.append(step_cell_style[-1])
+                yield t
             elif isinstance(t, BracketToken) and t.is_right():
                 step_style.pop()
-                transformed_tokens.append(t)
+                step_cell_style.pop()
+                yield t
             elif isinstance(t, CommandToken) and t.value == "s":
                 parsed_argument = parse_convenient_dict(t.meta.get("argument", ""), macros=t.meta.get("macros") or {})
                 step_style[-1] = step_style[-1] | parsed_argument
+                step_cell_style[-1] = CellStyle.intern(**step_style[-1])
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
+                yield t
 
 @attr.s
 class AnimationExtParser(StyleMLExtParser):
@@ -43,16 +52,17 @@ class AnimationExtParser(StyleMLExtParser):
     \tickm[...]: 设置延时倍率
     """
     
+    retains_tokens = False
+    
     initial_tick = attr.ib(default=0)
     
-    def transformer(self, tokens):
+    def stream_transformer(self, tokens):
         step_tick = [self.initial_tick]
         step_tick_multiplier = [1]
-        transformed_tokens = []
         for t in tokens:
             if isinstance(t, CharacterToken):
-                t = attr.evolve(t, meta=(t.meta | {"post_delay": step_tick[-1] * step_tick_multiplier[-1]}))
-                transformed_tokens.append(t)
+                t = t.with_meta({"post_delay": step_tick[-1] * step_tick_multiplier[-1]})
+                yield t
             elif isinstance(t, CommandToken) and t.value == "tick":
                 argument = t.meta.get("argument")
                 step_tick[-1] = parse_convenient_obj_repr(argument, macros=t.meta.get("macros") or {})
@@ -61,30 +71,147 @@ class AnimationExtParser(StyleMLExtParser):
                 step_tick_multiplier[-1] = parse_convenient_obj_repr(argument, macros=t.meta.get("macros") or {})
             elif isinstance(t, CommandToken) and t.value == "delay":
                 delay = parse_convenient_obj_repr(t.meta.get("argument"), macros=t.meta.get("macros") or {})
-                transformed_tokens.append(Token(meta={"post_delay": delay}))
+                yield Token(meta={"post_delay": delay})
             elif isinstance(t, CommandToken) and t.value == "delaym":
                 delay = parse_convenient_obj_repr(t.meta.get("argument"), macros=t.meta.get("macros") or {})
-                transformed_tokens.append(Token(meta={"post_delay": step_tick[-1] * delay}))
+                yield Token(meta={"post_delay": step_tick[-1] * delay})
             elif isinstance(t, CommandToken) and t.value == "delayc":
                 delay = parse_convenient_obj_repr(t.meta.get("argument"), macros=t.meta.get("macros") or {})
-                transformed_tokens.append(Token(meta={"post_delay": step_tick[-1] * step_tick_multiplier[-1] * delay}))
+                yield Token(meta={"post_delay": step_tick[-1] * step_tick_multiplier[-1] * delay})
             elif isinstance(t, BracketToken) and t.is_left():
                 step_tick.append(step_tick[-1])
                 step_tick_multiplier.append(step_tick_multiplier[-1])
-                transformed_tokens.append(t)
+                yield t
             elif isinstance(t, BracketToken) and t.is_right():
                 step_tick.pop()
                 step_tick_multiplier.pop()
-                transformed_tokens.append(t)
+                yield t
             else:
-                transformed_tokens.append(t)
-        return transformed_tokens
+                yield t
+
+_counted = 1 # 计入行的长度
+_word = 2 # 英文单词的字符
+_break = 4 # 其他可打印字符，会断开单词；都不是的token（不可打印的）不影响单词
+
+def _is_word_char(ch):
+    return isinstance(ch, str) and ch.isascii() and (ch.isalnum() or ch == "'")
+
+@attr.s(eq=False)
+class RowLayout:
+    """
+    换行布局，用数组记录每个token换行前的位置，以及加上单词移动之后的列(eff)
+    token用place逐个放入：和上次放在同一下标的token相同时直接沿用，不同时丢弃之后的部分重新计算，
+    所以同一个句子再次换行时（如只有选项标记不同），只重新计算改变之后的部分；给token加上换行后的位置仍然每次都要做
+    word_wrap为True时，英文单词不从中间断开，跨过行尾的单词整个移到下一行（比一行还长的单词照常断开）
+    """
+    columns = attr.ib(default=0)
+    word_wrap = attr.ib(default=False)
+    xs = attr.ib(init=False, factory=lambda: array("l"))
+    ys = attr.ib(init=False, factory=lambda: array("l"))
+    kinds = attr.ib(init=False, factory=bytearray)
+    eff = attr.ib(init=False, factory=lambda: array("l"))
+    word_starts = attr.ib(init=False, factory=lambda: array("l")) # 放入每个token之后，当前单词的第一个token，没有则为-1
+    row_length = attr.ib(init=False, factory=lambda: array("l")) # 每行最大的eff
+    row_shift = attr.ib(init=False, factory=lambda: array("l")) # 每行因为移动单词，之后的token要增加的列数
+    row_start = attr.ib(init=False, factory=lambda: array("l")) # 每行第一次出现时，按之前各行的长度确定的起始行号
+    
+    def __len__(self):
+        return len(self.xs)
+    
+    @property
+    def word_start(self):
+        return self.word_starts[-1] if self.word_starts else -1
+    
+    def row_height(self, y):
+        return self.row_length[y] // self.columns + 1 if self.columns else 1
+    
+    def exact_row_starts(self):
+        "按最终的各行长度算出的每行起始行号"
+        starts = array("l", bytes(len(self.row_start) * array("l").itemsize))
+        for y in range(1, len(starts)):
+            starts[y] = starts[y - 1] + self.row_height(y - 1)
+        return starts
+    
+    def place(self, i, x, y, kind):
+        if i < len(self.xs):
+            if self.xs[i] == x and self.ys[i] == y and self.kinds[i] == kind:
+                return
+            self.truncate(i)
+        self._push(x, y, kind)
+    
+    def truncate(self, n):
+        "只保留前n个token"
+        if n >= len(self.xs):
+            return
+        word_start = self.word_starts[n - 1] if n else -1
+        redo = () # 没结束的单词可能被之后的token移动过，要重新放入
+        if word_start >= 0:
+            redo = list(zip(self.xs[word_start:n], self.ys[word_start:n], self.kinds[word_start:n]))
+            n = word_start
+        del self.xs[n:], self.ys[n:], self.kinds[n:], self.eff[n:], self.word_starts[n:]
+        rows = max(self.ys) + 1 if n else 0
+        del self.row_start[rows:], self.row_length[rows:], self.row_shift[rows:]
+        for y in range(rows):
+            self.row_length[y] = self.row_shift[y] = 0
+        for x, y, kind, e in zip(self.xs, self.ys, self.kinds, self.eff):
+            if kind & _counted and e > self.row_length[y]:
+                self.row_length[y] = e
+            if e - x > self.row_shift[y]:
+                self.row_shift[y] = e - x
+        for x, y, kind in redo:
+            self._push(x, y, kind)
+    
+    def _push(self, x, y, kind):
+        i = len(self.xs)
+        while len(self.row_start) <= y: # 新的行
+            self.row_start.append(self.row_start[-1] + self.row_height(len(self.row_start) - 1) if self.row_start else 0)
+            self.row_length.append(0)
+            self.row_shift.append(0)
+        e = x + self.row_shift[y]
+        word_start = self.word_start
+        if kind & _word:
+            prev = i - 1 # 单词中间可以有不可打印的token，它们和下一个字符位置相同
+            if (
+                word_start >= 0 and self.ys[word_start] == y and self.ys[prev] == y
+                and x == self.xs[prev] + (1 if self.kinds[prev] & _word else 0)
+                ):
+                start = self.eff[word_start]
+                if self.columns and e % self.columns == 0 and start % self.columns != 0 and e - start < self.columns:
+                    move = self.columns - start % self.columns # 单词跨过了行尾，整个移到下一行
+                    for k in range(word_start, i):
+                        if self.ys[k] == y:
+                            self.eff[k] += move
+                            if self.kinds[k] & _counted and self.eff[k] > self.row_length[y]:
+                                self.row_length[y] = self.eff[k]
+                    self.row_shift[y] += move
+                    e += move
+            else:
+                word_start = i
+        elif kind & _break:
+            word_start = -1
+        self.xs.append(x)
+        self.ys.append(y)
+        self.kinds.append(kind)
+        self.eff.append(e)
+        self.word_starts.append(word_start)
+        if kind & _counted and e > self.row_length[y]:
+            self.row_length[y] = e
 
 @attr.s
 class LineWrapExtParser(StyleMLExtParser):
+    """
+    streaming为False时，先看完所有token确定每行的长度，再换行
+    streaming为True时，边读边换行：某行之后出现了新的行时，该行占用的行数就固定了
+    token都是从上往下输出时（没有往回的\\repos, \\chain等），两种方式结果相同；否则之后写回该行的超出部分会和下面的行重叠
+    word_wrap为True时英文单词不从中间断开（参见RowLayout）
+    layout可以传入上次用过的RowLayout，只重新计算和上次不同的部分
+    """
     
     cr_area = attr.ib(default=Vector2D(0, 0)) # 0 代表无限制
     only_printable = attr.ib(default=True)
+    streaming = attr.ib(default=False)
+    word_wrap = attr.ib(default=False)
+    layout = attr.ib(default=None)
     
     @property
     def columns(self):
@@ -94,51 +221,85 @@ class LineWrapExtParser(StyleMLExtParser):
     def rows(self):
         return self.cr_area.y
     
+    def get_layout(self):
+        if self.layout is None or self.layout.columns != self.columns or self.layout.word_wrap != self.word_wrap:
+            self.layout = RowLayout(columns=self.columns, word_wrap=self.word_wrap)
+        return self.layout
+    
+    def token_kind(self, t):
+        kind = _counted if t.printable or not self.only_printable else 0
+        if self.word_wrap and t.printable:
+            kind |= _word if _is_word_char(t.value) else _break
+        return kind
+    
     def post_renderer(self, tokens):
-        columns_for_row = {} # 先确定每行的长度
-        total_row_amount = 0 # 和一共多少行
-        for t in tokens:
-            if self.only_printable and not t.printable:
-                continue
+        layout = self.get_layout()
+        place, token_kind = layout.place, self.token_kind
+        for i, t in enumerate(tokens):
             x, y = t.meta["pos"]
-            columns_for_row[y] = max(columns_for_row.get(y, 0), x)
-            total_row_amount = max(total_row_amount, y)
-        total_row_amount += 1
-        wrapped_row = {} # 再算出wrap前对应wrap后的行号
-        accumulated_rows = 0
-        for i in range(total_row_amount):
-            wrapped_row[i] = accumulated_rows
-            length = columns_for_row.get(i, 0)
-            split_into = (length // self.columns if self.columns else 0) + 1
-            accumulated_rows += split_into
-        transformed_tokens = []
-        for t in tokens:
+            place(i, x, y, token_kind(t))
+        layout.truncate(len(tokens))
+        return list(self._wrapped(layout, tokens, 0, layout.exact_row_starts()))
+    
+    def stream_post_renderer(self, tokens):
+        if not self.streaming:
+            yield from self.post_renderer(list(tokens))
+            return
+        layout = self.get_layout()
+        place, token_kind = layout.place, self.token_kind
+        if not self.word_wrap: # token放入之后位置就不会再改变
+            columns, rows, only_printable = self.columns, self.rows, self.only_printable
+            row_start = layout.row_start
+            i = -1
+            for i, t in enumerate(tokens):
+                x, y = t.meta["pos"]
+                place(i, x, y, _counted if t.printable or not only_printable else 0)
+                row = row_start[y] + (x // columns if columns else 0)
+                if rows != 0 and row >= rows:
+                    continue # 超出界限了
+                yield t.with_meta({"pos": Vector2D(x % columns if columns else x, row)})
+            layout.truncate(i + 1)
+            return
+        pending = [] # 位置还可能改变的token（没结束的单词）
+        first = 0 # pending[0]的下标
+        for i, t in enumerate(tokens):
             x, y = t.meta["pos"]
-            row = wrapped_row[y] + (x // self.columns if self.columns else 0)
-            col = x % self.columns if self.columns else x
-            if self.rows != 0 and row >= self.rows:
+            place(i, x, y, token_kind(t))
+            pending.append(t)
+            word_start = layout.word_starts[i] # 复用的layout中i之后可能还有上次的token
+            final = word_start if word_start >= 0 else i + 1 # 在这之前的token位置不会再改变
+            if final > first:
+                yield from self._wrapped(layout, pending[:final - first], first, layout.row_start)
+                del pending[:final - first]
+                first = final
+        yield from self._wrapped(layout, pending, first, layout.row_start)
+        layout.truncate(first + len(pending))
+    
+    def _wrapped(self, layout, tokens, first, row_start):
+        "给下标从first开始的tokens加上换行后的位置，丢弃超出区域的"
+        columns, rows = self.columns, self.rows
+        eff, ys = layout.eff, layout.ys
+        for i, t in enumerate(tokens, first):
+            e = eff[i]
+            if columns:
+                col, row = e % columns, row_start[ys[i]] + e // columns
+            else:
+                col, row = e, row_start[ys[i]]
+            if rows != 0 and row >= rows:
                 continue # 超出界限了
-            t = attr.evolve(t, meta=(t.meta | {"pos": Vector2D(col, row)}))
-            transformed_tokens.append(t)
-        return transformed_tokens
+            yield t.with_meta({"pos": Vector2D(col, row)})
 
 @attr.s
-class AffineTransformExtParser:
+class AffineTransformExtParser(StyleMLExtParser):
     origin = attr.ib(default=Vector2D(0, 0))
     col_grow = attr.ib(default=Vector2D(0, 1))
     row_grow = attr.ib(default=Vector2D(1, 0))
     
-    def post_renderer(self, tokens):
-        transformed_tokens = []
+    def stream_post_renderer(self, tokens):
         for t in tokens:
             if pos := t.meta.get("pos"):
-                t = attr.evolve(
-                    t, meta=(
-                        t.meta | {"pos": pos.affine_transform(self.row_grow, self.col_grow, self.origin)}
-                        )
-                    )
-            transformed_tokens.append(t)
-        return transformed_tokens
+                t = t.with_meta({"pos": pos.affine_transform(self.row_grow, self.col_grow, self.origin)})
+            yield t
 
 if __name__ == "__main__":
     from styleml.core import StyleMLCoreParser, ReturnCharExtParser
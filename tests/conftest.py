@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def _in_repo_root(monkeypatch):
+    "各脚本都用相对路径读取resources等文件"
+    monkeypatch.chdir(ROOT)
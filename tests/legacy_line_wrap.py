@@ -0,0 +1,47 @@
+# 改写前的LineWrapExtParser（用dict扫描两遍的版本），原样保留，用来和现在的实现做差分测试
+
+import attr
+
+from utilities import Vector2D
+
+@attr.s
+class LineWrapExtParser:
+    
+    cr_area = attr.ib(default=Vector2D(0, 0)) # 0 代表无限制
+    only_printable = attr.ib(default=True)
+    
+    @property
+    def columns(self):
+        return self.cr_area.x
+    
+    @property
+    def rows(self):
+        return self.cr_area.y
+    
+    def post_renderer(self, tokens):
+        columns_for_row = {} # 先确定每行的长度
+        total_row_amount = 0 # 和一共多少行
+        for t in tokens:
+            if self.only_printable and not t.printable:
+                continue
+            x, y = t.meta["pos"]
+            columns_for_row[y] = max(columns_for_row.get(y, 0), x)
+            total_row_amount = max(total_row_amount, y)
+        total_row_amount += 1
+        wrapped_row = {} # 再算出wrap前对应wrap后的行号
+        accumulated_rows = 0
+        for i in range(total_row_amount):
+            wrapped_row[i] = accumulated_rows
+            length = columns_for_row.get(i, 0)
+            split_into = (length // self.columns if self.columns else 0) + 1
+            accumulated_rows += split_into
+        transformed_tokens = []
+        for t in tokens:
+            x, y = t.meta["pos"]
+            row = wrapped_row[y] + (x // self.columns if self.columns else 0)
+            col = x % self.columns if self.columns else x
+            if self.rows != 0 and row >= self.rows:
+                continue # 超出界限了
+            t = attr.evolve(t, meta=(t.meta | {"pos": Vector2D(col, row)}))
+            transformed_tokens.append(t)
+        return transformed_tokens
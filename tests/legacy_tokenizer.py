@@ -0,0 +1,118 @@
+# 改写前的StyleMLCoreParser.tokenize（逐字符处理的版本），原样保留，用来和现在的实现做差分测试
+
+from styleml.core import CharacterToken, BracketToken, CommandToken
+
+command_terminator = set("\\ [\r\n")
+
+def list_split(l, sep):
+    l = iter(l)
+    splitted = []
+    while True:
+        sub = []
+        try:
+            while (item := next(l)) != sep:
+                sub.append(item)
+        except StopIteration:
+            break
+        finally:
+            splitted.append(sub)
+    return splitted
+
+def list_join(l, sep):
+    joined = l[0]
+    for sub in l[1:]:
+        joined.append(sep)
+        joined.extend(sub)
+    return joined
+
+def tokenize(text, inline_mode=False): # inline_mode不使用多行处理，不截行首行尾，也不除行首空格
+    # 处理转义符
+    text_as_rlist = list(reversed(text))
+    escaped_text_as_list = []
+    while len(text_as_rlist) != 0:
+        ch = text_as_rlist.pop()
+        try:
+            escape = text_as_rlist[-1]
+        except IndexError:
+            escape = ""
+        if ch == "\\" and escape in tuple("\\[]{}@#"): # 处理转义字符
+            text_as_rlist.pop()
+            escaped_text_as_list.append(ch + escape)
+        else:
+            escaped_text_as_list.append(ch)
+
+    if not inline_mode:
+        # 处理行首开始符(@)和注释符(#)
+        trimmed_text_as_rlist = []
+        for line in list_split(escaped_text_as_list, "\n"):
+            leading, *rest = list_split(line, "@")
+            if not rest: # 没行首开始符
+                leading.reverse()
+                try:
+                    while (ch := leading.pop()) == " ": # 去除前导空格
+                        pass
+                    leading.append(ch) # 把去多的加回来
+                except IndexError:
+                    pass # 整行都是空格，pop完了
+                leading.reverse()
+                line = leading
+            else:
+                rest = list_join(rest, "@")
+                line = rest
+            # 注释符
+            leading, *rest = list_split(line, "#")
+            trimmed_text_as_rlist.append(leading)
+        trimmed_text_as_rlist = list_join(trimmed_text_as_rlist, "\n")
+        trimmed_text_as_rlist.reverse()
+
+        # 处理换行符转义
+        flattened_text_as_rlist = []
+        while len(trimmed_text_as_rlist) != 0:
+            ch = trimmed_text_as_rlist.pop()
+            try:
+                escape = trimmed_text_as_rlist[-1]
+            except IndexError:
+                escape = ""
+            if ch == "\\" and escape == "\n":
+                trimmed_text_as_rlist.pop()
+            else:
+                flattened_text_as_rlist.append(ch)
+        flattened_text_as_rlist.reverse()
+    else:
+        escaped_text_as_list.reverse()
+        flattened_text_as_rlist = escaped_text_as_list
+
+
+    # 解析tokens
+    tokens = []
+    while len(flattened_text_as_rlist) != 0:
+        ch = flattened_text_as_rlist.pop()
+        if ch == "\\": # command
+            command = []
+            try:
+                while flattened_text_as_rlist[-1] not in command_terminator:
+                    command.append(flattened_text_as_rlist.pop())
+            except IndexError: # 防止文本最后出现命令的情况
+                pass
+            command = "".join(command)
+            meta = {}
+            try:
+                if flattened_text_as_rlist[-1] == "[":
+                    flattened_text_as_rlist.pop()
+                    argument = []
+                    while flattened_text_as_rlist[-1] != "]":
+                        argument.append(flattened_text_as_rlist.pop()[-1]) # 可能有转义序列
+                    flattened_text_as_rlist.pop()
+                    argument = "".join(argument)
+                    meta["argument"] = argument
+            except IndexError: # 防止文本最后出现无参数的命令
+                pass
+            if len(flattened_text_as_rlist) != 0 and flattened_text_as_rlist[-1] == " ": # command后可以有一个空格
+                flattened_text_as_rlist.pop()
+            tokens.append(CommandToken(command, meta))
+        elif ch in tuple("{}"):
+            tokens.append(BracketToken(ch))
+        else:
+            tokens.append(CharacterToken(ch[-1])) # 可能有转义序列
+
+    return tokens
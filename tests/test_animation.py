@@ -0,0 +1,164 @@
+import asyncio
+
+from mika_animation import AnimationManager, AnimationScheduler, AnimationWrapper, FakeClock, Waiter
+
+def make_scheduler(frame_time=1 / 60):
+    clock = FakeClock()
+    return clock, AnimationScheduler(clock=clock, sleep=clock.sleep, frame_time=frame_time)
+
+def test_wake_up_order_and_time():
+    clock, scheduler = make_scheduler(frame_time=0)
+    woken = []
+
+    async def wait(name, delay):
+        assert await scheduler.wait(delay)
+        woken.append((name, clock()))
+
+    async def main():
+        await asyncio.gather(wait("c", 0.3), wait("a", 0.1), wait("b", 0.2), wait("a2", 0.1))
+
+    asyncio.run(main())
+    assert woken == [("a", 0.1), ("a2", 0.1), ("b", 0.2), ("c", 0.3)]
+    assert scheduler.pending == 0
+
+def test_deadlines_in_one_frame_share_a_tick():
+    clock, scheduler = make_scheduler(frame_time=0.1)
+    woken = []
+
+    async def wait(name, delay):
+        await scheduler.wait(delay)
+        woken.append((name, clock()))
+
+    async def main():
+        await asyncio.gather(wait("a", 0.12), wait("b", 0.15), wait("c", 0.18))
+
+    asyncio.run(main())
+    assert woken == [("a", 0.12), ("b", 0.22), ("c", 0.22)] # b和c离a不到一帧，在下一帧一起醒来
+    assert scheduler.ticks == 2
+
+def test_earlier_deadline_restarts_driver():
+    clock, scheduler = make_scheduler(frame_time=0)
+    woken = []
+
+    async def wait(name, delay):
+        await scheduler.wait(delay)
+        woken.append((name, clock()))
+
+    async def main():
+        late = asyncio.create_task(wait("late", 1.0))
+        await asyncio.sleep(0) # 驱动循环已经开始等待1.0
+        await asyncio.gather(late, wait("early", 0.25))
+
+    asyncio.run(main())
+    assert woken == [("early", 0.25), ("late", 1.0)]
+
+def test_waiter_timeline_does_not_drift():
+    clock, scheduler = make_scheduler(frame_time=0.1)
+    waiter = Waiter(scheduler=scheduler)
+    times = []
+
+    async def main():
+        for _ in range(10):
+            assert await waiter(0.03)
+            times.append(clock())
+
+    asyncio.run(main())
+    # 每帧最多醒来一次，但按时间线计时，已经过了的等待立即完成，10个0.03秒一共只比0.3秒多不到一帧
+    assert [round(t, 6) for t in times] == [0.03, 0.13, 0.13, 0.13, 0.23, 0.23, 0.23, 0.33, 0.33, 0.33]
+    assert scheduler.ticks == 4
+
+async def sentinel(scheduler, delay, log):
+    await scheduler.wait(delay)
+    log.append("sentinel")
+
+def test_waiter_interrupt():
+    clock, scheduler = make_scheduler(frame_time=0)
+    waiter = Waiter(scheduler=scheduler)
+    log = []
+
+    async def typewriter():
+        for _ in range(10):
+            ok = await waiter(1.0)
+            log.append(ok)
+            if not ok:
+                return
+
+    async def interrupt_later():
+        await scheduler.wait(1.5)
+        waiter.interrupt()
+
+    async def main():
+        await asyncio.gather(typewriter(), interrupt_later(), sentinel(scheduler, 1.8, log))
+
+    asyncio.run(main())
+    # 中断时立即结束等待，不等到2.0（FakeClock在醒来的协程运行前就会拨到下一个唤醒时间，所以比较先后而不是时刻）
+    assert log == [True, False, "sentinel"]
+    assert waiter.interrupted and waiter.pending is None
+    assert scheduler.pending == 0
+    assert asyncio.run(waiter(1.0)) is False
+
+def test_waiter_skip():
+    clock, scheduler = make_scheduler(frame_time=0)
+    waiter = Waiter(scheduler=scheduler)
+    log = []
+
+    async def typewriter():
+        for _ in range(5):
+            log.append(await waiter(1.0))
+
+    async def skip_later():
+        await scheduler.wait(1.5)
+        waiter.skip()
+
+    async def main():
+        await asyncio.gather(typewriter(), skip_later(), sentinel(scheduler, 1.8, log))
+
+    asyncio.run(main())
+    assert log == [True] * 5 + ["sentinel"] # 跳过后剩下的部分立即显示
+    assert waiter.instant and not waiter.interrupted
+
+def test_waiters_share_scheduler():
+    clock, scheduler = make_scheduler(frame_time=0)
+    manager = AnimationManager(scheduler=scheduler)
+    waiters = [manager.new_waiter(), manager.new_waiter(instant=True)]
+    assert all(w.scheduler is scheduler for w in waiters)
+    assert waiters[1].instant
+
+    async def main():
+        return await asyncio.gather(waiters[0](0.5), waiters[1](0.5), scheduler.wait(0.2))
+
+    assert asyncio.run(main()) == [True, True, True]
+    assert clock() == 0.5
+
+def test_animation_manager_runs_wrappers():
+    clock, scheduler = make_scheduler(frame_time=0)
+    manager = AnimationManager(scheduler=scheduler)
+    log = []
+
+    async def typewriter(name, tick, n, waiter):
+        for i in range(n):
+            log.append((round(clock(), 3), name, i))
+            await waiter(tick)
+
+    async def main():
+        anims = [
+            AnimationWrapper(task=typewriter(name, tick, 3, manager.new_waiter()))
+            for name, tick in (("a", 0.1), ("b", 0.25))
+        ]
+        ids = [manager.add_animation(anim) for anim in anims]
+        assert ids == [0, 1] and manager.next_id == 2
+        assert manager.pool == dict(zip(ids, anims))
+        tasks = [manager.start_animation(anim_id) for anim_id in ids]
+        await anims[0].finished_event.wait()
+        assert anims[0].finished
+        await asyncio.gather(*tasks)
+        return anims
+
+    anims = asyncio.run(main())
+    assert all(anim.finished and anim.ongoing and anim.finished_event.is_set() for anim in anims)
+    assert manager.pool == {}
+    assert log == [
+        (0, "a", 0), (0, "b", 0),
+        (0.1, "a", 1), (0.2, "a", 2),
+        (0.25, "b", 1), (0.5, "b", 2),
+    ]
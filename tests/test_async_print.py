@@ -0,0 +1,159 @@
+import asyncio
+
+import attr
+
+from mika_animation import AnimationScheduler, FakeClock, Waiter
+from mika_screen import GameScreen
+from styleml.core import CharacterToken, Token
+from utilities import Vector2D
+
+class RecordingScreen(GameScreen):
+    "记录每个字符打印的时刻和flush的次数"
+    def __attrs_post_init__(self):
+        self.clock = None
+        self.log = []
+        self.flushes = 0
+        super().__attrs_post_init__()
+
+    def print_cell(self, pos, cell):
+        super().print_cell(pos, cell)
+        self.log.append((self.clock(), cell.ch))
+
+    def flush(self):
+        self.flushes += 1
+
+@attr.s
+class RecordingWaiter(Waiter):
+    "记录每次等待的(时间, token)，等待stop_at时返回False"
+    calls = attr.ib(factory=list)
+    stop_at = attr.ib(default=())
+
+    async def __call__(self, time, t=None):
+        self.calls.append((round(time, 6), t))
+        if any(t is s for s in self.stop_at):
+            return False
+        return await super().__call__(time, t)
+
+def setup(**kwargs):
+    clock = FakeClock()
+    scheduler = AnimationScheduler(clock=clock, sleep=clock.sleep, frame_time=0)
+    screen = RecordingScreen(dim=Vector2D(20, 2))
+    screen.clock = clock
+    return clock, scheduler, screen, RecordingWaiter(scheduler=scheduler, **kwargs)
+
+def chars(s, delay, y=0):
+    return [CharacterToken(ch, {"pos": Vector2D(x, y), "post_delay": delay}) for x, ch in enumerate(s)]
+
+def call(delay=0.5):
+    "有延迟的非字符token，如句间调用"
+    return Token("call", {"post_delay": delay})
+
+def test_skip_in_the_middle_of_a_slice():
+    clock, scheduler, screen, waiter = setup()
+    tokens = chars("abcdefghij", 1.0)
+
+    async def skip_later():
+        await scheduler.wait(2.5)
+        waiter.skip()
+
+    async def sentinel():
+        await scheduler.wait(2.8)
+        screen.log.append((clock(), "sentinel"))
+
+    async def main():
+        result = asyncio.gather(screen.async_print_tokens(iter(tokens), Vector2D(0, 0), waiter=waiter, start_from=2), skip_later(), sentinel())
+        return (await result)[0]
+
+    assert asyncio.run(main()) is None
+    # 跳过后剩下的字符立即打印（FakeClock会先拨到下一个唤醒时间，所以和sentinel比较先后）
+    assert [ch for _, ch in screen.log] == list("cdefghij") + ["sentinel"]
+    assert [t for _, t in waiter.calls] == tokens[2:5] # 跳过之后字符不再交给waiter
+    times = [time for time, _ in screen.log[:-1]]
+    assert times[:3] == [0, 1.0, 2.0] and len(set(times[3:])) == 1 # 剩下的在同一时刻打印
+    assert screen.flushes == 1
+
+def test_instant_hands_delayed_non_characters_to_waiter():
+    clock, scheduler, screen, waiter = setup(instant=True)
+    first, second = call(), call()
+    tokens = chars("ab", 1.0) + [first] + chars("cd", 1.0, 1) + [second] + chars("ef", 1.0, 1)
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter)) is None
+    assert waiter.calls == [(0.5, first), (0.5, second)]
+    assert [ch for _, ch in screen.log] == list("abcdef")
+    assert screen.flushes == 1 and clock() == 0
+
+def test_instant_returns_index_when_waiter_stops():
+    clock, scheduler, screen, waiter = setup(instant=True)
+    first, second = call(), call()
+    waiter.stop_at = (second,)
+    tokens = chars("ab", 1.0) + [first] + chars("cd", 1.0, 1) + [second] + chars("ef", 1.0, 1)
+    # start_from之后的下标，和不跳过时相同
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, start_from=1)) == 4
+    assert [ch for _, ch in screen.log] == list("bcd")
+    assert screen.flushes == 1
+
+def print_times(screen):
+    return [(round(time, 6), ch) for time, ch in screen.log]
+
+def test_frame_time_batches_characters():
+    clock, scheduler, screen, waiter = setup()
+    tokens = chars("abcdefghij", 0.03)
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, frame_time=0.1)) is None
+    # 累积满一帧（4个字符0.12秒）才等待一次，剩下的延迟最后等待，总时长不变
+    assert [(time, t) for time, t in waiter.calls] == [(0.12, tokens[3]), (0.12, tokens[7]), (0.06, None)]
+    assert print_times(screen) == [(0, c) for c in "abcd"] + [(0.12, c) for c in "efgh"] + [(0.24, c) for c in "ij"]
+    assert round(clock(), 6) == 0.3
+
+def test_frame_time_flushes_pending_before_non_characters():
+    clock, scheduler, screen, waiter = setup()
+    stcall = call(0.5)
+    tokens = chars("ab", 0.03) + [stcall] + chars("c", 0.03, 1)
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, frame_time=0.1)) is None
+    # 句间调用等之前的字符按时显示之后才处理
+    assert waiter.calls == [(0.06, None), (0.5, stcall), (0.03, None)]
+    assert print_times(screen) == [(0, "a"), (0, "b"), (0.56, "c")]
+    assert round(clock(), 6) == 0.59
+
+def test_frame_time_returns_index_on_interrupt():
+    clock, scheduler, screen, waiter = setup()
+    stcall = call(0.5)
+    tokens = chars("ab", 0.03) + [stcall] + chars("cd", 0.03, 1)
+    waiter.stop_at = (None,) # 累积的延迟被中断
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, frame_time=0.1)) == 2
+    assert waiter.calls == [(0.06, None)]
+    waiter.calls.clear()
+    waiter.stop_at = ()
+
+    async def interrupt_later():
+        await scheduler.wait(0.56 + 0.01)
+        waiter.interrupt()
+
+    async def main():
+        screen.log.clear()
+        result = await asyncio.gather(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, frame_time=0.1), interrupt_later())
+        return result[0]
+
+    # 最后剩下的延迟等待时被中断，返回最后一个token的下标
+    assert asyncio.run(main()) == 4
+    assert waiter.calls[-1] == (0.06, None)
+    assert [ch for _, ch in screen.log] == list("abcd")
+
+def test_inter_sentence_waiter_with_frame_time():
+    from mika_regional_dialogue import InterSentenceCallToken, InterSentenceWaiter
+    clock = FakeClock()
+    scheduler = AnimationScheduler(clock=clock, sleep=clock.sleep, frame_time=0)
+    screen = RecordingScreen(dim=Vector2D(20, 2))
+    screen.clock = clock
+    called = []
+
+    async def caller(sentence_name, instant=False, macros=None):
+        called.append((round(clock(), 6), sentence_name, instant, macros))
+
+    waiter = InterSentenceWaiter(scheduler=scheduler, async_inter_sentence_caller=caller, base_sentence_name="home.hall")
+    stcall = InterSentenceCallToken({"is_sync": True, "target": ".door"}, {"post_delay": -1, "macros": {"x": 1}})
+    tokens = chars("ab", 0.03) + [stcall] + chars("cd", 0.03, 1)
+    assert asyncio.run(screen.async_print_tokens(tokens, Vector2D(0, 0), waiter=waiter, frame_time=0.1)) is None
+    assert called == [(0.06, "home.hall.door", False, {"x": 1})]
+    assert print_times(screen) == [(0, "a"), (0, "b"), (0.06, "c"), (0.06, "d")]
+    assert round(clock(), 6) == 0.12
+    assert asyncio.run(waiter(0.1, None)) is True # t为None时只是等待
+    assert len(called) == 1
@@ -0,0 +1,73 @@
+# fused的transform/render和逐阶段处理的结果相同，用所有demo句子检查
+import contextlib
+import io
+
+import pytest
+
+import styleml.core
+import styleml.macro_ext
+import styleml.portal_ext
+import styleml_glyph_exts
+import styleml_mika_exts
+import mika_golden
+from mika_regional_dialogue import ModularMacroProxy, InterSentenceCallExtParser
+
+def make_parser(macros, fused):
+    return styleml.core.StyleMLCoreParser(fused=fused, ext_parser=[
+        styleml.macro_ext.MacroExtParser(initial_macros=macros),
+        InterSentenceCallExtParser(),
+        styleml.portal_ext.PortalExtParser(),
+        styleml_glyph_exts.GlyphsetExtParser(),
+        styleml_mika_exts.AnimationExtParser(initial_tick=0.03),
+        styleml_mika_exts.StyleExtParser(),
+        styleml.core.ReturnCharExtParser()
+    ])
+
+@pytest.fixture(scope="module")
+def runner():
+    with contextlib.redirect_stdout(io.StringIO()): # 读取yaml时会打印解析结果
+        runner = mika_golden.HeadlessRunner.from_resources()
+        runner.sentences = dict(runner.sentences)
+    return runner
+
+def outcome(f):
+    try:
+        return f()
+    except Exception as e:
+        return type(e)
+
+def test_fused_matches_unfused_on_demo_sentences(runner):
+    assert len(runner.sentences) > 50
+    for name, sentence in runner.sentences.items():
+        for choice in (None, 0, 1):
+            macros = ModularMacroProxy(global_macros=runner.predefined_macros.fork(), base_module=name)
+            macros[".choice"] = choice
+            macros[".returned"] = False
+            tokens = sentence.content_tokens
+            expected = outcome(lambda: make_parser(macros, False).transform_and_render(tokens))
+            fused = outcome(lambda: make_parser(macros, True).transform_and_render(tokens))
+            streamed = outcome(lambda: list(make_parser(macros, False).stream_transform_and_render(tokens)))
+            assert fused == expected, (name, choice)
+            assert streamed == expected, (name, choice)
+            if isinstance(expected, list):
+                assert all(type(a) is type(b) for a, b in zip(fused, expected))
+
+def test_pending_tokens_do_not_leak():
+    parser = make_parser({}, True)
+    tokens = parser.tokenize(r"{\s[fg=red]ab}\n\g[x]c\delay[:1]d")
+    rendered = parser.transform_and_render(tokens)
+    assert {type(t) for t in rendered if t.printable} == {styleml.core.CharacterToken}
+    assert rendered == make_parser({}, False).transform_and_render(tokens)
+    # 输入的token没有被修改
+    assert all(t.meta == {} for t in tokens if isinstance(t, styleml.core.CharacterToken))
+
+def test_retaining_extension_disables_in_place_meta():
+    class Doubler(styleml.core.StyleMLExtParser):
+        "保存并重复产生收到的token，不能就地修改"
+        def stream_transformer(self, tokens):
+            for t in tokens:
+                yield t
+                yield t
+    parser = styleml.core.StyleMLCoreParser(fused=True, ext_parser=[Doubler(), styleml_mika_exts.StyleExtParser()])
+    rendered = parser.transform_and_render(parser.tokenize("ab"))
+    assert [t.meta["pos"].x for t in rendered] == [0, 1, 2, 3]
@@ -0,0 +1,35 @@
+import json
+import os
+
+from mika_golden import HeadlessRunner, check_paths
+from mika_screen import GameScreen
+from utilities import Vector2D
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+def test_scripted_paths_match_golden():
+    with open(os.path.join(GOLDEN_DIR, "paths.json"), encoding="utf-8") as f:
+        paths = json.load(f)
+    assert check_paths(HeadlessRunner.from_resources(), paths, GOLDEN_DIR) == []
+
+def test_golden_runner_is_repeatable():
+    "共享编译缓存的第二个runner播放同一条路径，画面不变"
+    runner = HeadlessRunner.from_resources()
+    first = runner.play_scripted([1, 1, 0, 2, None])
+    assert runner.play_scripted([1, 1, 0, 2, None]) == first
+
+class RecordingScreen(GameScreen):
+    def __attrs_post_init__(self):
+        self.printed = []
+        super().__attrs_post_init__()
+
+    def print_cell(self, pos, cell):
+        self.printed.append((pos, cell))
+        super().print_cell(pos, cell)
+
+def test_clear_rectangle_goes_through_print_cell():
+    screen = RecordingScreen(dim=Vector2D(4, 3))
+    screen.printed.clear()
+    screen.clear_rectangle(Vector2D(1, 1), Vector2D(3, 3))
+    assert len(screen.printed) == 4
+    assert set(screen.printed) == {(Vector2D(x, y), None) for x in (1, 2) for y in (1, 2)}
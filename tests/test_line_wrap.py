@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from styleml.core import CharacterToken, Token
+from styleml_mika_exts import LineWrapExtParser, RowLayout
+from utilities import Vector2D
+import legacy_line_wrap
+
+CHARS = "ab'. 中"
+
+def random_tokens(rnd, monotone):
+    "monotone为True时token从上往下输出（流式换行和一次换行结果相同的前提）"
+    tokens = []
+    y = 0
+    for _ in range(rnd.randint(0, 30)):
+        if monotone:
+            y += rnd.random() < 0.2
+        else:
+            y = rnd.randint(0, 4)
+        x = rnd.randint(0, 12)
+        if rnd.random() < 0.8:
+            tokens.append(CharacterToken(rnd.choice(CHARS), {"pos": Vector2D(x, y)}))
+        else:
+            tokens.append(Token(None, {"pos": Vector2D(x, y)}))
+    return tokens
+
+def edited(rnd, tokens, monotone):
+    "改变、截断或延长tokens的尾部，像选项标记改变时那样"
+    n = rnd.randint(0, len(tokens))
+    tail = random_tokens(rnd, monotone)
+    if monotone and tokens[:n]:
+        y = tokens[n - 1].meta["pos"].y
+        tail = [t.with_meta({"pos": Vector2D(t.meta["pos"].x, t.meta["pos"].y + y)}) for t in tail]
+    return tokens[:n] + tail
+
+def norm(tokens):
+    return [(type(t), t.value, t.meta["pos"]) for t in tokens]
+
+def wrap(tokens, area, only_printable, word_wrap, streaming=False, layout=None):
+    parser = LineWrapExtParser(area, only_printable=only_printable, word_wrap=word_wrap, streaming=streaming, layout=layout)
+    return norm(parser.stream_post_renderer(iter(tokens))), parser.get_layout()
+
+@pytest.mark.parametrize("word_wrap", [False, True])
+def test_random_layouts_agree(word_wrap):
+    rnd = random.Random(16)
+    for _ in range(2000):
+        area = Vector2D(rnd.choice([0, 1, 3, 5, 8]), rnd.choice([0, 2, 4, 10]))
+        only_printable = rnd.random() < 0.5
+        monotone = rnd.random() < 0.5
+        tokens = random_tokens(rnd, monotone)
+        fresh, _ = wrap(tokens, area, only_printable, word_wrap)
+        if not word_wrap:
+            try:
+                legacy = norm(legacy_line_wrap.LineWrapExtParser(area, only_printable).post_renderer(tokens))
+            except KeyError: # 旧版的已知问题：只有不可打印token的行没有行号
+                legacy = None
+            if legacy is not None:
+                assert fresh == legacy
+        # 复用另一句（尾部不同）的layout
+        _, layout = wrap(edited(rnd, tokens, monotone), area, only_printable, word_wrap)
+        reused, layout = wrap(tokens, area, only_printable, word_wrap, layout=layout)
+        assert reused == fresh
+        if monotone:
+            assert wrap(tokens, area, only_printable, word_wrap, streaming=True)[0] == fresh
+            _, layout = wrap(edited(rnd, tokens, monotone), area, only_printable, word_wrap, streaming=True, layout=layout)
+            assert wrap(tokens, area, only_printable, word_wrap, streaming=True, layout=layout)[0] == fresh
+
+def text_tokens(s):
+    tokens, x, y = [], 0, 0
+    for ch in s:
+        if ch == "\n":
+            x, y = 0, y + 1
+            continue
+        tokens.append(CharacterToken(ch, {"pos": Vector2D(x, y)}))
+        x += 1
+    return tokens
+
+def grid(s, columns):
+    rows = {}
+    for _, ch, pos in wrap(text_tokens(s), Vector2D(columns, 0), False, True)[0]:
+        row = rows.setdefault(pos.y, [" "] * columns)
+        row[pos.x] = ch
+    return ["".join(rows.get(y, [])).rstrip() for y in range(max(rows) + 1)]
+
+def test_word_wrap_output():
+    assert grid("hello world foo", 8) == ["hello", "world", "foo"]
+    assert grid("ab中文字hello there", 6) == ["ab中文字", "hello", "there"] # 中文照常断开
+    assert grid("hello, world", 7) == ["hello,", "world"]
+    assert grid("abc\nhello world", 8) == ["abc", "hello", "world"]
+    assert grid("abcdefghij", 4) == ["abcd", "efgh", "ij"] # 比一行还长的单词照常断开
+
+def test_word_wrap_keeps_short_words_whole():
+    rnd = random.Random(0)
+    for _ in range(300):
+        columns = rnd.randint(2, 9)
+        words = ["".join(rnd.choice("abc") for _ in range(rnd.randint(1, columns))) for _ in range(rnd.randint(1, 8))]
+        s = " ".join(words)
+        wrapped = wrap(text_tokens(s), Vector2D(columns, 0), False, True)[0]
+        rows = {}
+        for _, ch, pos in wrapped:
+            rows.setdefault(pos.y, {})[pos.x] = ch
+        lines = ["".join(rows[y].get(x, " ") for x in range(columns)) for y in sorted(rows)]
+        assert [w for line in lines for w in line.split()] == words
+
+def test_reused_layout_recomputes_only_the_tail():
+    layout = RowLayout(columns=5)
+    parser = LineWrapExtParser(Vector2D(5, 0), only_printable=False, layout=layout)
+    first = parser.post_renderer(text_tokens("abcdefgh\nxyz"))
+    pushed = []
+    push = layout._push
+    layout._push = lambda *args: (pushed.append(args), push(*args))
+    second = parser.post_renderer(text_tokens("abcdefgh\nxyzw"))
+    assert parser.get_layout() is layout
+    assert pushed == [(3, 1, 1)] # 只放入了新的w
+    assert norm(second)[:-1] == norm(first)
+    pushed.clear()
+    third = parser.post_renderer(text_tokens("abcdefgh\nx"))
+    assert pushed == [] and norm(third) == norm(first)[:-2]
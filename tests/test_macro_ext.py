@@ -0,0 +1,42 @@
+from styleml.core import StyleMLCoreParser
+from styleml.macro_ext import MacroExtParser, MacroScope
+from mika_macro_store import MacroStore
+from mika_regional_dialogue import ModularMacroProxy
+
+def text_of(tokens):
+    return "".join(t.value for t in tokens)
+
+def expand(text, initial_macros):
+    return MacroExtParser().expand_and_get_dependencies(StyleMLCoreParser.tokenize(text), initial_macros)
+
+def test_dependencies_from_dict():
+    expanded, macros, reads = expand(r"\!greeting \ifelse[a!mood,b=happy,then=!,else=.]", {"greeting": "hi", "unused": "x"})
+    assert text_of(expanded) == "hi."
+    assert reads == {"greeting": "hi", "mood": MacroScope.missing}
+
+def test_dependencies_ignore_macros_defined_while_expanding():
+    expanded, macros, reads = expand(r"\def[greeting=hello]\!greeting ", {"greeting": "hi"})
+    assert text_of(expanded) == "hello"
+    assert reads == {}
+
+def test_dependencies_from_macro_store():
+    expanded, macros, reads = expand(r"\!a.greeting ", MacroStore({"a.greeting": "hi"}))
+    assert text_of(expanded) == "hi"
+    assert reads == {"a.greeting": "hi"}
+
+def test_dependencies_through_modular_proxy():
+    global_macros = MacroStore({"home.greeting": "hi", "home.name": "mika"})
+    proxy = ModularMacroProxy(global_macros=global_macros, base_module="home")
+    proxy[".choice"] = 1
+    expanded, macros, reads = expand(r"\def[.seen=yes]\!.greeting \ifelse[a!.choice,b;1,then=\\!.name ]\ifelse[a!.missing,b?,then=?]", proxy)
+    assert text_of(expanded) == "himika?"
+    assert reads == {
+        "home.greeting": "hi",
+        "home.choice": 1,
+        "home.name": "mika",
+        "home.missing": MacroScope.missing
+    }
+    # 展开时定义的宏只进入返回的宏环境，原来的proxy不受影响
+    assert macros.global_macros is global_macros
+    assert macros[".seen"] == "yes"
+    assert ".seen" not in proxy
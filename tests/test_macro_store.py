@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from mika_macro_store import MacroStore
+
+NAMES = ["a", "b", "a.x", "a.y", "a.b.x", "a.b.y", "a.b.c.x", "b.x", "c.d.e"]
+MODULES = ["", "a", "a.b", "a.b.c", "b", "c", "c.d", "z"]
+
+def under(module, key):
+    return not module or key.startswith(module + ".")
+
+def check(store, model):
+    assert dict(store.items()) == model
+    assert len(store) == len(model)
+    for name in NAMES:
+        assert (name in store) == (name in model)
+        assert store.get(name) == model.get(name)
+    for module in MODULES:
+        assert store.macros_under(module) == {k: v for k, v in model.items() if under(module, k)}
+
+def test_fork_isolation():
+    store = MacroStore({"start_sentence": "home.start", "home.visited": True, "home.bedroom.light": False})
+    saved = store.fork()
+    store["home.bedroom.light"] = True
+    store["town.gold"] = 10
+    assert saved.macros_under("home") == {"home.visited": True, "home.bedroom.light": False}
+    assert "town.gold" not in saved
+    saved["home.visited"] = False
+    assert store["home.visited"] is True
+
+def test_version_under():
+    store = MacroStore({"a.x": 1, "a.b.x": 2, "c.x": 3})
+    versions = {m: store.version_under(m) for m in MODULES}
+    assert store.version_under("z") == 0
+    store["a.b.y"] = 4
+    changed = {m for m in MODULES if store.version_under(m) != versions[m]}
+    assert changed == {"", "a", "a.b"}
+    versions = {m: store.version_under(m) for m in MODULES}
+    store["a.b.y"] = store["a.b.y"] # 写入同一个对象，内容没有改变
+    assert {m: store.version_under(m) for m in MODULES} == versions
+    del store["c.x"]
+    assert store.version_under("c") == 0 # 没有宏的模块被删掉了
+    assert store.version_under("") != versions[""]
+    assert store.version_under("a") == versions["a"]
+
+def test_delete_prunes_empty_modules():
+    store = MacroStore({"a.b.c.x": 1, "a.y": 2})
+    del store["a.b.c.x"]
+    assert store._find(["a", "b"]) is None
+    assert store._find(["a"]).size == 1
+    del store["a.y"]
+    assert store._root.children == {} and len(store) == 0
+    with pytest.raises(KeyError):
+        del store["a.y"]
+    with pytest.raises(TypeError):
+        store[1] = 1
+
+def test_fuzz_against_dicts():
+    rnd = random.Random(0)
+    for _ in range(80):
+        stores = [MacroStore()]
+        models = [{}]
+        for _ in range(60):
+            i = rnd.randrange(len(stores))
+            store, model = stores[i], models[i]
+            op = rnd.random()
+            if op < 0.1:
+                stores.append(store.fork())
+                models.append(dict(model))
+            elif op < 0.7:
+                name, value = rnd.choice(NAMES), rnd.randrange(3)
+                before = {m: store.version_under(m) for m in MODULES}
+                store[name] = value
+                changed = model.get(name, object()) != value
+                model[name] = value
+                for m in MODULES:
+                    # 只要该模块下的内容改变了，version就改变；整数是缓存的对象，值相同时就是同一个对象
+                    assert (store.version_under(m) != before[m]) == (changed and under(m, name))
+            else:
+                name = rnd.choice(NAMES)
+                if name in model:
+                    before = {m: store.version_under(m) for m in MODULES}
+                    del store[name]
+                    del model[name]
+                    for m in MODULES:
+                        assert (store.version_under(m) != before[m]) == under(m, name)
+                else:
+                    with pytest.raises(KeyError):
+                        del store[name]
+            for store, model in zip(stores, models):
+                check(store, model)
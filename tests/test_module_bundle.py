@@ -0,0 +1,100 @@
+import os
+import pickle
+import shutil
+import sys
+import zlib
+
+import pytest
+
+import mika_modules
+import mika_module_bundle
+from mika_sentence_pool import LazySentencePool
+
+ROOT = "./resources/modules"
+
+def test_committed_bundle_is_up_to_date():
+    "改了resources/modules之后需要重新运行generate_module_bundle.py"
+    with open("./modules_bundle.bin", "rb") as f:
+        data = f.read()
+    sources = mika_module_bundle.sources_digest(ROOT, mika_modules.walk_modules(ROOT))
+    assert mika_module_bundle.read_bundle(data, sources)
+
+@pytest.fixture
+def module_copy(tmp_path):
+    "resources/modules的副本和它的打包文件"
+    root = tmp_path / "modules"
+    shutil.copytree(ROOT, root)
+    bundle = tmp_path / "modules_bundle.bin"
+    bundle.write_bytes(mika_module_bundle.compile_bundle(str(root), mika_modules.walk_modules(str(root))))
+    return str(root), str(bundle)
+
+def uses_bundle(pool):
+    return all(isinstance(v, bytes) for v in pool.modules.values())
+
+def test_fresh_bundle_is_used(module_copy):
+    root, bundle = module_copy
+    pool = LazySentencePool.from_bundle_or_module_files(bundle, root)
+    assert uses_bundle(pool)
+    assert dict(pool) == dict(LazySentencePool.from_module_files(root, mika_modules.walk_modules(root)))
+
+def test_stale_bundle_falls_back_to_module_files(module_copy):
+    root, bundle = module_copy
+    file_name = os.path.join(root, "home_neighbor", "home.yaml")
+    with open(file_name, encoding="utf-8") as f:
+        content = f.read()
+    with open(file_name, "w", encoding="utf-8") as f:
+        f.write(content.replace("这是家里的走廊", "这是刚改过的走廊"))
+    with pytest.raises(ValueError):
+        LazySentencePool.from_bundle(bundle, mika_module_bundle.sources_digest(root, mika_modules.walk_modules(root)))
+    pool = LazySentencePool.from_bundle_or_module_files(bundle, root)
+    assert not uses_bundle(pool)
+    text = "".join(t.value for t in pool["home_neighbor.home.corridor"].content_tokens if isinstance(t.value, str))
+    assert "这是刚改过的走廊" in text
+
+class Renamed:
+    "pickle之后被删掉，模拟句子池中的类改名或移动"
+
+def rewrite_payload(bundle, payload, monkeypatch):
+    "保留文件头（仍然和源文件一致），换掉压缩的pickle"
+    with open(bundle, "rb") as f:
+        header = f.read()[:mika_module_bundle._header_size]
+    with open(bundle, "wb") as f:
+        f.write(header + zlib.compress(pickle.dumps(payload)))
+    monkeypatch.delattr(sys.modules[__name__], "Renamed")
+
+def test_header_is_checked_before_unpickling(module_copy):
+    root, bundle = module_copy
+    with open(bundle, "rb") as f:
+        data = f.read()
+    version, sources = mika_module_bundle.read_header(data)
+    assert version == mika_module_bundle.BUNDLE_VERSION
+    assert sources == mika_module_bundle.sources_digest(root, mika_modules.walk_modules(root))
+    header_size = mika_module_bundle._header_size
+    with pytest.raises(ValueError, match="out of date"):
+        mika_module_bundle.read_bundle(data[:header_size] + b"garbage", "0" * 64)
+    old_version = data[:8] + (version - 1).to_bytes(4, "little") + data[12:header_size] + b"garbage"
+    with pytest.raises(ValueError, match="version"):
+        mika_module_bundle.read_bundle(old_version)
+    with pytest.raises(ValueError, match="not a module bundle"):
+        mika_module_bundle.read_bundle(zlib.compress(pickle.dumps({"version": version})))
+
+def test_code_change_makes_bundle_stale(module_copy, monkeypatch):
+    root, bundle = module_copy
+    monkeypatch.setattr(mika_module_bundle, "code_modules", mika_module_bundle.code_modules + (mika_module_bundle,))
+    assert not uses_bundle(LazySentencePool.from_bundle_or_module_files(bundle, root))
+
+def test_unpickling_error_falls_back_to_module_files(module_copy, monkeypatch):
+    root, bundle = module_copy
+    rewrite_payload(bundle, {"modules": {}, "foreign": Renamed()}, monkeypatch)
+    with pytest.raises(AttributeError):
+        LazySentencePool.from_bundle(bundle)
+    pool = LazySentencePool.from_bundle_or_module_files(bundle, root)
+    assert not uses_bundle(pool)
+    assert "home_neighbor.home.corridor" in pool
+
+def test_module_unpickling_error_loads_module_file(module_copy, monkeypatch):
+    root, bundle = module_copy
+    rewrite_payload(bundle, {"modules": {"home_neighbor.home": pickle.dumps(Renamed())}, "foreign": {}}, monkeypatch)
+    pool = LazySentencePool.from_bundle_or_module_files(bundle, root)
+    assert uses_bundle(pool)
+    assert "home_neighbor.home.corridor" in pool
@@ -0,0 +1,82 @@
+import styleml.macro_ext
+import mika_golden
+from mika_regional_dialogue import InterSentenceCallToken, RegionalDialogueManager, ScreenRegion, Sentence
+from utilities import Vector2D
+
+TEXT_A = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu"
+TEXT_B = "a b c d e f g h i j k l m n o p q r s t u v w x y z " * 2
+
+def make_manager(text, word_wrap=True):
+    return RegionalDialogueManager(
+        sentences={"s": Sentence(content_tokens="\\!text", region_conv="=r")},
+        screen_regions={"r": ScreenRegion(size=Vector2D(10, 8), word_wrap=word_wrap)},
+        macros={"text": text},
+        macro_parser=styleml.macro_ext.MacroExtParser(),
+        postmacro_parser=mika_golden.make_postmacro_parser(),
+        current_sentence_name="s"
+    )
+
+def expected_tokens(text, word_wrap):
+    return list(make_manager(text, word_wrap).eval_sentence())
+
+def test_interleaved_streams_do_not_share_row_layout():
+    for word_wrap in (False, True):
+        manager = make_manager(TEXT_A, word_wrap)
+        a = manager.stream_sentence(0)
+        first = [next(a), next(a)]
+        manager.macros["text"] = TEXT_B
+        b = manager.stream_sentence(1)
+        tokens_a, tokens_b = first, []
+        for x, y in zip(a, b):
+            tokens_a.append(x)
+            tokens_b.append(y)
+        tokens_a.extend(a)
+        tokens_b.extend(b)
+        assert tokens_a == expected_tokens(TEXT_A, word_wrap)
+        assert tokens_b == expected_tokens(TEXT_B, word_wrap)
+        assert ("s", Vector2D(10, 8)) in manager.row_layouts
+
+def test_abandoned_stream_keeps_layout_out_of_cache():
+    manager = make_manager(TEXT_A)
+    manager.eval_sentence()
+    layout = manager.row_layouts["s", Vector2D(10, 8)]
+    stream = manager.stream_sentence(1)
+    next(stream)
+    assert ("s", Vector2D(10, 8)) not in manager.row_layouts
+    del stream
+    manager.macros["text"] = TEXT_B
+    assert manager.eval_sentence(2) == expected_tokens(TEXT_B, True)
+    assert manager.row_layouts["s", Vector2D(10, 8)] is not layout
+
+def make_styled_manager(color):
+    return RegionalDialogueManager(
+        sentences={"s": Sentence(content_tokens="\\def[.seen=yes]\\s[fg!color]hello\\stcall[=t]", region_conv="=r")},
+        screen_regions={"r": ScreenRegion(size=Vector2D(10, 8))},
+        macros={"color": color},
+        macro_parser=styleml.macro_ext.MacroExtParser(),
+        postmacro_parser=mika_golden.make_postmacro_parser(),
+        current_sentence_name="s"
+    )
+
+def without_macros(tokens):
+    return [(type(t), t.value, {k: v for k, v in t.meta.items() if k != "macros"}) for t in tokens]
+
+def test_stream_reads_macros_from_its_start():
+    expected = make_styled_manager("red").eval_sentence()
+    assert expected[0].meta["style"].fg == "red"
+    manager = make_styled_manager("red")
+    stream = manager.stream_sentence()
+    assert manager.macros["s.seen"] == "yes" # 暂存的宏在开始时就写入了全局宏
+    manager.macros["color"] = "blue"
+    tokens = []
+    for t in stream:
+        if isinstance(t, InterSentenceCallToken): # 句间调用的宏环境也是开始时的
+            assert t.meta["macros"]["color"] == "red"
+        tokens.append(t)
+    assert without_macros(tokens) == without_macros(expected)
+    assert manager.sentence_dependencies("s") == {"color"}
+    # 迭代完之后，缓存的tokens和eval_sentence的一样引用全局宏
+    calls = [t for t in tokens if isinstance(t, InterSentenceCallToken)]
+    assert len(calls) == 1 and calls[0].meta["macros"].global_macros is manager.macros
+    # 读到的宏已经改变，不使用缓存
+    assert [t.meta["style"].fg for t in manager.stream_sentence() if not isinstance(t, InterSentenceCallToken)] == ["blue"] * 5
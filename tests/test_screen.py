@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from mika_screen import GameScreen, ScreenCell, ScreenCellBuffer, CellPalette
+from styleml_glyph_exts import CustomGlyph
+from utilities import Vector2D
+
+FLAGS = ("hlit", "bold", "emph", "undl", "midl", "topl")
+DIM = Vector2D(7, 5)
+
+def random_cell(rnd):
+    if rnd.random() < 0.2:
+        return None
+    return ScreenCell(
+        rnd.choice(["a", "b", None, CustomGlyph("c_hz", "-ab")]), # 每次都是新的CustomGlyph
+        fg=rnd.choice(["white", "red"]),
+        bg=rnd.choice(["black", "blue"]),
+        **{name: rnd.random() < 0.5 for name in FLAGS}
+    )
+
+def random_rectangle(rnd):
+    xs = sorted(rnd.randrange(DIM.x + 1) for _ in range(2))
+    ys = sorted(rnd.randrange(DIM.y + 1) for _ in range(2))
+    return Vector2D(xs[0], ys[0]), Vector2D(xs[1], ys[1])
+
+@pytest.mark.parametrize("palette_limit", [ScreenCellBuffer.min_palette_limit, 3])
+def test_buffer_matches_list2d(monkeypatch, palette_limit):
+    monkeypatch.setattr(ScreenCellBuffer, "min_palette_limit", palette_limit)
+    rnd = random.Random(5)
+    for _ in range(60):
+        expected = GameScreen(dim=DIM)
+        actual = GameScreen(dim=DIM, buffer_type=ScreenCellBuffer)
+        for _ in range(30):
+            op = rnd.random()
+            pos0, pos1 = random_rectangle(rnd)
+            if op < 0.3:
+                pos, cell = Vector2D(rnd.randrange(DIM.x), rnd.randrange(DIM.y)), random_cell(rnd)
+                expected.print_cell(pos, cell)
+                actual.print_cell(pos, cell)
+            elif op < 0.6:
+                style = {name: rnd.random() < 0.5 for name in rnd.sample(FLAGS, 2)}
+                if rnd.random() < 0.5:
+                    style["fg"] = rnd.choice(["green", "white"])
+                expected.paint_rectangle(pos0, pos1, style)
+                actual.paint_rectangle(pos0, pos1, style)
+            elif op < 0.7:
+                expected.clear_rectangle(pos0, pos1)
+                actual.clear_rectangle(pos0, pos1)
+            else:
+                # 从另一个值表不同的缓冲区复制
+                src = ScreenCellBuffer(DIM)
+                for y in range(DIM.y):
+                    for x in range(DIM.x):
+                        src[Vector2D(x, y)] = random_cell(rnd)
+                dst = Vector2D(rnd.randrange(DIM.x - (pos1.x - pos0.x) + 1), rnd.randrange(DIM.y - (pos1.y - pos0.y) + 1))
+                for y in range(pos0.y, pos1.y):
+                    for x in range(pos0.x, pos1.x):
+                        expected.map[dst + Vector2D(x - pos0.x, y - pos0.y)] = src[Vector2D(x, y)]
+                actual.map.blit(src, pos0, pos1, dst)
+            assert list(actual.map) == list(expected.map)
+        assert list(actual.map.copy()) == list(expected.map)
+
+def test_palette_is_per_buffer_and_bounded():
+    a, b = ScreenCellBuffer(DIM), ScreenCellBuffer(DIM)
+    for i in range(5000):
+        a[Vector2D(i % DIM.x, 0)] = ScreenCell(CustomGlyph("c_hz", str(i)))
+    assert len(a.palette.values) <= a.palette_limit + 3
+    assert len(a.palette.values) < 5000
+    assert len(b.palette.values) == 3 # 只有默认的字符和颜色
+    assert [a[Vector2D(x, 0)].ch.value for x in range(DIM.x)] == [str(max(range(x, 5000, DIM.x))) for x in range(DIM.x)]
+
+def test_unhashable_values_are_keyed_by_identity():
+    palette = CellPalette()
+    g1, g2 = CustomGlyph("c_hz", "-ab"), CustomGlyph("c_hz", "-ab")
+    assert palette.encode(g1) == palette.encode(g1)
+    assert palette.encode(g1) != palette.encode(g2)
+    assert palette.values[palette.encode(g2)] is g2
+    assert palette.encode("a") == palette.encode("a")
+    assert palette.encode(1) != palette.encode(True)
@@ -0,0 +1,68 @@
+import mika_modules
+import mika_module_bundle
+from mika_sentence_pool import LazySentencePool
+
+HOME = """
+hall:
+  !para
+  c: hall
+  door:
+    !para
+    _t: [alias]
+    alias: town.gate
+    c: door
+"""
+
+TOWN = """
+square:
+  !para
+  c: square
+"""
+
+def write_modules(tmp_path):
+    root = tmp_path / "modules"
+    root.mkdir()
+    (root / "home.yaml").write_text(HOME, encoding="utf-8")
+    (root / "town.yaml").write_text(TOWN, encoding="utf-8")
+    return str(root)
+
+def bundle_pool(tmp_path):
+    root = write_modules(tmp_path)
+    bundle = tmp_path / "modules_bundle.bin"
+    bundle.write_bytes(mika_module_bundle.compile_bundle(root, mika_modules.walk_modules(root)))
+    return LazySentencePool.from_bundle(str(bundle))
+
+def test_lookup_loads_only_the_owning_module():
+    pool = LazySentencePool.from_module_files("./resources/modules")
+    assert "home_neighbor.home.corridor" in pool
+    assert set(pool.module_sentences) == {"home_neighbor.home"}
+
+def test_module_files_default_to_walking_root(tmp_path, monkeypatch):
+    root = write_modules(tmp_path)
+    monkeypatch.chdir(tmp_path) # 不依赖当前目录下的walk_modules.json
+    pool = LazySentencePool.from_module_files(root)
+    assert pool.modules == {"home": "home.yaml", "town": "town.yaml"}
+    assert pool["town.square"].content_tokens
+
+def test_foreign_sentence_from_module_files(tmp_path):
+    pool = LazySentencePool.from_module_files(write_modules(tmp_path))
+    assert pool["town.square"]
+    assert set(pool.module_sentences) == {"town"}
+    # town中没有town.gate，没有索引时读取所有模块建立索引
+    assert pool["town.gate"].next_conv == "=home.hall.door"
+    assert pool.foreign_sentences == {"town.gate": "home"}
+    assert "town.nowhere" not in pool
+
+def test_bundle_miss_does_not_load_other_modules(tmp_path):
+    pool = bundle_pool(tmp_path)
+    assert "town.nowhere" not in pool
+    assert "nowhere.at.all" not in pool
+    assert set(pool.module_sentences) == {"town"}
+
+def test_foreign_sentence_from_bundle(tmp_path):
+    pool = bundle_pool(tmp_path)
+    assert pool.foreign_sentences == {"town.gate": "home"}
+    assert pool["town.gate"].next_conv == "=home.hall.door"
+    assert set(pool.module_sentences) == {"home"}
+    assert "town.nowhere" not in pool
+    assert set(pool.module_sentences) == {"home", "town"}
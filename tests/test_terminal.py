@@ -0,0 +1,91 @@
+import asyncio
+import io
+
+from mika_screen import CellStyle, ScreenCell
+from mika_terminal import TerminalGameScreen, handle_input_line, style_sgr
+from utilities import Vector2D
+
+RED = CellStyle.intern(fg="red")
+
+def make_screen(**kwargs):
+    "第一帧（整个空白画面）已经输出，out中只有之后的输出"
+    out = io.StringIO()
+    scr = TerminalGameScreen(dim=Vector2D(8, 3), out=out, **kwargs)
+    scr.flush()
+    out.seek(0)
+    out.truncate()
+    return scr, out
+
+def test_unchanged_cells_emit_nothing():
+    scr, out = make_screen()
+    scr.print_cell(Vector2D(1, 1), None) # 和显示的一样
+    scr.flush()
+    assert out.getvalue() == ""
+    scr.print_cell(Vector2D(1, 1), ScreenCell.intern("a", RED))
+    scr.flush()
+    out.seek(0)
+    out.truncate()
+    scr.print_cell(Vector2D(1, 1), ScreenCell.intern("a", RED))
+    scr.flush()
+    assert out.getvalue() == ""
+
+def test_adjacent_cells_share_cursor_move_and_sgr():
+    scr, out = make_screen()
+    for x, ch in enumerate("abc", 2):
+        scr.print_cell(Vector2D(x, 1), ScreenCell.intern(ch, RED))
+    scr.flush()
+    assert out.getvalue() == "\x1b[2;5H" + style_sgr(RED) + "a b c "
+
+def test_non_adjacent_cell_moves_cursor():
+    scr, out = make_screen()
+    scr.print_cell(Vector2D(0, 0), ScreenCell.intern("a", RED))
+    scr.print_cell(Vector2D(1, 0), ScreenCell.intern("字", RED))
+    scr.print_cell(Vector2D(5, 2), ScreenCell.intern("b", RED))
+    scr.print_cell(Vector2D(6, 2), ScreenCell.intern("c"))
+    scr.flush()
+    assert out.getvalue() == (
+        "\x1b[1;1H" + style_sgr(RED) + "a 字"
+        + "\x1b[3;11H" + "b " + style_sgr(CellStyle.intern()) + "c "
+    )
+    # 光标和风格在两帧之间保留
+    out.seek(0)
+    out.truncate()
+    scr.print_cell(Vector2D(7, 2), ScreenCell.intern("d"))
+    scr.flush()
+    assert out.getvalue() == "d "
+
+def test_frames_are_limited_by_max_fps():
+    now = [10.0]
+    scr, out = make_screen(max_fps=20, clock=lambda: now[0])
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        scr.print_cell(Vector2D(0, 0), ScreenCell.intern("a"))
+        first = scr.flush_handle
+        scr.print_cell(Vector2D(1, 0), ScreenCell.intern("b"))
+        assert scr.flush_handle is first # 同一帧内只安排一次刷新
+        assert abs(first.when() - loop.time() - 0.05) < 0.01 # 上一帧在now，下一帧要等1/max_fps
+        frames = scr.frames
+        await asyncio.sleep(0.07)
+        assert scr.frames == frames + 1 and scr.flush_handle is None
+        assert out.getvalue().count("\x1b[1;1H") == 1
+        now[0] += 1 # 距离上一帧已经超过1/max_fps，立即刷新
+        scr.print_cell(Vector2D(2, 0), ScreenCell.intern("c"))
+        assert scr.flush_handle.when() <= loop.time()
+        await asyncio.sleep(0.01)
+        assert scr.frames == frames + 2
+
+    asyncio.run(main())
+
+def test_handle_input_line():
+    assert handle_input_line("\n", None, 3) == (True, None)
+    assert handle_input_line("\n", 2, 3) == (True, 2)
+    assert handle_input_line("x\n", 1, 3) == (True, 1)
+    assert handle_input_line("2\n", None, 3) == (False, 1)
+    assert handle_input_line("9\n", 1, 3) == (False, 1) # 没有这个选项
+    # 和网页版的方向键相同：第一次按下选中第一个，之后循环移动
+    assert handle_input_line("\x1b[A\n", None, 3) == (False, 0)
+    assert handle_input_line("\x1b[A\n", 0, 3) == (False, 2)
+    assert handle_input_line("\x1b[B\x1b[B\x1b[B\n", None, 3) == (False, 2)
+    assert handle_input_line("\x1bOB\n", 2, 3) == (False, 0)
+    assert handle_input_line("\x1b[B\n", None, None) == (False, None)
@@ -0,0 +1,113 @@
+# tokenize和改写前的实现（legacy_tokenizer）的差分测试，以及大输入上的速度对比
+# 直接运行时只打印大输入上的速度：python tests/test_tokenize.py
+
+import os
+import random
+import sys
+import timeit
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+sys.path[:0] = [TESTS, ROOT]
+import legacy_tokenizer
+from styleml.core import StyleMLCoreParser
+
+SPECIAL = "\\[]{}@# \n\r"
+
+CASES = [
+    "",
+    "plain text",
+    "  leading spaces\n   and more",
+    "   ",
+    "\n\n\n",
+    "a\\\nb",
+    "line\\\n  continued\\\n",
+    "@  keep leading spaces",
+    "a@b@c",
+    "  @@x",
+    "text # comment\nnext",
+    "#only comment",
+    "\\# not a comment \\@ not a start",
+    "\\\\ \\[ \\] \\{ \\} \\@ \\#",
+    "\\s[fg=red]{colored} text",
+    "\\cmd",
+    "\\cmd ",
+    "\\cmd  two spaces",
+    "\\cmd[",
+    "\\cmd[unterminated",
+    "\\cmd[arg]",
+    "\\cmd[a\\]b]tail",
+    "\\cmd[a\\\\]b]",
+    "\\a\\b\\c[x]\\d",
+    "\\\n",
+    "\\",
+    "{{}}}{",
+    "\\def[hl=\\\\s\\[fg=gold\\]]\\\n\\tick[:0.1]Behold\\delay[:0.5], here I am!",
+    "中文\\s[bg=gray]文字 # 注释\n  @ 行首",
+    "a\rb\r\n\\x\r",
+]
+
+def resource_texts():
+    "resources中所有的文本文件"
+    texts = []
+    for root, dirs, files in os.walk(os.path.join(ROOT, "resources")):
+        for name in sorted(files):
+            with open(os.path.join(root, name), encoding="utf-8") as f:
+                texts.append(f.read())
+    return texts
+
+def random_texts(seed, count, max_length=16):
+    rnd = random.Random(seed)
+    alphabet = list(SPECIAL) + list("ab中")
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, max_length))) for _ in range(count)]
+
+def outcome(tokenize, text, inline_mode):
+    try:
+        return tokenize(text, inline_mode)
+    except Exception as e: # 两者对不合法的输入也应该抛出相同的异常
+        return type(e)
+
+def assert_same(text, inline_mode):
+    expected = outcome(legacy_tokenizer.tokenize, text, inline_mode)
+    actual = outcome(StyleMLCoreParser.tokenize, text, inline_mode)
+    assert actual == expected, (text, inline_mode)
+
+@pytest.mark.parametrize("inline_mode", [False, True])
+@pytest.mark.parametrize("text", CASES)
+def test_cases(text, inline_mode):
+    assert_same(text, inline_mode)
+
+@pytest.mark.parametrize("inline_mode", [False, True])
+def test_random_texts(inline_mode):
+    for text in random_texts(0, 20000):
+        assert_same(text, inline_mode)
+
+@pytest.mark.parametrize("inline_mode", [False, True])
+def test_resources(inline_mode):
+    for text in resource_texts():
+        assert_same(text, inline_mode)
+        for line in text.splitlines():
+            assert_same(line, inline_mode)
+
+def large_text():
+    return "\n".join(resource_texts()) * 48 # 约22万字符
+
+def benchmark(text, number=3):
+    "返回(改写前, 现在)的tokenize用时"
+    return tuple(
+        min(timeit.repeat(lambda: tokenize(text), number=number, repeat=3)) / number
+        for tokenize in (legacy_tokenizer.tokenize, StyleMLCoreParser.tokenize)
+    )
+
+def test_large_input_not_slower():
+    text = large_text()
+    assert StyleMLCoreParser.tokenize(text) == legacy_tokenizer.tokenize(text)
+    legacy, current = benchmark(text, number=1)
+    assert current < legacy
+
+if __name__ == "__main__":
+    text = large_text()
+    legacy, current = benchmark(text)
+    print(f"{len(text)} characters: legacy {legacy * 1000:.1f}ms, current {current * 1000:.1f}ms")
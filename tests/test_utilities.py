@@ -0,0 +1,34 @@
+import pickle
+
+import pytest
+
+from utilities import Vector2D
+
+def test_vector_equality_matches_attrs_class():
+    assert Vector2D(1, 0) == Vector2D(1, 0)
+    assert Vector2D(1, 0) != Vector2D(0, 1)
+    assert Vector2D(1, 0) != (1, 0)
+    assert (1, 0) != Vector2D(1, 0)
+    assert not Vector2D(1, 0) == (1, 0)
+    assert Vector2D(1, 0) != [1, 0]
+    assert {Vector2D(1, 0): "a"}.get((1, 0)) is None
+    assert {Vector2D(1, 0): "a"}[Vector2D(1, 0)] == "a"
+
+@pytest.mark.parametrize("other", [Vector2D(2, 0), (2, 0)])
+def test_vectors_are_unordered(other):
+    with pytest.raises(TypeError):
+        Vector2D(1, 0) < other
+    with pytest.raises(TypeError):
+        other >= Vector2D(1, 0)
+
+def test_vector_operations():
+    v = Vector2D(3, 4)
+    assert v + Vector2D(1, 1) == Vector2D(4, 5)
+    assert v - Vector2D(1, 1) == Vector2D(2, 3)
+    assert 2 * v == v * 2 == Vector2D(6, 8)
+    assert -v == Vector2D(-3, -4)
+    assert v.length == 5
+    assert v.affine_transform(Vector2D(0, 1), Vector2D(1, 0), Vector2D(10, 0)) == Vector2D(14, 3)
+    assert type(v + Vector2D(1, 1)) is Vector2D
+    assert pickle.loads(pickle.dumps(v)) == v
+    assert repr(v) == "Vector2D(x=3, y=4)"
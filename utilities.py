@@ -1,4 +1,5 @@
 from itertools import zip_longest
+from operator import itemgetter
 
 import attr
 
@@ -8,65 +9,125 @@ def grouper(iterable, n, fillvalue=None):
     args = [iter(iterable)] * n
     return zip_longest(*args, fillvalue=fillvalue)
 
-@attr.s(order=False, frozen=True)
-class Vector2D:
+_tuple_new = tuple.__new__
+_tuple_eq = tuple.__eq__
+
+class Vector2D(tuple):
+    """
+    不可变的二维向量，直接继承tuple：创建和hash都在C层完成，也不需要每个实例的__dict__
+    运算符全部重写，不会退化成tuple的拼接/重复
+    比较和原来的attrs类相同：只和同类型的向量相等（Vector2D(1, 0) != (1, 0)），也不能比较大小
+    没有缓存常用的小向量：向量大多由运算得到，不经过__new__，而在__new__中查缓存会让未命中时的创建慢约三分之一
+    常用的方向可以用Cardinal中的常量
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, x, y):
+        return _tuple_new(cls, (x, y))
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            # 返回NotImplemented的话，tuple会用自己的比较，和同样内容的tuple相等
+            return False if isinstance(other, tuple) else NotImplemented
+        return _tuple_eq(self, other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = tuple.__hash__
+
+    def _unorderable(self, other):
+        # 直接抛出异常，否则和tuple比较时会用tuple的比较
+        raise TypeError(f"vectors are unordered: {type(self).__name__} and {type(other).__name__}")
+
+    __lt__ = __le__ = __gt__ = __ge__ = _unorderable
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(x={self[0]!r}, y={self[1]!r})"
 
-    x = attr.ib()
-    y = attr.ib()
-    
     @property
     def length_sq(self):
-        return (self.x**2 + self.y**2)
+        x, y = self
+        return x * x + y * y
 
     @property
     def length(self):
-        return (self.x**2 + self.y**2) ** 0.5
+        return self.length_sq ** 0.5
 
     @property
     def manhattan(self):
-        return abs(self.x) + abs(self.y)
+        x, y = self
+        return abs(x) + abs(y)
 
     @property
     def tuple(self):
-        return (self.x, self.y)
+        return (self[0], self[1])
 
     def __neg__(self):
-        return type(self)(-self.x, -self.y)
+        x, y = self
+        return _tuple_new(type(self), (-x, -y))
 
     def __add__(self, other):
-        return type(self)(self.x + other.x, self.y + other.y)
+        x, y = self
+        ox, oy = other
+        return _tuple_new(type(self), (x + ox, y + oy))
 
     def __sub__(self, other):
-        return self + (-other)
+        x, y = self
+        ox, oy = other
+        return _tuple_new(type(self), (x - ox, y - oy))
 
     def __mul__(self, other):
-        return type(self)(self.x * other, self.y * other)
+        x, y = self
+        return _tuple_new(type(self), (x * other, y * other))
 
     __rmul__ = __mul__
 
     def dot_product(self, other):
-        return self.x * other.x + self.y * other.y
+        x, y = self
+        ox, oy = other
+        return x * ox + y * oy
 
     def is_perpendicular_to(self, other):
         return self.dot_product(other) == 0
 
     def cross_product(self, other):
-        return self.x * other.y - self.y * other.x
+        x, y = self
+        ox, oy = other
+        return x * oy - y * ox
 
     def is_parallel_to(self, other):
         return self.cross_product(other) == 0
 
-    def __iter__(self):
-        yield from self.tuple
-
     def apply_matrix(self, mati, matj):
-        return self.x * mati + self.y * matj
+        x, y = self
+        ix, iy = mati
+        jx, jy = matj
+        return _tuple_new(type(self), (x * ix + y * jx, x * iy + y * jy))
 
     def affine_transform(self, mati, matj, translation):
-        return self.apply_matrix(mati, matj) + translation
-
-    def affine_transform_with_origin(self, origin, *args, **kwargs):
-        return (self - origin).affine_transform(*args, **kwargs) + origin
+        x, y = self
+        ix, iy = mati
+        jx, jy = matj
+        tx, ty = translation
+        return _tuple_new(type(self), (x * ix + y * jx + tx, x * iy + y * jy + ty))
+
+    def affine_transform_with_origin(self, origin, mati, matj, translation):
+        x, y = self
+        ox, oy = origin
+        x, y = x - ox, y - oy
+        ix, iy = mati
+        jx, jy = matj
+        tx, ty = translation
+        return _tuple_new(type(self), (x * ix + y * jx + tx + ox, x * iy + y * jy + ty + oy))
 
 class Cardinal:
     NORTH = UP = FORWARD = Vector2D(0, -1)